@@ -0,0 +1,49 @@
+import argparse
+import sys
+
+from hydraplay.server.HealthProbe import JsonRpcProbe
+from hydraplay.server.HydraServer import HydraServer
+from hydraplay.server.SnapCastService import SnapCastService
+
+
+class BenchmarkServer(HydraServer):
+    """
+    HydraServer which runs the fake Mopidy instances and the fake snapserver of the
+    benchmark as its child processes instead of the real ones. Everything between the
+    browser and the upstreams is the production code.
+    """
+
+    def __init__(self, configFile, event_rate, notification_rate):
+        super().__init__(configFile, stall_threshold=0)
+        self.event_rate = event_rate
+        self.notification_rate = notification_rate
+
+    async def start_services(self):
+        self.listen()
+        self.loop_monitor.start()
+
+        pool = self.mopidy_sercice
+        for instance in range(self.config.mopidy.instances):
+            command = [sys.executable, '-m', 'hydraplay.benchmark.FakeMopidy',
+                       '--port', str(pool.get_web_port(instance)), '--event-rate', str(self.event_rate)]
+            self.supervisor.spawn(pool.get_label(instance), command, probe=pool.get_probe(instance))
+
+        command = [sys.executable, '-m', 'hydraplay.benchmark.FakeSnapserver',
+                   '--notification-rate', str(self.notification_rate)]
+        self.supervisor.spawn(SnapCastService.LABEL, command,
+                              probe=JsonRpcProbe("http://127.0.0.1:1780/jsonrpc", "Server.GetRPCVersion"))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="hydraplay-benchmark-server")
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--event-rate", type=float, default=10)
+    parser.add_argument("--notification-rate", type=float, default=5)
+    args = parser.parse_args()
+
+    server = BenchmarkServer(args.config, args.event_rate, args.notification_rate)
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
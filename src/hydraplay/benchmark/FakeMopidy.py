@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import json
+import time
+
+import tornado.ioloop
+import tornado.web
+from tornado import websocket
+
+
+class FakeMopidyState:
+    """
+    Answers the JSON-RPC calls of the player with canned results and sends events
+    at a fixed rate. Every event carries the monotonic time it was sent at, so the
+    benchmark can measure the relay latency of the proxy.
+    """
+
+    results = {
+        'core.get_version': '3.4.2',
+        'core.playback.get_state': 'playing',
+        'core.playback.get_time_position': 1000,
+        'core.playback.get_current_tl_track': None,
+        'core.tracklist.get_tl_tracks': [],
+        'core.mixer.get_volume': 50,
+        'core.mixer.get_mute': False,
+    }
+
+    def __init__(self, event_rate):
+        self.event_rate = event_rate
+        self.sockets = set()
+
+    def answer(self, request):
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': self.results.get(request.get('method'))}
+
+    async def send_events(self):
+        if not self.event_rate:
+            return
+        interval = 1.0 / self.event_rate
+        position = 0
+        while True:
+            await asyncio.sleep(interval)
+            position += int(interval * 1000)
+            message = json.dumps({'event': 'seeked', 'time_position': position, 'sent_at': time.monotonic()})
+            for socket in list(self.sockets):
+                try:
+                    socket.write_message(message)
+                except websocket.WebSocketClosedError:
+                    self.sockets.discard(socket)
+
+
+class FakeMopidySocket(websocket.WebSocketHandler):
+
+    def initialize(self, state):
+        self.state = state
+
+    def open(self):
+        self.state.sockets.add(self)
+
+    def on_message(self, message):
+        self.write_message(json.dumps(self.state.answer(json.loads(message))))
+
+    def on_close(self):
+        self.state.sockets.discard(self)
+
+
+class FakeMopidyRpc(tornado.web.RequestHandler):
+
+    def initialize(self, state):
+        self.state = state
+
+    def post(self):
+        self.write(json.dumps(self.state.answer(json.loads(self.request.body))))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="fake-mopidy")
+    parser.add_argument("--port", type=int, default=6680)
+    parser.add_argument("--event-rate", type=float, default=10, help="events per second sent to every client")
+    args = parser.parse_args()
+
+    state = FakeMopidyState(args.event_rate)
+    tornado.web.Application([
+        (r"/mopidy/ws", FakeMopidySocket, {"state": state}),
+        (r"/mopidy/rpc", FakeMopidyRpc, {"state": state}),
+    ]).listen(args.port, address="127.0.0.1")
+
+    ioloop = tornado.ioloop.IOLoop.current()
+    ioloop.spawn_callback(state.send_events)
+    ioloop.start()
+
+
+if __name__ == "__main__":
+    main()
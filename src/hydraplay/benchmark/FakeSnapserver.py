@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import struct
+import time
+
+import tornado.ioloop
+import tornado.web
+from tornado import websocket
+
+from hydraplay.server.AudioRelay import SNAPCAST_WIRE_CHUNK
+
+
+class FakeSnapserverState:
+    """
+    Stands in for snapserver on port 1780: JSON-RPC control with notifications at a
+    fixed rate and a binary audio stream of WireChunks in real time.
+
+    The sent time field of the snapcast message header carries the monotonic time,
+    the benchmark reads it back to measure the relay latency.
+    """
+
+    # 48 kHz, 16 bit, stereo
+    BYTES_PER_SECOND = 48000 * 2 * 2
+    CHUNK_DURATION = 0.02
+
+    def __init__(self, notification_rate):
+        self.notification_rate = notification_rate
+        self.control_sockets = set()
+        self.stream_sockets = set()
+        self.server = {
+            'groups': [{'id': 'group-1', 'muted': False, 'name': '', 'stream_id': 'MOPIDY-0',
+                        'clients': [{'id': 'client-1', 'connected': True,
+                                     'config': {'volume': {'muted': False, 'percent': 50},
+                                                'latency': 0, 'name': ''}}]}],
+            'streams': [{'id': 'MOPIDY-0', 'status': 'playing', 'properties': {}}],
+            'server': {'snapserver': {'version': '0.26.0'}}
+        }
+
+    def answer(self, request):
+        method = request.get('method')
+        if method == 'Server.GetStatus':
+            result = {'server': self.server}
+        elif method == 'Server.GetRPCVersion':
+            result = {'major': 2, 'minor': 0, 'patch': 0}
+        else:
+            result = {}
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    async def send_notifications(self):
+        if not self.notification_rate:
+            return
+        interval = 1.0 / self.notification_rate
+        while True:
+            await asyncio.sleep(interval)
+            message = json.dumps({'jsonrpc': '2.0', 'method': 'Stream.OnProperties',
+                                  'params': {'id': 'MOPIDY-0', 'properties': {}, 'sent_at': time.monotonic()}})
+            self.write_all(self.control_sockets, message, False)
+
+    async def send_audio(self):
+        size = int(self.BYTES_PER_SECOND * self.CHUNK_DURATION)
+        payload = bytes(size)
+        started = time.monotonic()
+        sent = 0
+        while True:
+            sent += 1
+            # sleep until the chunk is due, the stream does not drift under load
+            await asyncio.sleep(max(0.0, started + sent * self.CHUNK_DURATION - time.monotonic()))
+            now = time.monotonic()
+            seconds, microseconds = int(now), int((now % 1) * 1000000)
+            body = struct.pack("<iiI", seconds, microseconds, size) + payload
+            header = struct.pack("<HHHiiiiI", SNAPCAST_WIRE_CHUNK, 0, 0, seconds, microseconds, 0, 0, len(body))
+            self.write_all(self.stream_sockets, header + body, True)
+
+    def write_all(self, sockets, message, binary):
+        for socket in list(sockets):
+            try:
+                socket.write_message(message, binary)
+            except websocket.WebSocketClosedError:
+                sockets.discard(socket)
+
+
+class FakeControlSocket(websocket.WebSocketHandler):
+
+    def initialize(self, state):
+        self.state = state
+
+    def open(self):
+        self.state.control_sockets.add(self)
+
+    def on_message(self, message):
+        self.write_message(json.dumps(self.state.answer(json.loads(message))))
+
+    def on_close(self):
+        self.state.control_sockets.discard(self)
+
+    def post(self):
+        # snapserver answers JSON-RPC over plain HTTP on the same path
+        self.write(json.dumps(self.state.answer(json.loads(self.request.body))))
+
+
+class FakeStreamSocket(websocket.WebSocketHandler):
+
+    def initialize(self, state):
+        self.state = state
+
+    def open(self):
+        self.state.stream_sockets.add(self)
+
+    def on_message(self, message):
+        # Hello and time sync of the browser client, nothing to answer for the benchmark
+        pass
+
+    def on_close(self):
+        self.state.stream_sockets.discard(self)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="fake-snapserver")
+    parser.add_argument("--port", type=int, default=1780)
+    parser.add_argument("--notification-rate", type=float, default=5,
+                        help="control notifications per second sent to every client")
+    args = parser.parse_args()
+
+    state = FakeSnapserverState(args.notification_rate)
+    tornado.web.Application([
+        (r"/jsonrpc", FakeControlSocket, {"state": state}),
+        (r"/stream", FakeStreamSocket, {"state": state}),
+    ]).listen(args.port, address="127.0.0.1")
+
+    ioloop = tornado.ioloop.IOLoop.current()
+    ioloop.spawn_callback(state.send_notifications)
+    ioloop.spawn_callback(state.send_audio)
+    ioloop.start()
+
+
+if __name__ == "__main__":
+    main()
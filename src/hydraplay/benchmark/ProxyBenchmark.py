@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from tornado import websocket
+from tornado.httpclient import AsyncHTTPClient
+
+from hydraplay.server.AudioRelay import is_wire_chunk
+from hydraplay.server.Executor import Executor
+from hydraplay.version import __version__
+
+
+def percentiles(samples):
+    if not samples:
+        return {'p50': None, 'p99': None, 'max': None}
+    samples = sorted(samples)
+    return {
+        'p50': round(samples[len(samples) // 2], 3),
+        'p99': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+        'max': round(samples[-1], 3)
+    }
+
+
+class RouteResult:
+    """
+    Messages and latencies of all simulated clients of one route type.
+    """
+
+    def __init__(self):
+        self.clients = 0
+        self.messages = 0
+        self.bytes = 0
+        self.relay_latencies = []
+        self.request_latencies = []
+        self.errors = 0
+
+    def to_dict(self, duration):
+        return {
+            'clients': self.clients,
+            'messages': self.messages,
+            'messages_per_second': round(self.messages / duration, 1),
+            'bytes_per_second': round(self.bytes / duration),
+            'relay_latency_ms': percentiles(self.relay_latencies),
+            'request_latency_ms': percentiles(self.request_latencies),
+            'errors': self.errors
+        }
+
+
+class SimulatedClient:
+    """
+    One websocket of a browser. Records the latency of upstream messages, which carry
+    the monotonic time they were sent at, and of its own requests.
+    """
+
+    def __init__(self, url, route, result, request=None, request_interval=1.0):
+        self.url = url
+        self.route = route
+        self.result = result
+        self.request = request
+        self.request_interval = request_interval
+        self.connection = None
+        self.measuring = False
+        self.sent = {}
+        self.last_id = 0
+
+    async def connect(self):
+        self.connection = await websocket.websocket_connect(self.url)
+        self.result.clients += 1
+
+    async def run(self):
+        if self.request is not None:
+            asyncio.ensure_future(self.send_requests())
+        connection = self.connection
+        while True:
+            message = await connection.read_message()
+            if message is None:
+                if self.measuring:
+                    self.result.errors += 1
+                return
+            received = time.monotonic()
+            if not self.measuring:
+                continue
+            self.result.messages += 1
+            self.result.bytes += len(message)
+            if isinstance(message, bytes):
+                self.record_chunk(message, received)
+            else:
+                self.record_message(message, received)
+
+    def record_chunk(self, chunk, received):
+        if is_wire_chunk(chunk) and len(chunk) >= 14:
+            seconds, microseconds = struct.unpack_from("<ii", chunk, 6)
+            self.result.relay_latencies.append((received - seconds - microseconds / 1000000) * 1000)
+
+    def record_message(self, message, received):
+        data = json.loads(message)
+        sent_at = data.get('sent_at') or (data.get('params') or {}).get('sent_at')
+        if sent_at is not None:
+            self.result.relay_latencies.append((received - sent_at) * 1000)
+        elif data.get('id') in self.sent:
+            self.result.request_latencies.append((received - self.sent.pop(data['id'])) * 1000)
+
+    async def send_requests(self):
+        while self.connection is not None:
+            await asyncio.sleep(self.request_interval)
+            self.last_id += 1
+            self.sent[self.last_id] = time.monotonic()
+            try:
+                await self.connection.write_message(json.dumps(dict(self.request, id=self.last_id)))
+            except websocket.WebSocketClosedError:
+                return
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class ProxyBenchmark:
+    """
+    Starts a HydraServer with fake upstreams in a child process, connects the simulated
+    browsers and reports throughput, latencies and resource usage of the server.
+    """
+
+    START_TIMEOUT = 30
+
+    def __init__(self, args):
+        self.logger = logging.getLogger(__name__)
+        self.args = args
+        self.results = {'mopidy': RouteResult(), 'control': RouteResult(), 'stream': RouteResult()}
+        self.clients = []
+        self.server = None
+        self.work_dir = None
+
+    def write_config(self):
+        source = Path(__file__).resolve().parent.parent / "config" / "hydra.config.json"
+        with open(source) as file:
+            config = json.load(file)
+        config['hydraplay']['port'] = self.args.port
+        config['hydraplay']['workers'] = self.args.workers
+        config['mopidy']['instances'] = self.args.instances
+        config['mopidy']['web_base_port'] = self.args.mopidy_base_port
+        config['mopidy']['config_path'] = self.work_dir + "/"
+        config['snapcast_server']['config_path'] = self.work_dir + "/"
+        config_file = os.path.join(self.work_dir, "hydra.config.json")
+        with open(config_file, "w") as file:
+            json.dump(config, file)
+        return config_file
+
+    async def start_server(self):
+        command = [sys.executable, '-m', 'hydraplay.benchmark.BenchmarkServer', '--config', self.write_config(),
+                   '--event-rate', str(self.args.event_rate),
+                   '--notification-rate', str(self.args.notification_rate)]
+        self.server = Executor("Benchmark Server", command)
+        self.server.start()
+
+        # the audio route does not wait for its upstream, start once every fake answers its probe
+        deadline = time.monotonic() + self.START_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+            try:
+                response = await AsyncHTTPClient().fetch("http://127.0.0.1:{0}/api/processes".format(self.args.port))
+            except Exception:
+                continue
+            processes = json.loads(response.body)['processes']
+            expected = self.args.instances + 1 + (self.args.workers if self.args.workers > 1 else 0)
+            if len(processes) == expected and all(process['startup_time'] for process in processes):
+                return
+        raise RuntimeError("benchmark server did not start within {0} seconds".format(self.START_TIMEOUT))
+
+    def server_usage(self):
+        """(rss, cpu seconds) of the server and its worker processes, the fakes are not counted."""
+        usage = self.server.resource_usage()
+        if usage is None:
+            return None
+        rss, cpu = usage
+        try:
+            with open("/proc/{0}/task/{0}/children".format(self.server.pid)) as file:
+                children = file.read().split()
+        except OSError:
+            children = []
+        for pid in children:
+            try:
+                with open("/proc/{0}/cmdline".format(pid), "rb") as file:
+                    if b"HydraWorker" not in file.read():
+                        continue
+            except OSError:
+                continue
+            child = Executor.read_usage(pid)
+            if child is not None:
+                rss += child[0]
+                cpu += child[1]
+        return rss, cpu
+
+    def create_clients(self):
+        base = "ws://127.0.0.1:{0}/socket/".format(self.args.port)
+        for number in range(self.args.clients):
+            # every browser tab of the player has one Mopidy and one Snapcast control connection
+            self.clients.append(SimulatedClient(base + "stream/{0}".format(number % self.args.instances),
+                                                'mopidy', self.results['mopidy'],
+                                                {'jsonrpc': '2.0', 'method': 'core.playback.get_state'}))
+            self.clients.append(SimulatedClient(base + "control/jsonrpc", 'control', self.results['control'],
+                                                {'jsonrpc': '2.0', 'method': 'Server.GetStatus'}))
+        for number in range(self.args.audio_clients):
+            self.clients.append(SimulatedClient(base + "control/stream", 'stream', self.results['stream']))
+
+    async def run(self):
+        self.work_dir = tempfile.mkdtemp(prefix="hydraplay-benchmark-")
+        try:
+            await self.start_server()
+            self.create_clients()
+            for client in self.clients:
+                await client.connect()
+                asyncio.ensure_future(client.run())
+
+            await asyncio.sleep(self.args.warmup)
+            usage_before = self.server_usage()
+            started = time.monotonic()
+            for client in self.clients:
+                client.measuring = True
+
+            rss_max = 0
+            while time.monotonic() - started < self.args.duration:
+                await asyncio.sleep(0.5)
+                usage = self.server_usage()
+                if usage is not None:
+                    rss_max = max(rss_max, usage[0])
+
+            for client in self.clients:
+                client.measuring = False
+            duration = time.monotonic() - started
+            usage_after = self.server_usage()
+            return self.report(duration, usage_before, usage_after, rss_max)
+        finally:
+            for client in self.clients:
+                client.close()
+            if self.server is not None:
+                self.server.stop()
+                await self.server.wait()
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def report(self, duration, usage_before, usage_after, rss_max):
+        routes = {route: result.to_dict(duration) for route, result in self.results.items() if result.clients}
+        messages = sum(result.messages for result in self.results.values())
+        server = {'cpu_percent': None, 'rss_bytes': None, 'rss_max_bytes': rss_max or None}
+        if usage_before is not None and usage_after is not None:
+            server['cpu_percent'] = round((usage_after[1] - usage_before[1]) / duration * 100, 1)
+            server['rss_bytes'] = usage_after[0]
+
+        return {
+            'hydraplay_version': __version__,
+            'timestamp': time.time(),
+            'parameters': {
+                'clients': self.args.clients,
+                'audio_clients': self.args.audio_clients,
+                'instances': self.args.instances,
+                'workers': self.args.workers,
+                'duration': self.args.duration,
+                'event_rate': self.args.event_rate,
+                'notification_rate': self.args.notification_rate
+            },
+            'duration': round(duration, 3),
+            'messages': messages,
+            'messages_per_second': round(messages / duration, 1),
+            'routes': routes,
+            'server': server
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m hydraplay.benchmark",
+                                     description="Benchmarks the websocket proxy of HydraPlay against fake "
+                                                 "Mopidy and Snapserver upstreams. Port 1780 must be free.")
+    parser.add_argument("--clients", type=int, default=10, help="simulated player browsers")
+    parser.add_argument("--audio-clients", type=int, default=2, help="simulated Snapweb audio clients")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of the server")
+    parser.add_argument("--instances", type=int, default=2, help="fake Mopidy instances")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds before measuring starts")
+    parser.add_argument("--event-rate", type=float, default=10, help="Mopidy events per second")
+    parser.add_argument("--notification-rate", type=float, default=5, help="Snapcast notifications per second")
+    parser.add_argument("--port", type=int, default=18080, help="port of the benchmarked server")
+    parser.add_argument("--mopidy-base-port", type=int, default=16680, help="port of the first fake Mopidy")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(ProxyBenchmark(args).run())
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=4)
+    else:
+        print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+from hydraplay.benchmark.ProxyBenchmark import main
+
+main()
@@ -1,27 +1,480 @@
+import copy
 import json
 import logging
+import os
+import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+
+
+class ConfigError(ValueError):
+    """A config file or settings tree HydraPlay can not run with, the message names the option."""
+    pass
+
+
+REQUIRED = object()
+
+
+class SectionReader:
+    """
+    Reads the options of one config section. Missing options get their default, invalid
+    ones raise a ConfigError with the full name of the option, e.g. mopidy.instances.
+    """
+
+    def __init__(self, path, content):
+        self.logger = logging.getLogger(__name__)
+        if content is None:
+            content = {}
+        if not isinstance(content, dict):
+            raise ConfigError("{0} must be an object, got {1}".format(path, json.dumps(content)))
+        self.path = path
+        self.content = content
+        self.known = set()
+
+    name_pattern = re.compile(r'^[A-Za-z0-9_-]+$')
+    line_break_pattern = re.compile(r'[\r\n]')
+
+    def name(self, key):
+        return "{0}.{1}".format(self.path, key)
+
+    def error(self, key, expected, value):
+        return ConfigError("{0} must be {1}, got {2}".format(self.name(key), expected, json.dumps(value)))
+
+    def value(self, key, default):
+        self.known.add(key)
+        if key in self.content:
+            return self.content[key]
+        if default is REQUIRED:
+            raise ConfigError("{0} is missing".format(self.name(key)))
+        return default
+
+    def integer(self, key, default=REQUIRED, minimum=None, maximum=None):
+        value = self.value(key, default)
+        if not isinstance(value, int) or isinstance(value, bool) \
+                or (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise self.error(key, self.describe("an integer", minimum, maximum), value)
+        return value
+
+    def number(self, key, default=REQUIRED, minimum=0):
+        value = self.value(key, default)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value < minimum:
+            raise self.error(key, self.describe("a number", minimum), value)
+        return value
+
+    def port(self, key, default=REQUIRED):
+        return self.integer(key, default, 1, 65535)
+
+    def flag(self, key, default=False):
+        value = self.value(key, default)
+        # older configs have "true" and "false" as strings
+        if value in ("true", "false"):
+            return value == "true"
+        if not isinstance(value, bool):
+            raise self.error(key, "true or false", value)
+        return value
+
+    def string(self, key, default=REQUIRED, choices=None):
+        value = self.value(key, default)
+        if not isinstance(value, str) or not value:
+            raise self.error(key, "a non-empty string", value)
+        if choices and value.split(":", 1)[0] not in choices:
+            raise self.error(key, "one of {0}".format(", ".join(choices)), value)
+        return value
+
+    def option(self, key):
+        """A value which is written into an ini file as it is, e.g. an option of a Mopidy extension."""
+        value = self.value(key, REQUIRED)
+        if isinstance(value, (bool, int, float)):
+            return value
+        if not isinstance(value, str) or self.line_break_pattern.search(value):
+            raise self.error(key, "a number, true, false or a string without line breaks", value)
+        return value
+
+    def section(self, key):
+        return SectionReader(self.name(key), self.value(key, None))
+
+    def check_names(self):
+        """Raises a ConfigError for keys which can not be used as ini section or option names."""
+        for key in self.content:
+            if not self.name_pattern.match(key):
+                raise ConfigError("{0} is not a valid name, use letters, digits, - and _".format(self.name(key)))
+
+    def check_unknown(self):
+        for key in sorted(set(self.content) - self.known):
+            self.logger.warning("Unknown option {0} is ignored.".format(self.name(key)))
+
+    @staticmethod
+    def describe(kind, minimum=None, maximum=None):
+        if minimum is not None and maximum is not None:
+            return "{0} from {1} to {2}".format(kind, minimum, maximum)
+        if minimum is not None:
+            return "{0} >= {1}".format(kind, minimum)
+        return kind
+
+
+def merge_patch(content, patch):
+    """
+    Returns content with a JSON merge patch (RFC 7386) applied: objects are merged
+    key by key, null removes a key, anything else replaces the value.
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    merged = copy.deepcopy(content) if isinstance(content, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = merge_patch(merged.get(key), value)
+    return merged
+
+
+def frozen_mapping(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: frozen_mapping(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(frozen_mapping(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class AudioRelaySettings:
+    __slots__ = ('queue_size', 'slow_consumer_policy')
+    queue_size: int
+    slow_consumer_policy: str
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(queue_size=reader.integer('queue_size', 64, minimum=1),
+                       slow_consumer_policy=reader.string('slow_consumer_policy', "drop_oldest",
+                                                          choices=("drop_oldest", "disconnect")))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class SupervisorSettings:
+    __slots__ = ('probe_interval', 'probe_grace', 'probe_failures', 'crash_loop_limit', 'crash_loop_window',
+                 'max_restart_delay')
+    probe_interval: float
+    probe_grace: float
+    probe_failures: int
+    crash_loop_limit: int
+    crash_loop_window: float
+    max_restart_delay: float
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(probe_interval=reader.number('probe_interval', 10, minimum=0.1),
+                       probe_grace=reader.number('probe_grace', 30),
+                       probe_failures=reader.integer('probe_failures', 3, minimum=1),
+                       crash_loop_limit=reader.integer('crash_loop_limit', 5, minimum=1),
+                       crash_loop_window=reader.number('crash_loop_window', 300),
+                       max_restart_delay=reader.number('max_restart_delay', 60))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class ProfilingSettings:
+    __slots__ = ('enabled', 'stall_threshold')
+    enabled: bool
+    stall_threshold: float
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(enabled=reader.flag('enabled'),
+                       stall_threshold=reader.number('stall_threshold', 1.0))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class ShutdownSettings:
+    __slots__ = ('drain_timeout', 'kill_timeout')
+    drain_timeout: float
+    kill_timeout: float
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(drain_timeout=reader.number('drain_timeout', 2),
+                       kill_timeout=reader.number('kill_timeout', 5))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class ProcessLogSettings:
+    __slots__ = ('rate', 'burst')
+    rate: float
+    burst: int
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(rate=reader.number('rate', 100),
+                       burst=reader.integer('burst', 500, minimum=1))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class LogBufferSettings:
+    __slots__ = ('size',)
+    size: int
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(size=reader.integer('size', 0, minimum=0))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class WebsocketSettings:
+    __slots__ = ('compression', 'compression_level', 'mem_level', 'upstream_compression', 'batch_window')
+    compression: bool
+    compression_level: int
+    mem_level: int
+    upstream_compression: bool
+    batch_window: float
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(compression=reader.flag('compression', True),
+                       compression_level=reader.integer('compression_level', 6, 1, 9),
+                       mem_level=reader.integer('mem_level', 8, 1, 9),
+                       upstream_compression=reader.flag('upstream_compression'),
+                       batch_window=reader.number('batch_window', 0))
+        reader.check_unknown()
+        return settings
+
+    def compression_options(self):
+        """The compression_options of tornado's websockets for the clients, None without compression."""
+        if not self.compression:
+            return None
+        return {'compression_level': self.compression_level, 'mem_level': self.mem_level}
+
+    def upstream_connect_options(self):
+        """Keyword arguments of websocket_connect for the JSON-RPC upstreams."""
+        if not self.upstream_compression:
+            return {}
+        return {'compression_options': {'compression_level': self.compression_level, 'mem_level': self.mem_level}}
+
+
+@dataclass(frozen=True)
+class CommandShapingSettings:
+    __slots__ = ('coalesce_window', 'rate', 'burst')
+    coalesce_window: float
+    rate: float
+    burst: int
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(coalesce_window=reader.number('coalesce_window', 0.1),
+                       rate=reader.number('rate', 50),
+                       burst=reader.integer('burst', 100, minimum=1))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class HydraplaySettings:
+    __slots__ = ('port', 'source_type', 'use_ws_proxy', 'cookie_secret', 'workers', 'coordinator_port', 'uvloop',
+                 'audio_relay', 'supervisor', 'profiling', 'shutdown', 'process_log',
+                 'log_buffer', 'websocket', 'command_shaping')
+    port: int
+    source_type: str
+    use_ws_proxy: bool
+    cookie_secret: str
+    workers: int
+    coordinator_port: int
+    uvloop: bool
+    audio_relay: AudioRelaySettings
+    supervisor: SupervisorSettings
+    profiling: ProfilingSettings
+    shutdown: ShutdownSettings
+    process_log: ProcessLogSettings
+    log_buffer: LogBufferSettings
+    websocket: WebsocketSettings
+    command_shaping: CommandShapingSettings
+
+    @classmethod
+    def read(cls, reader):
+        port = reader.port('port', 8080)
+        settings = cls(port=port,
+                       source_type=reader.string('source_type', "tcp", choices=("fifo", "tcp")),
+                       use_ws_proxy=reader.flag('use_ws_proxy'),
+                       cookie_secret=reader.string('cookie_secret'),
+                       workers=reader.integer('workers', 1, minimum=1),
+                       coordinator_port=reader.port('coordinator_port', port + 1),
+                       uvloop=reader.flag('uvloop'),
+                       audio_relay=AudioRelaySettings.read(reader.section('audio_relay')),
+                       supervisor=SupervisorSettings.read(reader.section('supervisor')),
+                       profiling=ProfilingSettings.read(reader.section('profiling')),
+                       shutdown=ShutdownSettings.read(reader.section('shutdown')),
+                       process_log=ProcessLogSettings.read(reader.section('process_log')),
+                       log_buffer=LogBufferSettings.read(reader.section('log_buffer')),
+                       websocket=WebsocketSettings.read(reader.section('websocket')),
+                       command_shaping=CommandShapingSettings.read(reader.section('command_shaping')))
+        if settings.workers > 1 and settings.coordinator_port == port:
+            raise ConfigError("{0} must differ from {1}".format(reader.name('coordinator_port'), reader.name('port')))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class ElasticSettings:
+    __slots__ = ('min_instances', 'idle_timeout')
+    min_instances: int
+    idle_timeout: float
+
+    @classmethod
+    def read(cls, reader):
+        settings = cls(min_instances=reader.integer('min_instances', 1, minimum=0),
+                       idle_timeout=reader.number('idle_timeout', 600))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class MopidySettings:
+    __slots__ = ('mpd_base_port', 'web_base_port', 'tcp_sink_base_port', 'instances', 'config_path', 'data_dir',
+                 'library_dir', 'extensions', 'elastic')
+    mpd_base_port: int
+    web_base_port: int
+    tcp_sink_base_port: int
+    instances: int
+    config_path: str
+    data_dir: str
+    library_dir: str
+    extensions: Mapping[str, Mapping]
+    elastic: Optional[ElasticSettings]
+
+    @classmethod
+    def read(cls, reader):
+        instances = reader.integer('instances', 2, minimum=1)
+        ports = {}
+        for key, default in (('mpd_base_port', 6600), ('web_base_port', 6680), ('tcp_sink_base_port', 4953)):
+            ports[key] = reader.integer(key, default, 1, 65536 - instances)
+
+        # the extensions are rendered into the [<name>] sections of mopidy.conf
+        extensions = reader.section('extensions')
+        extensions.check_names()
+        for name in extensions.content:
+            extension = extensions.section(name)
+            extension.check_names()
+            for key in extension.content:
+                if key == 'enabled':
+                    extension.flag('enabled')
+                else:
+                    extension.option(key)
+
+        # an empty elastic section leaves all instances running, like a missing one
+        elastic = reader.section('elastic')
+        data_dir = reader.string('data_dir', "/var/lib/mopidy")
+        settings = cls(instances=instances,
+                       config_path=reader.string('config_path', "/tmp/"),
+                       data_dir=data_dir,
+                       library_dir=reader.string('library_dir', os.path.join(data_dir, 'hydraplay-library')),
+                       extensions=frozen_mapping(extensions.content),
+                       elastic=ElasticSettings.read(elastic) if elastic.content else None,
+                       **ports)
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class SnapcastSettings:
+    __slots__ = ('config_path', 'server_port', 'remote_port', 'codec', 'additional_streams')
+    config_path: str
+    server_port: int
+    remote_port: int
+    codec: str
+    additional_streams: Tuple[Mapping, ...]
+
+    @classmethod
+    def read(cls, reader):
+        streams = reader.value('additional_streams', [])
+        if not isinstance(streams, list):
+            raise reader.error('additional_streams', "a list", streams)
+        for idx, stream in enumerate(streams):
+            stream_reader = SectionReader("{0}[{1}]".format(reader.name('additional_streams'), idx), stream)
+            stream_reader.string('label')
+            stream_reader.string('source_type', choices=("fifo", "tcp"))
+
+        settings = cls(config_path=reader.string('config_path', "/tmp/"),
+                       server_port=reader.port('server_port', 1704),
+                       remote_port=reader.port('remote_port', 1705),
+                       codec=reader.string('codec', "flac", choices=("flac", "opus", "ogg", "pcm", "null")),
+                       additional_streams=frozen_mapping(streams))
+        reader.check_unknown()
+        return settings
+
+
+@dataclass(frozen=True)
+class Settings:
+    __slots__ = ('hydraplay', 'mopidy', 'snapcast_server')
+    hydraplay: HydraplaySettings
+    mopidy: MopidySettings
+    snapcast_server: SnapcastSettings
+
+    @classmethod
+    def read(cls, content):
+        if not isinstance(content, dict):
+            raise ConfigError("settings must be a JSON object, got {0}".format(json.dumps(content)))
+        if not isinstance(content.get('hydraplay'), dict):
+            raise ConfigError("settings section 'hydraplay' is missing")
+        return cls(hydraplay=HydraplaySettings.read(SectionReader('hydraplay', content['hydraplay'])),
+                   mopidy=MopidySettings.read(SectionReader('mopidy', content.get('mopidy'))),
+                   snapcast_server=SnapcastSettings.read(SectionReader('snapcast_server',
+                                                                       content.get('snapcast_server'))))
 
-from hydraplay.util.YAMLObject import YAMLobj
 
 class Config:
+    """
+    The config file. content is the JSON tree as it is saved and sent to the workers,
+    the validated settings are read as attributes, e.g. config.mopidy.instances.
+    Both are replaced as a whole by update(), version counts the updates.
+    """
+
     def __init__(self, file_name):
         self.logger = logging.getLogger(__name__)
         self.file_name = file_name
-        try:
-            self.content = self.load_json(file_name)
-            self.content = YAMLobj(self.content)
-        except Exception as error:
-            self.logger.error("Config file is not valid JSON, please check your hydraplay config again.")
-            return None
+        self.version = 0
+        self.content = self.load_json(file_name)
+        self.set_settings(Settings.read(self.content))
 
     def load_json(self, file):
         self.logger.debug("Loading config file.")
-        with open(file) as json_data_file:
+        try:
+            with open(file) as json_data_file:
                 data = json.load(json_data_file)
-                # fill config with default values when not set
-                self.logger.debug("Config file is valid.")
+        except OSError as e:
+            raise ConfigError("Can not read config file {0}: {1}".format(file, e.strerror))
+        except json.JSONDecodeError as e:
+            raise ConfigError("Config file {0} is not valid JSON, line {1} column {2}: {3}".format(
+                file, e.lineno, e.colno, e.msg))
         return data
 
+    def set_settings(self, settings):
+        self.settings = settings
+        self.hydraplay = settings.hydraplay
+        self.mopidy = settings.mopidy
+        self.snapcast_server = settings.snapcast_server
+
+    def update(self, content):
+        """Replaces the content, raises a ConfigError and keeps the old one when the new one is invalid."""
+        settings = Settings.read(content)
+        self.content = content
+        self.set_settings(settings)
+        self.version += 1
+
+    def restore(self, content, settings, version):
+        """Puts back what update() replaced, when the new settings could not be applied."""
+        self.content = content
+        self.set_settings(settings)
+        self.version = version
+
     def save_json(self, file_name=None):
         self.logger.debug("Saving config file.")
         if file_name:
@@ -1,5 +1,7 @@
 from hydraplay.version import __version__
 from hydraplay.server.HydraServer import HydraServer
+from hydraplay.server.LogPipeline import LogPipeline
+from hydraplay.config import Config, ConfigError
 import logging
 import logging.handlers
 import sys
@@ -8,7 +10,7 @@ import signal
 class ServiceExit(Exception):
     """
     Custom exception which is used to trigger the clean exit
-    of all running threads and the main program.
+    of the main program before the server loop is running.
     """
     pass
 
@@ -49,8 +51,6 @@ def checkDependencies():
 
 def main():
 
-    checkDependencies()
-
     signal.signal(signal.SIGTERM, service_shutdown)
     signal.signal(signal.SIGINT, service_shutdown)
 
@@ -71,17 +71,24 @@ def main():
                         default="/etc/hydraplay/hydra.config.json",
                         help="Specify the config file to use. HydraPlay needs to have write access for the config dialog to work. Defaults to /etc/hydraplay/hydra.config.json")
 
+    parser.add_argument("--check-config", action="store_true", dest="checkConfig",
+                        help="Validate the config file and exit")
+
     parser.add_argument("--logfile", action="store", dest="logConf", default=None,
                         help="Define the log file and path for logging. Defaults to /var/log/hydraplay/hydraplay.log")
 
+    parser.add_argument("--profile", action="store_true", dest="profile",
+                        help="Start the sampling profiler with the server and enable /api/admin/profiler")
+
+    parser.add_argument("--stall-threshold", action="store", type=float, dest="stallThreshold", default=None,
+                        help="Log a stack trace when the event loop is blocked longer than this many seconds, 0 disables it. Defaults to 1")
+
     parser.add_argument("--loglevel", action="store", dest="logLevel", default="debug",
                         help="Specify the Log level. Possible Params are debug, info and warning")
 
     args = parser.parse_args()
 
     formatter = logging.Formatter('%(asctime)s [%(process)d:%(thread)d] %(levelname)s - %(name)s: %(message)s')
-    logger = logging.getLogger()
-
 
     log_level = {
         "debug": logging.DEBUG,
@@ -92,32 +99,39 @@ def main():
     level = log_level.get(str(args.logLevel), "debug")
 
     if args.logConf:
-        fh = logging.handlers.RotatingFileHandler(args.logConf, maxBytes=5000000, backupCount=5)
-        fh.setLevel(level)
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
-        logger.propagate = False
-        logger.setLevel(level)
+        handler = logging.handlers.RotatingFileHandler(args.logConf, maxBytes=5000000, backupCount=5)
     else:
-        ch = logging.StreamHandler()
-        ch.setLevel(level)
-        ch.setFormatter(formatter)
-        logger.addHandler(ch)
-        logger.propagate = False
-        logger.setLevel(level)
+        handler = logging.StreamHandler()
+    handler.setLevel(level)
+    handler.setFormatter(formatter)
+    # records are written by a thread, logging never waits for the file or the terminal
+    log_pipeline = LogPipeline.install([handler], level)
 
     if args.version:
         print("HydraPlay version %s" % __version__)
         sys.exit(0)
 
+    if args.checkConfig:
+        try:
+            Config(args.config)
+        except ConfigError as e:
+            print(e)
+            sys.exit(1)
+        print("Config file %s is valid." % args.config)
+        sys.exit(0)
+
+    checkDependencies()
+
     try:
-        server = HydraServer(args.config)
+        server = HydraServer(args.config, profile=args.profile, stall_threshold=args.stallThreshold,
+                             log_pipeline=log_pipeline)
         server.run()
+        if server.exit_on_error:
+            sys.exit(1)
 
     except ServiceExit:
+        # once the loop runs, the server handles SIGTERM and SIGINT itself and stops all services
         server.shutdown()
-        # Terminate the running threads.
-        # Set the shutdown flag on each thread to trigger a clean shutdown of each thread.
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import re
+
+from tornado import ioloop
+
+from hydraplay.server.StaticAssetCache import CachedAsset, hash_file
+
+
+def get_cache_dir():
+    """Writable directory for generated files, the package directory may be read-only."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "hydraplay")
+
+
+class AssetManifest:
+    """
+    Content fingerprints of one static bundle (player or snapweb).
+
+    At startup every file below the bundle root is hashed and gets a fingerprinted
+    name, e.g. snapcontrol.js becomes snapcontrol.3f2a9c1be04d.js. The src and href
+    references in index.html are rewritten to these names, so those assets can be
+    cached forever by the browser and only index.html has to be revalidated.
+    References inside other files (CSS url(), chunks loaded by the scripts) keep
+    their names, these files are served with ETags and revalidated as before.
+    """
+
+    INDEX_FILE = "index.html"
+    HASH_LENGTH = 12
+
+    reference_pattern = re.compile(r'(\b(?:src|href)\s*=\s*["\'])([^"\'#?]+)(["\'])', re.IGNORECASE)
+
+    def __init__(self, root, cache_dir=None):
+        self.logger = logging.getLogger(__name__)
+        self.root = os.path.abspath(root)
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.assets = {}
+        self.fingerprints = {}
+        self.index = None
+        self.rebuilding = None
+
+    def get_manifest_file(self):
+        return os.path.join(self.cache_dir, "{0}-manifest.json".format(os.path.basename(self.root)))
+
+    def build(self):
+        """Hashes the bundle, blocks, used at startup before the server is listening."""
+        self.apply(*self.scan())
+
+    async def rebuild(self):
+        """Hashes the bundle again in a thread, concurrent requests share one rebuild."""
+        if self.rebuilding is None:
+            self.rebuilding = ioloop.IOLoop.current().run_in_executor(None, self.scan)
+            try:
+                self.apply(*await self.rebuilding)
+            finally:
+                self.rebuilding = None
+        else:
+            await self.rebuilding
+
+    def scan(self):
+        assets = {}
+        fingerprints = {}
+        if not os.path.isdir(self.root):
+            self.logger.info("Static bundle {0} does not exist, skipping manifest.".format(self.root))
+            return assets, fingerprints, None
+
+        for directory, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                abspath = os.path.join(directory, filename)
+                path = os.path.relpath(abspath, self.root).replace(os.path.sep, "/")
+                if path == self.INDEX_FILE:
+                    continue
+                digest = hash_file(abspath)[:self.HASH_LENGTH]
+                name, extension = os.path.splitext(path)
+                hashed_path = "{0}.{1}{2}".format(name, digest, extension)
+                assets[path] = hashed_path
+                fingerprints[hashed_path] = (path, digest)
+
+        return assets, fingerprints, self.rewrite_index(assets)
+
+    def apply(self, assets, fingerprints, index):
+        self.assets = assets
+        self.fingerprints = fingerprints
+        self.index = index
+        if index is not None or assets:
+            self.write()
+            self.logger.info("Fingerprinted {0} assets in {1}".format(len(assets), self.root))
+
+    def rewrite_index(self, assets):
+        index_path = os.path.join(self.root, self.INDEX_FILE)
+        if not os.path.isfile(index_path):
+            return None
+
+        with open(index_path, "r", encoding="utf-8") as file:
+            html = file.read()
+
+        def replace(match):
+            reference = match.group(2)
+            path = reference[2:] if reference.startswith("./") else reference
+            hashed_path = assets.get(path)
+            if hashed_path is None:
+                return match.group(0)
+            return match.group(1) + hashed_path + match.group(3)
+
+        body = self.reference_pattern.sub(replace, html).encode("utf-8")
+        return CachedAsset(index_path, os.stat(index_path), body)
+
+    def write(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.get_manifest_file(), "w") as file:
+                json.dump(self.assets, file, indent=4, sort_keys=True)
+        except OSError as e:
+            # the manifest in memory is what is served, the file is informational
+            self.logger.debug("Could not write asset manifest: {0}".format(e))
+
+    def resolve(self, path):
+        """Returns (original path, fingerprint) for a fingerprinted path, otherwise None."""
+        return self.fingerprints.get(path)
+
+    async def get_index(self, abspath):
+        if self.index is None or self.index.abspath != abspath:
+            return None
+        stat_result = os.stat(abspath)
+        if stat_result.st_mtime != self.index.mtime:
+            # the bundle was rebuilt, hash it again without blocking the loop
+            await self.rebuild()
+        return self.index
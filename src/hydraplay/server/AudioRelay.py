@@ -0,0 +1,146 @@
+import logging
+import time
+from collections import deque
+
+from tornado import ioloop, locks
+from tornado.websocket import WebSocketClosedError
+
+# snapcast message type of audio chunks, the only messages which may be dropped
+SNAPCAST_WIRE_CHUNK = 2
+
+
+def is_wire_chunk(chunk):
+    # every snapcast message starts with its type as little endian uint16
+    return len(chunk) >= 2 and chunk[0] | (chunk[1] << 8) == SNAPCAST_WIRE_CHUNK
+
+
+class AudioRelay:
+    """
+    Relays the binary snapcast stream of one upstream to one browser.
+
+    Upstream messages are put into a bounded queue and written by a separate
+    coroutine, so reading from snapserver never waits for a slow client. When the
+    queue is full the oldest audio chunk is dropped or the client is disconnected,
+    depending on the configured policy. Control messages are never dropped, when
+    there is no audio chunk left to make room for one the client is disconnected,
+    the queue never grows beyond max_queue. Chunks are queued as received, without copying.
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+
+    def __init__(self, client, max_queue, policy):
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.wakeup = locks.Event()
+        self.closed = False
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+        self.max_lag = 0
+
+    def start(self):
+        ioloop.IOLoop.current().spawn_callback(self.write_loop)
+
+    def feed(self, chunk):
+        if self.closed:
+            return
+
+        if len(self.queue) >= self.max_queue:
+            if self.policy == self.DISCONNECT:
+                self.disconnect()
+                return
+            if not self.drop_oldest():
+                if is_wire_chunk(chunk):
+                    self.dropped += 1
+                else:
+                    # the stream would be broken without the control message
+                    self.disconnect()
+                return
+
+        self.queue.append((time.monotonic(), chunk))
+        self.queued_bytes += len(chunk)
+        self.max_lag = max(self.max_lag, len(self.queue))
+        self.wakeup.set()
+
+    def disconnect(self):
+        self.logger.info("Client too slow, disconnecting after {0} queued chunks.".format(len(self.queue)))
+        self.close()
+        self.client.close(1008, "client too slow")
+
+    def drop_oldest(self):
+        for idx, (received, chunk) in enumerate(self.queue):
+            if is_wire_chunk(chunk):
+                del self.queue[idx]
+                self.queued_bytes -= len(chunk)
+                self.dropped += 1
+                return True
+        return False
+
+    async def write_loop(self):
+        while not self.closed:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            received, chunk = self.queue.popleft()
+            self.queued_bytes -= len(chunk)
+            try:
+                await self.client.write_message(chunk, binary=True)
+            except WebSocketClosedError:
+                self.close()
+                return
+            self.sent += 1
+            self.sent_bytes += len(chunk)
+
+    def lag(self):
+        """Age of the oldest chunk which was not sent yet, in seconds."""
+        if not self.queue:
+            return 0.0
+        return time.monotonic() - self.queue[0][0]
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.queued_bytes = 0
+        self.wakeup.set()
+
+    def stats(self):
+        return {
+            'client': self.client.request.remote_ip,
+            'queued': len(self.queue),
+            'queued_bytes': self.queued_bytes,
+            'lag': self.lag(),
+            'max_lag': self.max_lag,
+            'sent': self.sent,
+            'sent_bytes': self.sent_bytes,
+            'dropped': self.dropped
+        }
+
+
+class AudioRelayManager:
+
+    def __init__(self, config):
+        self.logger = logging.getLogger(__name__)
+        settings = config.hydraplay.audio_relay
+        self.max_queue = settings.queue_size
+        self.policy = settings.slow_consumer_policy
+        self.relays = set()
+
+    def create(self, client):
+        relay = AudioRelay(client, self.max_queue, self.policy)
+        self.relays.add(relay)
+        relay.start()
+        return relay
+
+    def release(self, relay):
+        relay.close()
+        self.relays.discard(relay)
+
+    def stats(self):
+        return [relay.stats() for relay in self.relays]
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+
+from tornado.websocket import WebSocketClosedError
+
+from hydraplay.server.Metrics import RouteMetrics
+
+
+class CoordinatorChannel:
+    """
+    Coordinator side of the IPC channel to the worker processes.
+
+    Every worker keeps one websocket to the coordinator on the local coordinator port.
+    Messages are JSON objects with a type:
+
+    coordinator to worker
+        config: the config content and its version, sent on connect and after every change
+        state: state and readiness of the child processes and the hibernated Mopidy instances
+    worker to coordinator
+        ensure: a client needs a hibernated Mopidy instance
+        report: proxy counters and Mopidy usage of the worker, sent periodically
+
+    The state is compared every STATE_INTERVAL and only sent when it changed.
+    """
+
+    STATE_INTERVAL = 0.25
+    WORKER_LABEL = "Worker_{0}"
+
+    def __init__(self, config, supervisor, mopidy_pool):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.supervisor = supervisor
+        self.mopidy_pool = mopidy_pool
+        self.workers = {}
+        self.reports = {}
+        self.state = None
+        self.config_version = None
+        self.task = None
+        mopidy_pool.busy_checks.append(self.is_busy)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.publish_loop())
+
+    async def publish_loop(self):
+        while True:
+            await asyncio.sleep(self.STATE_INTERVAL)
+            self.publish()
+
+    def publish(self):
+        if self.config.version != self.config_version:
+            self.config_version = self.config.version
+            self.broadcast(self.config_message())
+        state = self.collect_state()
+        if state != self.state:
+            self.state = state
+            self.broadcast(self.state_message())
+
+    def collect_state(self):
+        return {
+            'processes': {label: {'state': executor.state, 'ready': executor.ready.is_set()}
+                          for label, executor in self.supervisor.processes.items()},
+            'hibernated': sorted(self.mopidy_pool.hibernated)
+        }
+
+    def config_message(self):
+        return json.dumps({'type': 'config', 'version': self.config.version, 'content': self.config.content})
+
+    def state_message(self):
+        return json.dumps(dict(self.state or self.collect_state(), type='state'))
+
+    def add(self, worker, socket):
+        self.logger.info("Worker {0} connected.".format(worker))
+        self.workers[worker] = socket
+        # a worker connects once it is listening, which makes it ready
+        executor = self.supervisor.get(self.WORKER_LABEL.format(worker))
+        if executor is not None:
+            self.supervisor.set_ready(executor)
+        self.send(socket, self.config_message())
+        self.send(socket, self.state_message())
+
+    def remove(self, worker, socket):
+        if self.workers.get(worker) is socket:
+            self.logger.info("Worker {0} disconnected.".format(worker))
+            del self.workers[worker]
+            self.reports.pop(worker, None)
+
+    def on_message(self, worker, message):
+        if message.get('type') == 'ensure':
+            self.mopidy_pool.ensure_instance(int(message['instance']))
+        elif message.get('type') == 'report':
+            # checked before it is stored, the idle loop and the metrics read it without checks
+            self.check_report(message)
+            self.reports[worker] = message
+
+    def check_report(self, message):
+        """Raises a ValueError when a report of a worker does not have the expected shape."""
+        usage, metrics = message['mopidy'], message['metrics']
+        if not isinstance(usage, dict) or not isinstance(metrics, dict):
+            raise ValueError("mopidy and metrics of a report must be objects")
+        for instance, entry in usage.items():
+            if not isinstance(entry, dict) or not isinstance(entry.get('subscribers'), int) \
+                    or not isinstance(entry.get('playing'), bool):
+                raise ValueError("invalid usage of Mopidy instance {0}: {1}".format(instance, entry))
+        for route, values in metrics.items():
+            if not isinstance(values, list) or len(values) != len(RouteMetrics.__slots__) \
+                    or not all(isinstance(value, (int, float)) for value in values):
+                raise ValueError("invalid metrics of route {0}: {1}".format(route, values))
+
+    def broadcast(self, message):
+        for socket in list(self.workers.values()):
+            self.send(socket, message)
+
+    def send(self, socket, message):
+        try:
+            socket.write_message(message)
+        except WebSocketClosedError:
+            pass
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for socket in list(self.workers.values()):
+            socket.close()
+
+    def is_busy(self, instance):
+        usage = [report['mopidy'].get(str(instance)) for report in self.reports.values()]
+        return any(entry['subscribers'] or entry['playing'] for entry in usage if entry)
+
+    def metrics_snapshots(self):
+        return [report['metrics'] for report in self.reports.values()]
+
+    def stats(self):
+        return {
+            'connected': sorted(self.workers),
+            'reports': {worker: report['mopidy'] for worker, report in sorted(self.reports.items())}
+        }
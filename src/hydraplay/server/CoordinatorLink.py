@@ -0,0 +1,110 @@
+import asyncio
+import json
+import logging
+
+from tornado import locks, ioloop, websocket
+
+
+class CoordinatorLink:
+    """
+    Worker side of the IPC channel (see CoordinatorChannel). Applies the config of the
+    coordinator, keeps the last known state of its child processes and sends the
+    reports of the worker. The websocket is reconnected when it breaks.
+    """
+
+    RECONNECT_DELAY = 1.0
+    REPORT_INTERVAL = 5.0
+
+    def __init__(self, url, config, metrics):
+        self.logger = logging.getLogger(__name__)
+        self.url = url
+        self.config = config
+        self.metrics = metrics
+        self.connection = None
+        self.config_version = None
+        self.processes = {}
+        self.hibernated = set()
+        self.changed = locks.Condition()
+        self.config_listeners = []
+        self.state_listeners = []
+        # callable returning the Mopidy usage of this worker for the reports
+        self.usage = None
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(self.run()), asyncio.ensure_future(self.report_loop())]
+
+    async def run(self):
+        while True:
+            try:
+                self.connection = await websocket.websocket_connect(self.url)
+            except Exception as e:
+                self.logger.debug("Coordinator is not reachable: {0}".format(e))
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                continue
+
+            self.logger.info("Connected to coordinator {0}".format(self.url))
+            while True:
+                message = await self.connection.read_message()
+                if message is None:
+                    break
+                try:
+                    self.on_message(json.loads(message))
+                except (ValueError, KeyError, TypeError) as e:
+                    # includes a ConfigError, the worker keeps the config it has
+                    self.logger.error("Invalid message from coordinator: {0}".format(e))
+            self.connection = None
+            self.logger.warning("Lost the connection to the coordinator, reconnecting.")
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    def on_message(self, message):
+        if message['type'] == 'config':
+            if message['version'] != self.config_version:
+                self.config.update(message['content'])
+                self.config_version = message['version']
+                self.notify(self.config_listeners)
+        elif message['type'] == 'state':
+            self.processes = message['processes']
+            self.hibernated = set(message['hibernated'])
+            self.notify(self.state_listeners)
+            self.changed.notify_all()
+
+    def notify(self, listeners):
+        for listener in listeners:
+            try:
+                listener()
+            except Exception:
+                self.logger.exception("Listener failed on a message from the coordinator")
+
+    async def report_loop(self):
+        while True:
+            await asyncio.sleep(self.REPORT_INTERVAL)
+            self.send({'type': 'report',
+                       'metrics': self.metrics.snapshot(),
+                       'mopidy': self.usage() if self.usage is not None else {}})
+
+    def send(self, message):
+        if self.connection is None:
+            return
+        try:
+            self.connection.write_message(json.dumps(message))
+        except websocket.WebSocketClosedError:
+            pass
+
+    def is_ready(self, label):
+        process = self.processes.get(label)
+        return process is not None and process['ready']
+
+    async def wait_ready(self, label, timeout):
+        """Waits until the coordinator reports the process as ready, returns False on timeout."""
+        deadline = ioloop.IOLoop.current().time() + timeout
+        while not self.is_ready(label):
+            if not await self.changed.wait(timeout=deadline):
+                return False
+        return True
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.connection is not None:
+            self.connection.close()
@@ -0,0 +1,19 @@
+import asyncio
+import logging
+
+
+def run_event_loop(main, use_uvloop=False):
+    """
+    Runs the main coroutine of a HydraPlay process on a new event loop until it returns.
+    With use_uvloop the loop of uvloop is used when the package is installed.
+    """
+    logger = logging.getLogger(__name__)
+    if use_uvloop:
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("uvloop is not installed, using the asyncio event loop.")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logger.info("Using the uvloop event loop.")
+    asyncio.run(main)
@@ -1,72 +1,260 @@
-import threading
-import subprocess
+import asyncio
+import atexit
 import logging
-import re
+import os
+import signal
+import sys
+import time
 
-class Executor(threading.Thread):
+from tornado import locks
 
-    def __init__(self, label, command):
-        threading.Thread.__init__(self)
+from hydraplay.server.LogParser import LogParser
+
+
+def with_parent_death_signal(command):
+    """
+    Returns the command started through ParentDeathExec on Linux, which makes the
+    kernel kill the child when the server dies. Without it a child in its own session
+    survives a crashed or SIGKILLed server.
+    """
+    if not sys.platform.startswith("linux"):
+        return command
+    return [sys.executable, '-m', 'hydraplay.server.ParentDeathExec', str(os.getpid())] + list(command)
+
+
+class Executor:
+    """
+    Runs one child process on the server loop and logs its output.
+
+    Output is read in binary chunks and split into lines, every line goes through
+    the LogParser of the tool (Mopidy, snapserver, ...) and the LogThrottle.
+    """
+
+    READ_SIZE = 64 * 1024
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    STARTING = "starting"
+    RUNNING = "running"
+    STOPPING = "stopping"
+    EXITED = "exited"
+    STOPPED = "stopped"
+    FAILED = "failed"
+    BACKOFF = "backoff"
+
+    # process groups which are still running, killed when the server exits
+    running = set()
+
+    def __init__(self, label, command, parser=None, probe=None, throttle=None):
         self.logger = logging.getLogger(__name__ + "." + label)
         self.process = None
         self.command = command
         self.label = label
-        self.daemon = True
+        self.parser = parser or LogParser()
+        self.probe = probe
+        self.throttle = throttle
+        self.state = None
+        self.returncode = None
+        self.started_at = None
+        self.exited_at = None
+        self.lines = 0
+        self.task = None
+        self.restarts = 0
+        self.stop_requested = False
+        self.restart_requested = False
+        self.healthy = None
+        self.probe_failures = 0
+        self.ready = locks.Event()
+        self.ready_at = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
 
-    def run(self):
+    def start(self):
+        self.state = self.STARTING
+        self.task = asyncio.ensure_future(self.run())
+        return self.task
 
+    async def run(self):
         try:
             self.logger.debug("Command: {0}".format(self.command))
-            self.process = subprocess.Popen(self.command,
-                                            stdout=subprocess.PIPE,
-                                            stderr=subprocess.STDOUT,
-                                            universal_newlines=True,
-                                            )
-            for stdout_line in iter(self.process.stdout.readline, ""):
-                line = stdout_line.strip()
-
-                if ('Mopidy' in self.label):
-                    # mopidy log filter, removes redundant log information
-                    filtered_line = re.sub(r'(INFO|DEBUG|ERROR)(\s+)\d+-\d+-\d+\s\d+:\d+:\d+,\d+', '', line)
-
-                    # mopidy log filter
-                    if "INFO" in line:
-                        self.logger.info(filtered_line)
-                    elif "ERROR" in line:
-                        self.logger.error(filtered_line)
-                    elif "DEBUG" in line:
-                        self.logger.debug(filtered_line)
-                    else:
-                        self.logger.debug(line)
-
-
-                elif ('Snapcast' in self.label):
-                    #snapcast log filter, removes redundant log information
-                    filtered_line = re.sub(r'\d+-\d+-\d+\s\d+-\d+\d+-\d+.\d+\ (\[(Notice|Debug|Error|Info)\])', '', line)
-
-                    if "Info" in line or "Notice" in line:
-                        self.logger.info(filtered_line)
-                    if "Error" in line:
-                        self.logger.error(filtered_line)
-                    if "Debug" in line:
-                        self.logger.debug(filtered_line)
-
-                else:
-                    self.logger.debug(line)
-
-            self.process.stdout.close()
-            return_code = self.process.wait()
-
-            self.logger.info("Process {0} started.".format(self.label))
+            # own process group, helpers started by the tool are stopped together with it
+            self.process = await asyncio.create_subprocess_exec(*with_parent_death_signal(self.command),
+                                                                stdout=asyncio.subprocess.PIPE,
+                                                                stderr=asyncio.subprocess.STDOUT,
+                                                                start_new_session=True)
+            Executor.running.add(self.process.pid)
+            self.started_at = time.time()
+            self.exited_at = None
+            self.returncode = None
+            self.healthy = None
+            self.probe_failures = 0
+            self.ready.clear()
+            self.ready_at = None
+            self.state = self.RUNNING
+            self.logger.info("Process {0} started with pid {1}.".format(self.label, self.process.pid))
+
+            await self.read_output()
+
+            self.returncode = await self.process.wait()
+            Executor.running.discard(self.process.pid)
+            self.exited_at = time.time()
+            self.ready.clear()
+            self.state = self.STOPPED if self.stop_requested else self.EXITED
+            self.logger.info("Process {0} exited with code {1}.".format(self.label, self.returncode))
         except Exception as e:
+            self.state = self.FAILED
+            self.exited_at = time.time()
             self.logger.error("Error while running Executer: {0}".format(e))
+        return self.returncode
+
+    async def read_output(self):
+        stream = self.process.stdout
+        pending = b""
+        while True:
+            chunk = await stream.read(self.READ_SIZE)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                self.log_line(line)
+        if pending:
+            self.log_line(pending)
+        if self.throttle is not None:
+            for level, message in self.throttle.flush():
+                self.logger.log(level, message)
+
+    def log_line(self, line):
+        self.lines += 1
+        parsed = self.parser.parse(line.decode("utf-8", "replace").rstrip())
+        if parsed is None:
+            return
+        level, message = parsed
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.throttle is None:
+            self.logger.log(level, message)
+            return
+        for level, message in self.throttle.filter(level, message):
+            self.logger.log(level, message)
+
+    def is_running(self):
+        return self.state in (self.STARTING, self.RUNNING, self.STOPPING, self.BACKOFF)
+
+    def is_alive(self):
+        return self.process is not None and self.returncode is None and self.state != self.FAILED
+
+    def uptime(self):
+        if self.started_at is None:
+            return 0
+        return (self.exited_at or time.time()) - self.started_at
 
     def stop(self):
+        self.stop_requested = True
+        self.ready.clear()
+        if self.state == self.BACKOFF:
+            self.state = self.STOPPED
+        self.terminate()
+
+    def restart(self):
+        """Restarts the process right away, without counting it as a crash."""
+        self.restart_requested = True
+        self.ready.clear()
+        self.terminate()
+
+    def terminate(self):
         try:
-            self.process.terminate()
-            self.logger.info("Process %s killed", self.label)
+            if self.is_alive():
+                if self.stop_requested:
+                    self.state = self.STOPPING
+                self.send_signal(signal.SIGTERM)
+                self.logger.info("Process %s killed", self.label)
+        except ProcessLookupError:
+            pass
         except Exception as e:
             self.logger.error(e)
 
+    async def terminate_and_wait(self, timeout=10.0):
+        """Terminates the process and escalates to SIGKILL if it does not exit in time."""
+        if not self.is_alive():
+            return
+        self.terminate()
+        await self.wait_or_kill(timeout)
+
+    async def wait_or_kill(self, timeout):
+        """Waits for a terminated process to exit and kills it when it takes too long."""
+        if not self.is_alive():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.process.wait()), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning("Process {0} did not terminate, killing it.".format(self.label))
+            self.send_signal(signal.SIGKILL)
+            await self.process.wait()
+
+    def send_signal(self, signum):
+        # the whole process group, see run()
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    @classmethod
+    def kill_running(cls):
+        """Kills the process groups which were not stopped, e.g. when the server fails."""
+        for pid in list(cls.running):
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        cls.running.clear()
+
+    def set_ready(self):
+        self.healthy = True
+        self.ready_at = time.time()
+        self.ready.set()
+
+    def resource_usage(self):
+        """Returns (rss in bytes, cpu seconds) of the running process from /proc, None when not available."""
+        if not self.is_alive():
+            return None
+        return self.read_usage(self.process.pid)
+
+    @classmethod
+    def read_usage(cls, pid):
+        try:
+            with open("/proc/{0}/stat".format(pid)) as file:
+                # the command name may contain spaces, the fields start after it
+                fields = file.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            return None
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / cls.CLOCK_TICKS
+        return int(fields[21]) * cls.PAGE_SIZE, cpu_seconds
+
+    async def wait(self):
+        if self.task is not None:
+            await self.task
+        return self.returncode
+
+    def to_dict(self):
+        return {
+            'label': self.label,
+            'command': self.command,
+            'pid': self.pid,
+            'state': self.state,
+            'returncode': self.returncode,
+            'started_at': self.started_at,
+            'exited_at': self.exited_at,
+            'uptime': self.uptime() if self.exited_at is None else 0,
+            'startup_time': self.ready_at - self.started_at if self.ready_at else None,
+            'restarts': self.restarts,
+            'healthy': self.healthy,
+            'probe_failures': self.probe_failures,
+            'lines': self.lines,
+            'suppressed_lines': self.throttle.stats() if self.throttle is not None else None
+        }
 
 
+atexit.register(Executor.kill_running)
@@ -0,0 +1,33 @@
+import json
+import logging
+
+from tornado.httpclient import AsyncHTTPClient
+
+
+class JsonRpcProbe:
+    """
+    Liveness check which sends one JSON-RPC request over HTTP. Mopidy answers on
+    /mopidy/rpc and snapserver on /jsonrpc, a result proves that the core of the
+    process is still serving requests and not only the socket is open.
+    """
+
+    def __init__(self, url, method, timeout=5.0):
+        self.logger = logging.getLogger(__name__)
+        self.url = url
+        self.method = method
+        self.timeout = timeout
+        self.body = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method})
+
+    async def check(self):
+        try:
+            response = await AsyncHTTPClient().fetch(self.url, method="POST", body=self.body,
+                                                     headers={'Content-Type': 'application/json'},
+                                                     connect_timeout=self.timeout,
+                                                     request_timeout=self.timeout)
+            return 'result' in json.loads(response.body)
+        except Exception as e:
+            self.logger.debug("Probe {0} {1} failed: {2}".format(self.url, self.method, e))
+            return False
+
+    def __repr__(self):
+        return "{0} {1}".format(self.url, self.method)
@@ -1,76 +1,298 @@
 from hydraplay.server.handler.StaticFileHandler import StaticFileHandler
 from hydraplay.server.handler.SettingsHandler import SettingsHandler
 from hydraplay.server.handler.MopidyExtensionHandler import MopidyExtensionHandler
+from hydraplay.server.handler.MediaScanEventsHandler import MediaScanEventsHandler
 from hydraplay.server.handler.WebsocketProxyHandler import WebsocketProxyHandler
+from hydraplay.server.handler.StatusHandler import StatusHandler
+from hydraplay.server.handler.ProcessHandler import ProcessHandler
+from hydraplay.server.handler.MetricsHandler import MetricsHandler
+from hydraplay.server.handler.ProfilerHandler import ProfilerHandler
+from hydraplay.server.handler.WorkerChannelHandler import WorkerChannelHandler
+from hydraplay.server.handler.LogHandler import LogHandler
+from hydraplay.server.handler.LogTailHandler import LogTailHandler
+from hydraplay.server.UpstreamConnector import UpstreamConnector
+from hydraplay.server.SnapcastControlHub import SnapcastControlHub
+from hydraplay.server.AudioRelay import AudioRelayManager
+from hydraplay.server.StaticAssetCache import StaticAssetCache
+from hydraplay.server.AssetManifest import AssetManifest
 from hydraplay.server.SnapCastService import SnapCastService
 from hydraplay.server.MopidyPoolService import MopidyPoolService
-from hydraplay.config import Config
+from hydraplay.server.ProcessSupervisor import ProcessSupervisor
+from hydraplay.server.Reconfigurator import Reconfigurator
+from hydraplay.server.MediaScanner import MediaScanner
+from hydraplay.server.Metrics import ProxyMetrics, LoopLagMonitor
+from hydraplay.server.Profiler import SamplingProfiler, StallWatchdog
+from hydraplay.server.SettingsDocument import SettingsDocument
+from hydraplay.server.StartupTimeline import StartupTimeline
+from hydraplay.server.CoordinatorChannel import CoordinatorChannel
+from hydraplay.server.LogParser import WorkerLogParser
+from hydraplay.server.EventLoop import run_event_loop
+from hydraplay.server.ProxyConnections import ProxyConnections
+from hydraplay.server.LogBuffer import LogBuffer
+from hydraplay.config import Config, ConfigError
 from pathlib import Path
 import tornado
 import logging
-import time
-import threading
 
 import asyncio
-import tornado.ioloop
+import signal
+import sys
+import time
 import tornado.web
-import tornado.httpserver
-from tornado.platform.asyncio import AnyThreadEventLoopPolicy
 
 
 class HydraServer:
 
-    def __init__(self, configFile):
+    STARTUP_TIMEOUT = 120
+
+    def __init__(self, configFile, profile=False, stall_threshold=None, log_pipeline=None):
         self.mopidy_sercice = None
         self.webserver = None
+        self.http_server = None
+        self.stopping = None
         self.snapcast_service = None
+        self.upstream_connector = UpstreamConnector()
+        self.snapcast_hub = SnapcastControlHub(self.upstream_connector)
+        self.supervisor = None
+        self.timeline = StartupTimeline()
+        self.proxy_metrics = ProxyMetrics()
+        self.connections = ProxyConnections()
+        self.loop_monitor = LoopLagMonitor()
+        self.profiler = SamplingProfiler()
+        self.watchdog = None
+        self.log_pipeline = log_pipeline
+        self.log_buffer = None
+        self.workers = 1
+        self.coordinator_channel = None
         self.exit_on_error = False
-        self.mopidy_service_started = threading.Event()
+
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
 
         try:
             self.config = Config(configFile)
-            asyncio.set_event_loop_policy(AnyThreadEventLoopPolicy())
             self.system_exit = SystemExit()
-            self.logger = logging.getLogger(__name__)
-            self.logger.setLevel(logging.DEBUG)
 
             self.static_files = str(Path(__file__).resolve().parent) + "/static/"
             self.logger.debug(self.static_files)
-            self.server_port = self.config.content['hydraplay']['port']
+            self.server_port = self.config.hydraplay.port
+            self.snapcast_hub.connect_options = self.config.hydraplay.websocket.upstream_connect_options()
+            self.snapcast_hub.batch_window = self.config.hydraplay.websocket.batch_window
+            self.snapcast_hub.set_command_shaping(self.config.hydraplay.command_shaping)
+            if self.config.hydraplay.log_buffer.size:
+                # started first, the buffer keeps the startup of all processes
+                self.log_buffer = LogBuffer(self.config.hydraplay.log_buffer.size)
+                self.log_buffer.start()
+            self.use_uvloop = self.config.hydraplay.uvloop
+            self.drain_timeout = self.config.hydraplay.shutdown.drain_timeout
+            self.kill_timeout = self.config.hydraplay.shutdown.kill_timeout
 
-            self.mopidy_sercice = MopidyPoolService(self.config.content, self.mopidy_service_started)
-            self.snapcast_service = SnapCastService(self.config.content)
-        except:
+            profiling = self.config.hydraplay.profiling
+            self.profile_on_start = profile
+            self.profiling_enabled = profile or profiling.enabled
+            if stall_threshold is None:
+                stall_threshold = profiling.stall_threshold
+            if stall_threshold:
+                self.watchdog = StallWatchdog(stall_threshold)
+
+            self.supervisor = ProcessSupervisor(self.config, self.timeline)
+            self.audio_relays = AudioRelayManager(self.config)
+            self.static_cache = StaticAssetCache()
+            self.player_manifest = AssetManifest(self.static_files + "/player")
+            self.player_manifest.build()
+            self.snapweb_manifest = AssetManifest(self.static_files + "/snapweb")
+            self.snapweb_manifest.build()
+            self.mopidy_sercice = MopidyPoolService(self.config, self.supervisor, self.upstream_connector)
+            self.snapcast_hub.stream_listeners.append(self.mopidy_sercice.on_stream_assigned)
+            self.snapcast_service = SnapCastService(self.config, self.supervisor, self.snapcast_hub)
+            self.media_scanner = MediaScanner(self.config, self.supervisor, self.mopidy_sercice)
+            self.settings_document = SettingsDocument(self.config)
+            self.reconfigurator = Reconfigurator(self.config, self.mopidy_sercice, self.snapcast_service,
+                                                 self.settings_document)
+
+            # with more than one worker this process becomes the coordinator and the workers serve the clients
+            self.workers = self.config.hydraplay.workers
+            self.coordinator_port = self.config.hydraplay.coordinator_port
+            if self.workers > 1:
+                self.coordinator_channel = CoordinatorChannel(self.config, self.supervisor, self.mopidy_sercice)
+        except ConfigError as e:
+            self.logger.error("Invalid config, HydraPlay is not started: {0}".format(e))
+            self.exit_on_error = True
+            self.shutdown()
+        except Exception:
+            self.logger.exception("HydraPlay could not be started.")
             self.exit_on_error = True
             self.shutdown()
 
     def run(self):
         if not self.exit_on_error:
             self.logger.info("Hydraplay Server started.")
-            self.mopidy_sercice.start()
-            self.mopidy_service_started.wait()
+            run_event_loop(self.serve(), self.use_uvloop)
+
+    async def serve(self):
+        """
+        Runs all services on the one event loop until shutdown() is called. Everything
+        the services started on the loop is stopped or cancelled before it returns.
+        """
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.shutdown)
+
+        startup = asyncio.ensure_future(self.start_services())
+        startup.add_done_callback(self.on_startup_done)
+        await self.stopping.wait()
+
+        # a shutdown while booting cancels the startup, e.g. waiting for Mopidy
+        startup.cancel()
+        await asyncio.gather(startup, return_exceptions=True)
+        await self.stop_services()
+
+    def on_startup_done(self, startup):
+        if not startup.cancelled() and startup.exception() is not None:
+            self.logger.error("Starting the services failed: {0}".format(startup.exception()))
+            self.shutdown()
 
-            self.snapcast_service.start()
+    async def start_services(self):
+        # the web server comes up first, clients of an instance wait until it is ready
+        self.listen()
+        self.loop_monitor.start()
+        if self.watchdog is not None:
+            self.watchdog.start()
+        if self.profile_on_start:
+            self.profiler.start()
+        self.timeline.mark("Web server listening")
+
+        # all instances read the one shared local library
+        await self.media_scanner.setup_library()
+
+        # child processes are supervised on the server loop
+        await asyncio.gather(self.mopidy_sercice.start(), self.snapcast_service.start())
+        self.timeline.mark("Processes spawned")
+
+        if await self.mopidy_sercice.wait_all_ready(self.STARTUP_TIMEOUT):
+            self.timeline.mark("All Mopidy instances ready")
+        else:
+            self.logger.warning("Not all Mopidy instances were ready after {0} seconds.".format(self.STARTUP_TIMEOUT))
+
+    def listen(self):
+        self.webserver = self.routes()
+        if self.coordinator_channel is not None:
+            # the workers own the public port, the coordinator only answers them
+            self.logger.debug("Coordinator listening on port {0}".format(self.coordinator_port))
+            self.http_server = self.webserver.listen(self.coordinator_port, address="127.0.0.1")
+            self.coordinator_channel.start()
+            self.start_workers()
+        else:
             self.logger.debug("Server listening on port {0}".format(self.server_port))
-            self.webserver = self.routes()
-            self.webserver.listen(self.server_port)
-            tornado.ioloop.IOLoop.instance().start()
+            self.http_server = self.webserver.listen(self.server_port)
+
+    def start_workers(self):
+        level = logging.getLevelName(logging.getLogger().getEffectiveLevel()).lower()
+        for worker in range(self.workers):
+            command = [sys.executable, '-m', 'hydraplay.server.HydraWorker', '--config', self.config.file_name,
+                       '--worker', str(worker), '--coordinator-port', str(self.coordinator_port),
+                       '--loglevel', level]
+            self.supervisor.spawn(self.get_worker_label(worker), command, WorkerLogParser())
+        self.timeline.mark("Workers spawned")
+
+    def get_worker_label(self, worker):
+        return CoordinatorChannel.WORKER_LABEL.format(worker)
 
     def shutdown(self):
-       #self.snapcast_service.stop()
-       #self.snapcast_service.join()
-       if self.mopidy_sercice is not None:
+        if self.stopping is not None:
+            self.stopping.set()
+        elif self.mopidy_sercice is not None:
+            # the loop is not running, nothing was started on it
             self.mopidy_sercice.stop()
-       #self.mopidy_sercice.join()
-       ioloop = tornado.ioloop.IOLoop.current()
-       ioloop.add_callback(ioloop.stop)
-       self.logger.info("Hydraplay Server stopped.")
+
+    async def stop_services(self):
+        """Stops the server in phases and logs how long each of them took."""
+        self.logger.info("Stopping Hydraplay Server.")
+        phases = [("stop listening", self.stop_listening),
+                  ("close websockets", self.close_connections),
+                  ("stop processes", self.stop_processes),
+                  ("remove files", self.remove_files)]
+        started = time.monotonic()
+        timings = []
+        for name, phase in phases:
+            phase_started = time.monotonic()
+            try:
+                await phase()
+            except Exception as e:
+                self.logger.error("Shutdown phase {0} failed: {1}".format(name, e))
+            timings.append("{0} {1:.2f}s".format(name, time.monotonic() - phase_started))
+
+        self.loop_monitor.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self.profiler.stop()
+        self.logger.info("Hydraplay Server stopped in {0:.2f}s ({1}).".format(time.monotonic() - started,
+                                                                              ", ".join(timings)))
+
+    async def stop_listening(self):
+        if self.http_server is not None:
+            self.http_server.stop()
+
+    async def close_connections(self):
+        # browsers get a close frame, then the shared upstream connections are closed
+        await self.connections.close_all(self.drain_timeout)
+        self.mopidy_sercice.close()
+        self.snapcast_hub.close()
+
+    async def stop_processes(self):
+        # all children at once, SIGKILL for those still running after kill_timeout
+        await self.supervisor.close(self.kill_timeout)
+        if self.coordinator_channel is not None:
+            self.coordinator_channel.close()
+
+    async def remove_files(self):
+        self.mopidy_sercice.delete_files()
+        self.snapcast_service.delete_config()
 
     def routes(self):
-        return tornado.web.Application([
-            (r'/socket/(.*)', WebsocketProxyHandler),
-            (r"/api/media/scan", MopidyExtensionHandler),
-            (r"/api/settings", SettingsHandler, {"config": self.config}),
-            (r"/client/(.*)", StaticFileHandler, {"path": self.static_files+"/snapweb", "default_filename": "index.html"}),
-            (r"/(.*)", StaticFileHandler, {"path": self.static_files+"/player", "default_filename": "index.html"}),
-        ], cookie_secret=self.config.content['hydraplay']['cookie_secret'])
+        admin_routes = []
+        if self.coordinator_channel is not None:
+            admin_routes.append((r"/internal/workers", WorkerChannelHandler, {"channel": self.coordinator_channel}))
+        if self.log_buffer is not None:
+            admin_routes.append((r"/api/logs/tail", LogTailHandler, {"log_buffer": self.log_buffer,
+                                                                     "connections": self.connections}))
+            admin_routes.append((r"/api/logs", LogHandler, {"log_buffer": self.log_buffer}))
+        if self.profiling_enabled:
+            admin_routes.append((r"/api/admin/profiler(?:/(start|stop))?", ProfilerHandler,
+                                 {"profiler": self.profiler, "watchdog": self.watchdog}))
+
+        return tornado.web.Application(admin_routes + [
+            (r'/socket/(.*)', WebsocketProxyHandler, {"connector": self.upstream_connector,
+                                                       "snapcast_hub": self.snapcast_hub,
+                                                       "mopidy_pool": self.mopidy_sercice,
+                                                       "audio_relays": self.audio_relays,
+                                                       "metrics": self.proxy_metrics,
+                                                       "connections": self.connections,
+                                                       "websocket_settings": self.config.hydraplay.websocket}),
+            (r"/api/media/scan/(\w+)/events", MediaScanEventsHandler, {"scanner": self.media_scanner}),
+            (r"/api/media/scan(?:/(\w+))?", MopidyExtensionHandler, {"scanner": self.media_scanner}),
+            (r"/api/status", StatusHandler, {"connector": self.upstream_connector,
+                                             "snapcast_hub": self.snapcast_hub,
+                                             "mopidy_pool": self.mopidy_sercice,
+                                             "audio_relays": self.audio_relays,
+                                             "static_cache": self.static_cache,
+                                             "timeline": self.timeline,
+                                             "coordinator_channel": self.coordinator_channel}),
+            (r"/api/processes", ProcessHandler, {"supervisor": self.supervisor}),
+            (r"/api/metrics", MetricsHandler, {"metrics": self.proxy_metrics,
+                                               "connector": self.upstream_connector,
+                                               "static_cache": self.static_cache,
+                                               "supervisor": self.supervisor,
+                                               "loop_monitor": self.loop_monitor,
+                                               "watchdog": self.watchdog,
+                                               "log_pipeline": self.log_pipeline,
+                                               "coordinator_channel": self.coordinator_channel}),
+            (r"/api/settings", SettingsHandler, {"config": self.config,
+                                                "reconfigurator": self.reconfigurator,
+                                                "settings_document": self.settings_document}),
+            (r"/client/(.*)", StaticFileHandler, {"path": self.static_files+"/snapweb", "default_filename": "index.html",
+                                                  "cache": self.static_cache, "manifest": self.snapweb_manifest}),
+            (r"/(.*)", StaticFileHandler, {"path": self.static_files+"/player", "default_filename": "index.html",
+                                           "cache": self.static_cache, "manifest": self.player_manifest}),
+        ], cookie_secret=self.config.hydraplay.cookie_secret)
@@ -0,0 +1,150 @@
+from hydraplay.server.handler.StaticFileHandler import StaticFileHandler
+from hydraplay.server.handler.WebsocketProxyHandler import WebsocketProxyHandler
+from hydraplay.server.handler.CoordinatorProxyHandler import CoordinatorProxyHandler
+from hydraplay.server.handler.CoordinatorSocketHandler import CoordinatorSocketHandler
+from hydraplay.server.UpstreamConnector import UpstreamConnector
+from hydraplay.server.SnapcastControlHub import SnapcastControlHub
+from hydraplay.server.AudioRelay import AudioRelayManager
+from hydraplay.server.StaticAssetCache import StaticAssetCache
+from hydraplay.server.AssetManifest import AssetManifest
+from hydraplay.server.CoordinatorLink import CoordinatorLink
+from hydraplay.server.RemoteMopidyPool import RemoteMopidyPool
+from hydraplay.server.Metrics import ProxyMetrics
+from hydraplay.server.EventLoop import run_event_loop
+from hydraplay.server.ProxyConnections import ProxyConnections
+from hydraplay.server.LogPipeline import LogPipeline
+from hydraplay.config import Config
+from pathlib import Path
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+import tornado.ioloop
+import tornado.web
+from tornado.httpclient import AsyncHTTPClient
+
+
+class HydraWorker:
+    """
+    Worker process of the multi-process mode (hydraplay.workers in the config).
+
+    All workers listen on the public port with SO_REUSEPORT, the kernel spreads the
+    client connections over them. A worker proxies the websockets and serves the
+    static files on its own loop and core, API requests are forwarded to the
+    coordinator. The coordinator is the HydraServer process, it runs Mopidy, snapserver
+    and the workers and shares its config and process state over the CoordinatorLink.
+    """
+
+    # concurrent API requests forwarded to the coordinator, long polls and scan events included
+    MAX_API_REQUESTS = 1000
+    PARENT_CHECK_INTERVAL = 2000
+
+    def __init__(self, configFile, worker, coordinator_port):
+        self.logger = logging.getLogger(__name__)
+        self.worker = worker
+        self.webserver = None
+        self.http_server = None
+        self.api_client = None
+        self.stopping = None
+        self.parent_pid = os.getppid()
+        self.config = Config(configFile)
+        self.server_port = self.config.hydraplay.port
+        self.coordinator_url = "http://127.0.0.1:{0}".format(coordinator_port)
+        self.coordinator_socket_url = "ws://127.0.0.1:{0}".format(coordinator_port)
+        self.static_files = str(Path(__file__).resolve().parent) + "/static/"
+
+        self.upstream_connector = UpstreamConnector()
+        self.snapcast_hub = SnapcastControlHub(self.upstream_connector)
+        self.snapcast_hub.connect_options = self.config.hydraplay.websocket.upstream_connect_options()
+        self.snapcast_hub.batch_window = self.config.hydraplay.websocket.batch_window
+        self.snapcast_hub.set_command_shaping(self.config.hydraplay.command_shaping)
+        self.proxy_metrics = ProxyMetrics()
+        self.connections = ProxyConnections()
+        self.link = CoordinatorLink("ws://127.0.0.1:{0}/internal/workers?worker={1}".format(coordinator_port, worker),
+                                    self.config, self.proxy_metrics)
+        self.mopidy_pool = RemoteMopidyPool(self.config, self.upstream_connector, self.link)
+        self.snapcast_hub.stream_listeners.append(self.mopidy_pool.on_stream_assigned)
+        self.audio_relays = AudioRelayManager(self.config)
+        self.static_cache = StaticAssetCache()
+        self.player_manifest = AssetManifest(self.static_files + "/player")
+        self.player_manifest.build()
+        self.snapweb_manifest = AssetManifest(self.static_files + "/snapweb")
+        self.snapweb_manifest.build()
+
+    def routes(self):
+        return tornado.web.Application([
+            (r'/socket/(.*)', WebsocketProxyHandler, {"connector": self.upstream_connector,
+                                                       "snapcast_hub": self.snapcast_hub,
+                                                       "mopidy_pool": self.mopidy_pool,
+                                                       "audio_relays": self.audio_relays,
+                                                       "metrics": self.proxy_metrics,
+                                                       "connections": self.connections,
+                                                       "websocket_settings": self.config.hydraplay.websocket}),
+            (r"/api/logs/tail", CoordinatorSocketHandler, {"coordinator_url": self.coordinator_socket_url,
+                                                            "connections": self.connections}),
+            (r"/api/(.*)", CoordinatorProxyHandler, {"coordinator_url": self.coordinator_url,
+                                                     "client": self.api_client}),
+            (r"/client/(.*)", StaticFileHandler, {"path": self.static_files+"/snapweb", "default_filename": "index.html",
+                                                  "cache": self.static_cache, "manifest": self.snapweb_manifest}),
+            (r"/(.*)", StaticFileHandler, {"path": self.static_files+"/player", "default_filename": "index.html",
+                                           "cache": self.static_cache, "manifest": self.player_manifest}),
+        ], cookie_secret=self.config.hydraplay.cookie_secret)
+
+    def run(self):
+        run_event_loop(self.serve(), self.config.hydraplay.uvloop)
+
+    async def serve(self):
+        self.stopping = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.shutdown)
+
+        self.api_client = AsyncHTTPClient(force_instance=True, max_clients=self.MAX_API_REQUESTS)
+        self.webserver = self.routes()
+        self.http_server = self.webserver.listen(self.server_port, reuse_port=True)
+        self.link.start()
+        parent_check = tornado.ioloop.PeriodicCallback(self.check_parent, self.PARENT_CHECK_INTERVAL)
+        parent_check.start()
+        self.logger.info("Worker {0} listening on port {1}".format(self.worker, self.server_port))
+
+        await self.stopping.wait()
+        parent_check.stop()
+        self.http_server.stop()
+        await self.connections.close_all(self.config.hydraplay.shutdown.drain_timeout)
+        self.mopidy_pool.close()
+        self.snapcast_hub.close()
+        self.link.close()
+        self.api_client.close()
+
+    def check_parent(self):
+        # the coordinator was killed without stopping its workers
+        if os.getppid() != self.parent_pid:
+            self.logger.warning("Coordinator is gone, stopping worker {0}.".format(self.worker))
+            self.shutdown()
+
+    def shutdown(self):
+        self.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="hydraplay-worker")
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--worker", type=int, required=True)
+    parser.add_argument("--coordinator-port", type=int, required=True)
+    parser.add_argument("--loglevel", default="info")
+    args = parser.parse_args()
+
+    # output is read and logged by the coordinator, see WorkerLogParser
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+    LogPipeline.install([handler], getattr(logging, args.loglevel.upper(), logging.INFO))
+    # the worker runs in its own session (see Executor.run), so Ctrl-C in the terminal
+    # only reaches the coordinator, which stops the workers with SIGTERM. A SIGINT sent
+    # to the worker directly is ignored for the same reason.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    HydraWorker(args.config, args.worker, args.coordinator_port).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import json
+import logging
+
+from tornado import ioloop, locks
+from tornado.concurrent import Future
+from tornado.websocket import WebSocketClosedError
+
+from hydraplay.server.TokenBucket import TokenBucket
+
+
+class CommandWindow:
+    """
+    A shaped command which was just sent upstream, the newest command for the same
+    target waiting for the end of the window and the commands it superseded.
+    """
+
+    __slots__ = ('timeout', 'pending', 'superseded')
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.pending = None
+        self.superseded = []
+
+
+class JsonRpcHub:
+    """
+    Shares one upstream JSON-RPC websocket between many proxied clients.
+
+    Request ids of the clients are rewritten to hub unique ids, so responses can be
+    routed back to the client which sent the request. Messages without a pending
+    id (notifications, events) are sent to every subscriber. With a batch_window the
+    subscribers which asked for batches get the notifications of a burst together
+    as one JSON-RPC batch, the others get them one by one as before. Identical
+    read requests which are in flight at the same time are sent upstream only once.
+    Subclasses keep a model of the upstream state by overriding the hooks below.
+
+    Commands like volume changes are shaped: the first one for a target is sent at
+    once, the ones following within coalesce_window seconds are held back and only
+    the newest is sent when the window ends. The superseded requests are answered
+    with its response. Each subscriber may send command_rate requests per second
+    upstream (after a burst), requests above get a JSON-RPC error.
+    """
+
+    # methods whose concurrent identical calls are collapsed into one upstream call
+    coalesce_methods = frozenset()
+
+    # commands of which only the last one within the coalesce window is sent, e.g. volume sliders
+    shaped_methods = frozenset()
+
+    RATE_LIMIT_ERROR = {'code': -32000, 'message': "Rate limit exceeded"}
+    UNAVAILABLE_ERROR = {'code': -32001, 'message': "Upstream not connected"}
+
+    def __init__(self, uri, connector):
+        self.logger = logging.getLogger(__name__)
+        self.uri = uri
+        self.connector = connector
+        self.connection = None
+        self.connect_lock = locks.Lock()
+        self.subscribers = set()
+        self.pending = {}
+        self.inflight = {}
+        self.last_id = 0
+        self.upstream_messages = 0
+        # keyword arguments of websocket_connect, e.g. compression_options
+        self.connect_options = {}
+        # seconds, 0 sends every notification at once
+        self.batch_window = 0
+        self.batch = []
+        self.batch_timeout = None
+        self.batches = 0
+        # subscribers which read JSON-RPC batches
+        self.batch_subscribers = set()
+        # seconds, 0 sends every command at once
+        self.coalesce_window = 0
+        self.windows = {}
+        self.coalesced = 0
+        # upstream requests per second of one subscriber, 0 is unlimited
+        self.command_rate = 0
+        self.command_burst = 1
+        self.limits = {}
+        self.rate_limited = 0
+
+    async def subscribe(self, subscriber, batches=False):
+        await self.ensure_connected()
+        self.subscribers.add(subscriber)
+        if batches:
+            self.batch_subscribers.add(subscriber)
+        self.limits[subscriber] = TokenBucket(self.command_rate, self.command_burst)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        self.batch_subscribers.discard(subscriber)
+        self.limits.pop(subscriber, None)
+
+    async def ensure_connected(self):
+        async with self.connect_lock:
+            if self.connection is None:
+                self.connection = await self.connector.connect(self.uri, **self.connect_options)
+                ioloop.IOLoop.current().spawn_callback(self.read_loop, self.connection)
+                self.on_connect()
+
+    def next_id(self):
+        self.last_id += 1
+        return self.last_id
+
+    def send(self, subscriber, message):
+        """Handles a message received from a subscriber."""
+        try:
+            request = json.loads(message)
+        except ValueError:
+            self.logger.warning("Dropping invalid JSON-RPC message from client.")
+            return
+
+        if isinstance(request, list):
+            for entry in request:
+                self.send_request(subscriber, entry)
+        else:
+            self.send_request(subscriber, request)
+
+    def send_request(self, subscriber, request):
+        if not isinstance(request, dict) or 'method' not in request:
+            return
+
+        if 'id' not in request:
+            # client notification, nothing to route back
+            if self.within_limit(subscriber):
+                self.write_upstream(request)
+            return
+
+        if self.handle_request(subscriber, request):
+            return
+
+        if self.join_inflight(subscriber, request):
+            return
+
+        key = None
+        if self.coalesce_window and request['method'] in self.shaped_methods:
+            key = self.command_key(request)
+            window = self.windows.get(key)
+            if window is not None:
+                # last write wins, the command held back so far is superseded
+                if window.pending is not None:
+                    window.superseded.append(window.pending)
+                    self.coalesced += 1
+                window.pending = (subscriber, request)
+                return
+
+        if not self.within_limit(subscriber):
+            self.reply(subscriber, request, {'jsonrpc': '2.0', 'error': self.RATE_LIMIT_ERROR})
+            return
+
+        if key is not None:
+            self.open_window(key)
+        self.forward(subscriber, request)
+
+    def set_command_shaping(self, settings):
+        """Applies the hydraplay.command_shaping settings, the limits of subscribed clients stay."""
+        self.coalesce_window = settings.coalesce_window
+        self.command_rate = settings.rate
+        self.command_burst = settings.burst
+
+    def within_limit(self, subscriber):
+        limit = self.limits.get(subscriber)
+        if limit is None or limit.take():
+            return True
+        self.rate_limited += 1
+        return False
+
+    def command_key(self, request):
+        """The target of a shaped command, commands with the same key supersede each other."""
+        return request['method']
+
+    def open_window(self, key):
+        timeout = ioloop.IOLoop.current().call_later(self.coalesce_window, self.close_window, key)
+        self.windows[key] = CommandWindow(timeout)
+
+    def close_window(self, key):
+        window = self.windows.pop(key)
+        if window.pending is None:
+            return
+        # the newest command is sent and opens the next window
+        target, request = window.pending
+        self.open_window(key)
+        self.forward(target, request, window.superseded)
+
+    def call(self, method, params=None):
+        """Sends a request on behalf of the hub itself, returns a Future with the response."""
+        future = Future()
+        request = {'jsonrpc': '2.0', 'id': None, 'method': method}
+        if params is not None:
+            request['params'] = params
+        if not self.join_inflight(future, request):
+            self.forward(future, request)
+        return future
+
+    def join_inflight(self, target, request):
+        if request['method'] not in self.coalesce_methods:
+            return False
+        waiters = self.inflight.get(self.inflight_key(request))
+        if waiters is None:
+            return False
+        waiters.append((target, request))
+        return True
+
+    def inflight_key(self, request):
+        return request['method'], json.dumps(request.get('params'), sort_keys=True)
+
+    def forward(self, target, request, superseded=()):
+        key = None
+        if request['method'] in self.coalesce_methods:
+            key = self.inflight_key(request)
+            self.inflight[key] = [(target, request)]
+
+        upstream_id = self.next_id()
+        if superseded:
+            # the superseded commands get the response of the command which replaced them
+            key = ('superseded', upstream_id)
+            self.inflight[key] = [(target, request)] + list(superseded)
+        self.pending[upstream_id] = (target, request, key)
+        if not self.write_upstream(dict(request, id=upstream_id)):
+            # never sent, no response will come for it
+            del self.pending[upstream_id]
+            self.answer(target, request, key, {'jsonrpc': '2.0', 'error': self.UNAVAILABLE_ERROR})
+
+    def write_upstream(self, request):
+        """Returns False when the request could not be sent."""
+        if self.connection is None:
+            return False
+        self.upstream_messages += 1
+        try:
+            self.connection.write_message(json.dumps(request))
+        except WebSocketClosedError:
+            self.logger.info("Upstream {0} closed while sending.".format(self.uri))
+            return False
+        return True
+
+    def reply(self, subscriber, request, response):
+        self.send_reply(subscriber, json.dumps(dict(response, id=request['id'])))
+
+    def send_reply(self, subscriber, message):
+        """Sends a serialized response, the notifications received before it are sent first."""
+        self.flush_batch()
+        self.write_subscriber(subscriber, message)
+
+    def write_subscriber(self, subscriber, message):
+        try:
+            subscriber.write_message(message)
+        except WebSocketClosedError:
+            self.subscribers.discard(subscriber)
+            self.batch_subscribers.discard(subscriber)
+
+    def broadcast(self, message, exclude=None):
+        batched = self.batch_window and exclude is None and self.batch_subscribers
+        if batched:
+            self.batch.append(message)
+            if self.batch_timeout is None:
+                self.batch_timeout = ioloop.IOLoop.current().call_later(self.batch_window, self.flush_batch)
+        else:
+            self.flush_batch()
+        for subscriber in list(self.subscribers):
+            if subscriber is not exclude and not (batched and subscriber in self.batch_subscribers):
+                self.write_subscriber(subscriber, message)
+
+    def flush_batch(self):
+        if self.batch_timeout is not None:
+            ioloop.IOLoop.current().remove_timeout(self.batch_timeout)
+            self.batch_timeout = None
+        if not self.batch:
+            return
+        messages = self.batch
+        self.batch = []
+        self.batches += 1
+        # the messages are JSON already, a batch is their array
+        message = messages[0] if len(messages) == 1 else "[" + ",".join(messages) + "]"
+        for subscriber in list(self.batch_subscribers):
+            self.write_subscriber(subscriber, message)
+
+    async def read_loop(self, connection):
+        while True:
+            message = await connection.read_message()
+            if message is None:
+                break
+            try:
+                self.dispatch(message)
+            except Exception as e:
+                self.logger.error("Error while dispatching upstream message from {0}: {1}".format(self.uri, e))
+
+        self.logger.info("Upstream {0} disconnected.".format(self.uri))
+        if self.connection is connection:
+            self.connection = None
+        self.disconnect()
+
+    def dispatch(self, message):
+        data = json.loads(message)
+        if isinstance(data, list):
+            for entry in data:
+                self.dispatch_entry(entry, json.dumps(entry))
+        else:
+            self.dispatch_entry(data, message)
+
+    def dispatch_entry(self, data, message):
+        pending = self.pending.pop(data.get('id'), None) if isinstance(data, dict) else None
+        if pending is None:
+            self.on_notification(data)
+            self.broadcast(message)
+            return
+
+        target, request, key = pending
+        self.on_response(target, request, data)
+        self.answer(target, request, key, data)
+
+    def answer(self, target, request, key, response):
+        """Sends the response to the target and every request waiting for the same one."""
+        waiters = self.inflight.pop(key, None) if key is not None else None
+        for waiter, waiting_request in (waiters or [(target, request)]):
+            if isinstance(waiter, Future):
+                if not waiter.done():
+                    waiter.set_result(response)
+            else:
+                self.reply(waiter, waiting_request, response)
+
+    def disconnect(self):
+        # pending requests can not be answered anymore, close the clients so they reconnect
+        for waiters in self.inflight.values():
+            for waiter, request in waiters:
+                if isinstance(waiter, Future) and not waiter.done():
+                    waiter.cancel()
+        for target, request, key in self.pending.values():
+            if isinstance(target, Future) and not target.done():
+                target.cancel()
+        self.pending.clear()
+        self.inflight.clear()
+        for window in self.windows.values():
+            ioloop.IOLoop.current().remove_timeout(window.timeout)
+        self.windows.clear()
+        self.flush_batch()
+        self.on_disconnect()
+
+        for subscriber in list(self.subscribers):
+            subscriber.close(1012, "upstream restarted")
+        self.subscribers.clear()
+        self.batch_subscribers.clear()
+        self.limits.clear()
+
+    def stats(self):
+        return {
+            'uri': self.uri,
+            'connected': self.connection is not None,
+            'subscribers': len(self.subscribers),
+            'pending': len(self.pending),
+            'upstream_messages': self.upstream_messages,
+            'batches': self.batches,
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited
+        }
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def handle_request(self, subscriber, request):
+        """Answers a request without the upstream, returns True when it was handled."""
+        return False
+
+    def on_connect(self):
+        pass
+
+    def on_response(self, target, request, response):
+        pass
+
+    def on_notification(self, message):
+        pass
+
+    def on_disconnect(self):
+        pass
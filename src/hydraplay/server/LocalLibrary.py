@@ -0,0 +1,105 @@
+import logging
+import os
+import shutil
+import time
+
+
+class LocalLibrary:
+    """
+    The library of the Mopidy local extension, shared by all Mopidy instances.
+
+    Every instance reads the library from <data_dir>/local, which is a symlink to the
+    current generation below library_dir. A scan writes a new generation next to it
+    and the symlink is swapped when the scan succeeded, so instances never see a half
+    written library and the library exists only once, no matter how many instances run.
+    """
+
+    LIBRARY_NAME = "local"
+    CURRENT = "current"
+
+    def __init__(self, config):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+
+    def get_data_dir(self):
+        return self.config.mopidy.data_dir
+
+    def get_library_dir(self):
+        return self.config.mopidy.library_dir
+
+    def get_current(self):
+        return os.path.join(self.get_library_dir(), self.CURRENT)
+
+    def setup(self):
+        """Links the library of the instances to the current generation, adopts an existing library."""
+        link = os.path.join(self.get_data_dir(), self.LIBRARY_NAME)
+        os.makedirs(self.get_library_dir(), exist_ok=True)
+
+        if os.path.isdir(link) and not os.path.islink(link):
+            # library of an earlier HydraPlay version, or put there by hand, it is never deleted
+            self.adopt(link)
+        elif not os.path.lexists(self.get_current()):
+            generation = os.path.join(self.get_library_dir(), "library-initial")
+            os.makedirs(generation, exist_ok=True)
+            self.switch(generation)
+
+        if os.path.islink(link) and os.readlink(link) == self.get_current():
+            return
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(self.get_current(), link)
+
+    def adopt(self, library):
+        """Moves a library directory into a new generation and makes it the current one."""
+        if not os.path.lexists(self.get_current()):
+            generation = os.path.join(self.get_library_dir(), "library-initial")
+        else:
+            generation = os.path.join(self.get_library_dir(), "library-adopted-{0}".format(int(time.time())))
+            self.logger.warning("{0} is a directory, it replaces the current library {1}, which is kept.".format(
+                library, os.path.realpath(self.get_current())))
+        shutil.move(library, generation)
+        self.switch(generation)
+
+    def prepare_scan(self, job_id):
+        """
+        Creates the data_dir for a scan. The current library is copied into it, the
+        scan only has to look at changed files. Album art is hard linked, not copied.
+        """
+        self.setup()
+        data_dir = os.path.join(self.get_library_dir(), "scan-{0}".format(job_id))
+        shutil.rmtree(data_dir, ignore_errors=True)
+        os.makedirs(data_dir)
+        shutil.copytree(os.path.realpath(self.get_current()), os.path.join(data_dir, self.LIBRARY_NAME),
+                        copy_function=self.link_or_copy)
+        return data_dir
+
+    def link_or_copy(self, source, destination):
+        if source.endswith((".db", ".db-journal", ".db-wal", ".json.gz")):
+            # written in place by Mopidy
+            return shutil.copy2(source, destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
+        return destination
+
+    def publish(self, data_dir):
+        previous = os.path.realpath(self.get_current())
+        target = os.path.join(self.get_library_dir(), os.path.basename(data_dir).replace("scan-", "library-"))
+        os.rename(os.path.join(data_dir, self.LIBRARY_NAME), target)
+        shutil.rmtree(data_dir, ignore_errors=True)
+        self.switch(target)
+        if previous != target and os.path.dirname(previous) == self.get_library_dir():
+            shutil.rmtree(previous, ignore_errors=True)
+        self.logger.info("Local library switched to {0}".format(target))
+
+    def discard(self, data_dir):
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    def switch(self, generation):
+        # replacing a symlink with rename is atomic
+        temporary_link = self.get_current() + ".tmp"
+        if os.path.lexists(temporary_link):
+            os.remove(temporary_link)
+        os.symlink(generation, temporary_link)
+        os.replace(temporary_link, self.get_current())
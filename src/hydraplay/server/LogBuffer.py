@@ -0,0 +1,136 @@
+import logging
+import threading
+from collections import deque
+
+
+class LogFilter:
+    """
+    Selects log lines by source, minimum level and a text the message contains, case
+    insensitive. Built from the query arguments sources (comma separated), level and
+    pattern. The pattern is plain text, a regular expression of a client could keep
+    the event loop busy for ages.
+    """
+
+    MAX_PATTERN_LENGTH = 200
+
+    def __init__(self, sources=None, level=logging.NOTSET, pattern=None):
+        self.sources = set(sources) if sources else None
+        self.level = level
+        self.pattern = pattern.lower() if pattern else None
+
+    @classmethod
+    def from_request(cls, handler):
+        """Raises ValueError for an unknown level or a too long pattern."""
+        sources = [source for source in handler.get_query_argument("sources", "").split(",") if source]
+        level_name = handler.get_query_argument("level", "NOTSET").upper()
+        level = logging.getLevelName(level_name)
+        if not isinstance(level, int):
+            raise ValueError("unknown level {0}".format(level_name))
+        pattern = handler.get_query_argument("pattern", None)
+        if pattern is not None and len(pattern) > cls.MAX_PATTERN_LENGTH:
+            raise ValueError("pattern must not be longer than {0} characters".format(cls.MAX_PATTERN_LENGTH))
+        return cls(sources, level, pattern)
+
+    def matches(self, entry):
+        seq, created, source, level, message = entry
+        if level < self.level:
+            return False
+        if self.sources is not None and source not in self.sources:
+            return False
+        return self.pattern is None or self.pattern in message.lower()
+
+
+class LogBufferHandler(logging.Handler):
+
+    def __init__(self, buffer):
+        super().__init__()
+        self.buffer = buffer
+        self.setFormatter(logging.Formatter("%(message)s"))
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.buffer.get_source(record.name), record.created, record.levelno,
+                               self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class LogBuffer:
+    """
+    The recent log lines of HydraPlay and of each child process, kept in memory.
+
+    Every source (Mopidy_0, Snapcast Server, HydraPlay, ...) has its own ring buffer
+    of at most max_bytes, the oldest lines are dropped first, so a chatty process
+    can not push the lines of the others out. Lines are numbered, readers ask for
+    the lines after the last number they have seen.
+    """
+
+    # the loggers of the child processes, see Executor
+    PROCESS_LOGGER = "hydraplay.server.Executor."
+    OWN_SOURCE = "HydraPlay"
+    # per line, besides the message
+    ENTRY_OVERHEAD = 100
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.sources = {}
+        self.sizes = {}
+        self.dropped = {}
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.handler = LogBufferHandler(self)
+
+    def get_source(self, logger_name):
+        if logger_name.startswith(self.PROCESS_LOGGER):
+            return logger_name[len(self.PROCESS_LOGGER):]
+        return self.OWN_SOURCE
+
+    def append(self, source, created, level, message):
+        size = len(message) + self.ENTRY_OVERHEAD
+        with self.lock:
+            self.seq += 1
+            lines = self.sources.get(source)
+            if lines is None:
+                lines = self.sources[source] = deque()
+                self.sizes[source] = 0
+                self.dropped[source] = 0
+            lines.append((self.seq, created, source, level, message))
+            self.sizes[source] += size
+            while self.sizes[source] > self.max_bytes and len(lines) > 1:
+                dropped = lines.popleft()
+                self.sizes[source] -= len(dropped[4]) + self.ENTRY_OVERHEAD
+                self.dropped[source] += 1
+
+    def read(self, log_filter, after=0, limit=None):
+        """Returns the newest matching lines numbered above after, oldest first."""
+        with self.lock:
+            # only collected under the lock, the logging threads do not wait for the filter
+            candidates = []
+            for lines in self.sources.values():
+                for entry in reversed(lines):
+                    if entry[0] <= after:
+                        break
+                    candidates.append(entry)
+            last = self.seq
+        entries = [entry for entry in candidates if log_filter.matches(entry)]
+        entries.sort()
+        if limit is not None:
+            entries = entries[-limit:] if limit else []
+        return entries, last
+
+    def start(self):
+        logging.getLogger().addHandler(self.handler)
+
+    def stop(self):
+        logging.getLogger().removeHandler(self.handler)
+
+    @staticmethod
+    def to_dict(entry):
+        seq, created, source, level, message = entry
+        return {'seq': seq, 'time': created, 'source': source, 'level': logging.getLevelName(level),
+                'message': message}
+
+    def stats(self):
+        with self.lock:
+            return {source: {'lines': len(lines), 'bytes': self.sizes[source], 'dropped': self.dropped[source]}
+                    for source, lines in sorted(self.sources.items())}
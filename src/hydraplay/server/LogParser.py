@@ -0,0 +1,92 @@
+import logging
+import re
+
+
+class LogParser:
+    """
+    Turns one output line of a child process into a (level, message) tuple.
+    Returns None for lines which should not be logged.
+    """
+
+    def parse(self, line):
+        return logging.DEBUG, line
+
+
+class MopidyLogParser(LogParser):
+    """
+    Mopidy writes every record as a header line with level, timestamp and logger
+    name, followed by the indented message (see the format in mopidy.conf.j2).
+    The header is remembered and logged together with the message line.
+    """
+
+    header = re.compile(r'^(DEBUG|INFO|WARNING|ERROR|CRITICAL)\s+\d+-\d+-\d+\s\d+:\d+:\d+,\d+\s*(\S*)')
+
+    levels = {
+        'DEBUG': logging.DEBUG,
+        'INFO': logging.INFO,
+        'WARNING': logging.WARNING,
+        'ERROR': logging.ERROR,
+        'CRITICAL': logging.CRITICAL
+    }
+
+    def __init__(self):
+        self.level = logging.DEBUG
+        self.name = None
+
+    def parse(self, line):
+        match = self.header.match(line)
+        if match:
+            self.level = self.levels[match.group(1)]
+            self.name = match.group(2)
+            return None
+
+        message = line.strip()
+        if not message:
+            return None
+        if self.name:
+            message = "{0}: {1}".format(self.name, message)
+        return self.level, message
+
+
+class SnapcastLogParser(LogParser):
+    """
+    Removes timestamp and level from snapserver lines like
+    "2021-01-01 12-00-00.123 [Notice] (Server) message".
+    """
+
+    line_pattern = re.compile(r'^\d+-\d+-\d+\s\d+-\d+-\d+\.\d+\s\[(\w+)\]\s?(.*)$')
+
+    levels = {
+        'Trace': logging.DEBUG,
+        'Debug': logging.DEBUG,
+        'Info': logging.INFO,
+        'Notice': logging.INFO,
+        'Warning': logging.WARNING,
+        'Error': logging.ERROR,
+        'Fatal': logging.CRITICAL
+    }
+
+    def parse(self, line):
+        match = self.line_pattern.match(line)
+        if match is None:
+            return logging.DEBUG, line
+        return self.levels.get(match.group(1), logging.DEBUG), match.group(2)
+
+
+class WorkerLogParser(LogParser):
+    """
+    Worker processes of HydraPlay log "LEVEL logger: message". Lines without a level,
+    like the lines of a traceback, keep the level of the record before them.
+    """
+
+    line_pattern = re.compile(r'^(DEBUG|INFO|WARNING|ERROR|CRITICAL) (.*)$')
+
+    def __init__(self):
+        self.level = logging.DEBUG
+
+    def parse(self, line):
+        match = self.line_pattern.match(line)
+        if match is None:
+            return self.level, line
+        self.level = logging.getLevelName(match.group(1))
+        return self.level, match.group(2)
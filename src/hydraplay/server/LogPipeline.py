@@ -0,0 +1,208 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from hydraplay.server.TokenBucket import TokenBucket
+
+
+class LogThrottle:
+    """
+    Rate limit and deduplication for the output of one child process.
+
+    A line equal to the line before it is not logged, "N repeated lines suppressed" is
+    logged when a different line arrives. Lines above rate per second (after a burst)
+    are dropped, errors always pass. While lines are suppressed a summary is logged
+    at most every SUMMARY_INTERVAL seconds, flush() logs the rest when the process exits.
+    """
+
+    SUMMARY_INTERVAL = 10
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.last_message = None
+        self.repeated = 0
+        self.rate_limited = 0
+        self.summary_at = 0
+        self.suppressed_repeats = 0
+        self.suppressed_rate = 0
+
+    def filter(self, level, message):
+        """Returns the (level, message) entries to log for one line, summaries included."""
+        now = self.clock()
+        if not self.repeated and not self.rate_limited:
+            self.summary_at = now
+
+        entries = []
+        if message == self.last_message:
+            self.repeated += 1
+            self.suppressed_repeats += 1
+        else:
+            if self.repeated:
+                entries.append(self.repeat_summary())
+            self.last_message = message
+            if level >= logging.ERROR or self.bucket.take(now):
+                if self.rate_limited:
+                    entries.append(self.rate_summary())
+                entries.append((level, message))
+            else:
+                self.rate_limited += 1
+                self.suppressed_rate += 1
+
+        if (self.repeated or self.rate_limited) and now - self.summary_at >= self.SUMMARY_INTERVAL:
+            entries.extend(self.flush())
+            self.summary_at = now
+        return entries
+
+    def repeat_summary(self):
+        entry = (logging.WARNING, "{0} repeated lines suppressed".format(self.repeated))
+        self.repeated = 0
+        return entry
+
+    def rate_summary(self):
+        entry = (logging.WARNING, "{0} lines suppressed by the rate limit".format(self.rate_limited))
+        self.rate_limited = 0
+        return entry
+
+    def flush(self):
+        entries = []
+        if self.repeated:
+            entries.append(self.repeat_summary())
+        if self.rate_limited:
+            entries.append(self.rate_summary())
+        return entries
+
+    def stats(self):
+        return {'repeated': self.suppressed_repeats, 'rate_limited': self.suppressed_rate}
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler which drops and counts records while the queue is full instead of blocking."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Moves the writing of log records off the event loop. Loggers only put the record
+    into a bounded queue, a writer thread formats the records and writes them to the
+    handlers in batches, with one flush per batch. Records which do not fit into the
+    queue are dropped, the writer logs how many.
+    """
+
+    QUEUE_SIZE = 10000
+    BATCH_SIZE = 500
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, handlers, queue_size=QUEUE_SIZE):
+        self.logger = logging.getLogger(__name__)
+        self.handlers = handlers
+        self.queue = queue.Queue(queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.stopping = threading.Event()
+        self.thread = None
+        self.written = 0
+        self.batches = 0
+        self.reported_drops = 0
+
+    @classmethod
+    def install(cls, handlers, level):
+        """
+        Starts a pipeline to the handlers and makes it the only handler of the root logger.
+        The queued records are written when the interpreter exits.
+        """
+        pipeline = cls(handlers)
+        pipeline.handler.setLevel(level)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(pipeline.handler)
+        root.setLevel(level)
+        pipeline.start()
+        atexit.register(pipeline.stop)
+        return pipeline
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="LogPipeline", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        """Writes the queued records and stops the writer thread."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                records = [self.queue.get(timeout=self.POLL_INTERVAL)]
+            except queue.Empty:
+                continue
+            while len(records) < self.BATCH_SIZE:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            dropped = self.handler.dropped
+            if dropped != self.reported_drops:
+                records.append(self.drop_record(dropped - self.reported_drops))
+                self.reported_drops = dropped
+
+            for handler in self.handlers:
+                self.write(handler, records)
+            self.written += len(records)
+            self.batches += 1
+
+    def drop_record(self, count):
+        return self.logger.makeRecord(self.logger.name, logging.WARNING, __file__, 0,
+                                      "{0} log records dropped, the log queue was full".format(count), None, None)
+
+    def write(self, handler, records):
+        if not isinstance(handler, logging.StreamHandler):
+            for record in records:
+                handler.handle(record)
+            return
+
+        handler.acquire()
+        try:
+            lines = []
+            for record in records:
+                if record.levelno < handler.level or not handler.filter(record):
+                    continue
+                if isinstance(handler, logging.handlers.BaseRotatingHandler) and handler.shouldRollover(record):
+                    self.write_lines(handler, lines)
+                    lines = []
+                    handler.doRollover()
+                lines.append(handler.format(record) + handler.terminator)
+            self.write_lines(handler, lines)
+        except Exception:
+            handler.handleError(records[-1])
+        finally:
+            handler.release()
+
+    @staticmethod
+    def write_lines(handler, lines):
+        if lines:
+            handler.stream.write("".join(lines))
+            handler.flush()
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.handler.dropped
+        }
@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+
+from tornado import ioloop, locks
+
+from hydraplay.server.LocalLibrary import LocalLibrary
+from hydraplay.server.LogParser import MopidyLogParser
+
+
+class ScanJob:
+    """
+    One run of "mopidy local scan". Clients wait on the job for progress updates.
+    """
+
+    QUEUED = "queued"
+    INDEXING = "indexing"
+    SCANNING = "scanning"
+    UNCHANGED = "unchanged"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.state = self.QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.files = 0
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.scanned = 0
+        self.total = 0
+        self.error = None
+        self.version = 0
+        self.updated = locks.Condition()
+
+    def is_finished(self):
+        return self.state in (self.UNCHANGED, self.DONE, self.FAILED)
+
+    def update(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        if self.is_finished() and self.finished_at is None:
+            self.finished_at = time.time()
+        self.version += 1
+        self.updated.notify_all()
+
+    async def wait_for_update(self, version, timeout):
+        """Waits until the job changed after the given version, returns False on timeout."""
+        deadline = ioloop.IOLoop.current().time() + timeout
+        while self.version == version:
+            if not await self.updated.wait(timeout=deadline):
+                return False
+        return True
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'files': self.files,
+            'added': self.added,
+            'changed': self.changed,
+            'removed': self.removed,
+            'scanned': self.scanned,
+            'total': self.total,
+            'error': self.error
+        }
+
+
+class ScanLogParser(MopidyLogParser):
+    """
+    Logs the output of "mopidy local scan" and reads the progress of the scan from it.
+    """
+
+    progress_pattern = re.compile(r'Scanned (\d+) of (\d+) files')
+    found_pattern = re.compile(r'Found (\d+) files? in media_dir')
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+
+    def parse(self, line):
+        parsed = super().parse(line)
+        if parsed is None:
+            return None
+
+        match = self.progress_pattern.search(parsed[1])
+        if match:
+            self.job.update(scanned=int(match.group(1)), total=int(match.group(2)))
+        else:
+            match = self.found_pattern.search(parsed[1])
+            if match:
+                self.job.update(total=int(match.group(1)))
+        return parsed
+
+
+class MediaScanner:
+    """
+    Runs scans of the local media library, one at a time.
+
+    A request while a scan is running joins the running job. Before Mopidy is started
+    the media_dir is walked and compared with an index of the mtime and size of every
+    file from the last successful scan, the scan is skipped when nothing changed.
+    Walking 200k files costs seconds, a Mopidy scan of them most of an hour.
+
+    A single changed file still runs "mopidy local scan" over the whole media_dir.
+    It starts from a copy of the current library, so Mopidy only reads the tags of
+    added and changed files, but it walks and stats every file again. The index is
+    kept in library_dir next to the library it describes.
+
+    The scan writes a new generation of the shared LocalLibrary, which is switched
+    for all instances at once when the scan succeeded.
+    """
+
+    INDEX_FILE = "hydraplay-media-index.json"
+    MAX_JOBS = 10
+
+    def __init__(self, config, supervisor, mopidy_pool):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.supervisor = supervisor
+        self.mopidy_pool = mopidy_pool
+        self.library = LocalLibrary(config)
+        self.jobs = OrderedDict()
+        self.current = None
+
+    def get_media_dir(self):
+        local = self.config.mopidy.extensions.get('local', {})
+        if not local.get('enabled'):
+            return None
+        return local.get('media_dir')
+
+    async def setup_library(self):
+        if self.get_media_dir() is None:
+            return
+        try:
+            await ioloop.IOLoop.current().run_in_executor(None, self.library.setup)
+        except OSError as e:
+            self.logger.warning("Could not set up the shared local library: {0}".format(e))
+
+    def get_index_file(self):
+        return os.path.join(self.config.mopidy.library_dir, self.INDEX_FILE)
+
+    def start(self, force=False):
+        """Starts a scan job, or returns the one which is already running."""
+        if self.current is not None and not self.current.is_finished():
+            return self.current
+
+        job = ScanJob()
+        self.current = job
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.MAX_JOBS:
+            self.jobs.popitem(last=False)
+
+        ioloop.IOLoop.current().spawn_callback(self.run, job, force)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def run(self, job, force):
+        media_dir = self.get_media_dir()
+        if media_dir is None:
+            job.update(state=ScanJob.FAILED, error="the local extension is not enabled")
+            return
+
+        try:
+            job.update(state=ScanJob.INDEXING)
+            previous = await ioloop.IOLoop.current().run_in_executor(None, self.load_index)
+            index = await ioloop.IOLoop.current().run_in_executor(None, self.build_index, media_dir)
+
+            added, changed, removed = self.diff(previous, index)
+            job.update(files=len(index), added=added, changed=changed, removed=removed)
+            if previous is not None and not (added or changed or removed) and not force:
+                job.update(state=ScanJob.UNCHANGED)
+                self.logger.info("Media in {0} unchanged, skipping scan.".format(media_dir))
+                return
+
+            job.update(state=ScanJob.SCANNING, total=added + changed)
+            data_dir = await ioloop.IOLoop.current().run_in_executor(None, self.library.prepare_scan, job.id)
+            command = ['mopidy', '--config', self.mopidy_pool.write_scan_config(data_dir), 'local', 'scan']
+            returncode = await self.supervisor.run_once("Media Scan", command, ScanLogParser(job))
+            if returncode != 0:
+                await ioloop.IOLoop.current().run_in_executor(None, self.library.discard, data_dir)
+                job.update(state=ScanJob.FAILED, error="mopidy local scan exited with code {0}".format(returncode))
+                return
+
+            await ioloop.IOLoop.current().run_in_executor(None, self.library.publish, data_dir)
+            await ioloop.IOLoop.current().run_in_executor(None, self.save_index, index)
+            self.mopidy_pool.refresh_libraries()
+            job.update(state=ScanJob.DONE)
+        except Exception as e:
+            self.logger.error("Media scan failed: {0}".format(e))
+            job.update(state=ScanJob.FAILED, error=str(e))
+
+    def diff(self, previous, index):
+        if previous is None:
+            return len(index), 0, 0
+        added = changed = 0
+        for path, entry in index.items():
+            known = previous.get(path)
+            if known is None:
+                added += 1
+            elif known != entry:
+                changed += 1
+        removed = sum(1 for path in previous if path not in index)
+        return added, changed, removed
+
+    def build_index(self, media_dir):
+        index = {}
+        for directory, dirnames, filenames in os.walk(media_dir):
+            for filename in filenames:
+                abspath = os.path.join(directory, filename)
+                try:
+                    stat_result = os.stat(abspath)
+                except OSError:
+                    continue
+                index[os.path.relpath(abspath, media_dir)] = [stat_result.st_mtime_ns, stat_result.st_size]
+        return index
+
+    def load_index(self):
+        try:
+            with open(self.get_index_file()) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save_index(self, index):
+        os.makedirs(self.config.mopidy.library_dir, exist_ok=True)
+        # written to a temporary file first, a crash never leaves a broken index
+        temporary_file = self.get_index_file() + ".tmp"
+        with open(temporary_file, "w") as file:
+            json.dump(index, file)
+        os.replace(temporary_file, self.get_index_file())
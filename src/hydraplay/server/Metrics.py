@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+
+
+def payload_size(message):
+    """Size of a websocket message in bytes, text messages are sent as UTF-8."""
+    if isinstance(message, str) and not message.isascii():
+        # isascii() is a flag check, only names and titles with other characters are encoded
+        return len(message.encode("utf-8"))
+    return len(message)
+
+
+class RouteMetrics:
+    """
+    Counters of one websocket route type, updated in place by the proxy handlers.
+    """
+
+    __slots__ = ('active', 'opened', 'messages_in', 'messages_out', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.active = 0
+        self.opened = 0
+        # in: client to HydraPlay, out: HydraPlay to client
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class ProxyMetrics:
+    """
+    Websocket proxy counters per route type: control (snapserver JSON-RPC),
+    stream (snapserver audio) and mopidy.
+    """
+
+    CONTROL = "control"
+    STREAM = "stream"
+    MOPIDY = "mopidy"
+
+    def __init__(self):
+        self.routes = {
+            self.CONTROL: RouteMetrics(),
+            self.STREAM: RouteMetrics(),
+            self.MOPIDY: RouteMetrics()
+        }
+
+    def get(self, route):
+        return self.routes[route]
+
+    def snapshot(self):
+        """Counters as plain lists, sent by the workers to the coordinator."""
+        return {route: [getattr(metrics, name) for name in RouteMetrics.__slots__]
+                for route, metrics in self.routes.items()}
+
+    def merge(self, snapshot):
+        for route, values in snapshot.items():
+            metrics = self.routes.get(route)
+            if metrics is None:
+                continue
+            for name, value in zip(RouteMetrics.__slots__, values):
+                setattr(metrics, name, getattr(metrics, name) + value)
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the IOLoop wakes up a task sleeping for a fixed interval.
+    A high lag means a callback is blocking the loop and every client waits.
+    """
+
+    def __init__(self, interval=0.5):
+        self.logger = logging.getLogger(__name__)
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.samples = 0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.last_lag = lag
+            self.total_lag += lag
+            self.samples += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
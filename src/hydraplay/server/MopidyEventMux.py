@@ -0,0 +1,259 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from hydraplay.server.JsonRpcHub import JsonRpcHub
+
+
+class MopidyEventMux(JsonRpcHub):
+    """
+    Long-lived connection to one Mopidy instance, shared by all clients of /socket/stream/<n>.
+
+    Playback, tracklist and mixer state is tracked from the events Mopidy sends,
+    so the burst of getter calls a joining client sends is answered from a ready
+    snapshot instead of hitting Mopidy's core actor once per client.
+
+    Every event and every invalidation starts a new generation. The response of a
+    getter only fills the snapshot when it was requested in the current generation,
+    an older one may describe the state before the change.
+    """
+
+    # parameterless getters which are answered from the snapshot
+    snapshot_methods = frozenset([
+        'core.describe',
+        'core.get_version',
+        'core.get_uri_schemes',
+        'core.playback.get_state',
+        'core.playback.get_current_tl_track',
+        'core.playback.get_current_track',
+        'core.playback.get_current_tlid',
+        'core.playback.get_stream_title',
+        'core.tracklist.get_tl_tracks',
+        'core.tracklist.get_tracks',
+        'core.tracklist.get_length',
+        'core.tracklist.get_version',
+        'core.tracklist.get_repeat',
+        'core.tracklist.get_random',
+        'core.tracklist.get_single',
+        'core.tracklist.get_consume',
+        'core.tracklist.get_eot_tlid',
+        'core.tracklist.get_next_tlid',
+        'core.tracklist.get_previous_tlid',
+        'core.mixer.get_volume',
+        'core.mixer.get_mute',
+        'core.playlists.as_list',
+    ])
+
+    # getters whose result only depends on their parameters
+    lookup_methods = frozenset(['core.library.get_images'])
+
+    # fetched right after connecting, so the first client already gets a snapshot
+    prefetch_methods = [
+        'core.describe',
+        'core.playback.get_state',
+        'core.playback.get_current_tl_track',
+        'core.playback.get_stream_title',
+        'core.playback.get_time_position',
+        'core.tracklist.get_tl_tracks',
+        'core.tracklist.get_repeat',
+        'core.tracklist.get_random',
+        'core.mixer.get_volume',
+        'core.mixer.get_mute',
+    ]
+
+    coalesce_methods = snapshot_methods | lookup_methods | frozenset(['core.playback.get_time_position'])
+
+    # sent many times per second while a slider is dragged
+    shaped_methods = frozenset(['core.mixer.set_volume', 'core.playback.seek'])
+
+    # method name prefixes of calls which do not change any state
+    query_prefixes = ('get_', 'as_list', 'browse', 'search', 'lookup', 'filter', 'index', 'slice', 'describe')
+
+    lookup_cache_size = 256
+
+    # an estimated time position is re-synced with Mopidy after this many seconds
+    position_ttl = 5.0
+
+    tracklist_state = ['core.tracklist.get_tl_tracks', 'core.tracklist.get_tracks', 'core.tracklist.get_length',
+                       'core.tracklist.get_version', 'core.tracklist.get_eot_tlid', 'core.tracklist.get_next_tlid',
+                       'core.tracklist.get_previous_tlid']
+
+    options_state = ['core.tracklist.get_repeat', 'core.tracklist.get_random', 'core.tracklist.get_single',
+                     'core.tracklist.get_consume', 'core.tracklist.get_eot_tlid', 'core.tracklist.get_next_tlid',
+                     'core.tracklist.get_previous_tlid']
+
+    current_track_state = ['core.playback.get_current_tl_track', 'core.playback.get_current_track',
+                           'core.playback.get_current_tlid', 'core.playback.get_stream_title',
+                           'core.tracklist.get_eot_tlid', 'core.tracklist.get_next_tlid',
+                           'core.tracklist.get_previous_tlid']
+
+    def __init__(self, instance, port, connector):
+        super().__init__("ws://127.0.0.1:{0}/mopidy/ws".format(port), connector)
+        self.logger = logging.getLogger(__name__ + "." + str(instance))
+        self.instance = instance
+        self.port = port
+        self.snapshot = {}
+        self.lookups = OrderedDict()
+        self.position = None
+        self.answered_from_snapshot = 0
+        self.generation = 0
+        # generation in which each getter in flight was sent, by inflight_key
+        self.fill_generations = {}
+        self.stale_fills = 0
+
+    def on_connect(self):
+        for method in self.prefetch_methods:
+            self.call(method)
+
+    def on_disconnect(self):
+        self.snapshot.clear()
+        self.lookups.clear()
+        self.position = None
+        self.fill_generations.clear()
+
+    def stats(self):
+        stats = super().stats()
+        stats['answered_from_snapshot'] = self.answered_from_snapshot
+        stats['stale_fills'] = self.stale_fills
+        return stats
+
+    def get_playback_state(self):
+        return self.snapshot.get('core.playback.get_state')
+
+    def handle_request(self, subscriber, request):
+        method = request['method']
+        params = request.get('params')
+
+        if method == 'core.playback.get_time_position' and not params:
+            result = self.estimate_position()
+        elif method in self.snapshot_methods and not params and method in self.snapshot:
+            result = self.snapshot[method]
+        elif method in self.lookup_methods:
+            key = json.dumps(params, sort_keys=True)
+            if key not in self.lookups:
+                return False
+            self.lookups.move_to_end(key)
+            result = self.lookups[key]
+        else:
+            return False
+
+        if result is None and method == 'core.playback.get_time_position':
+            return False
+
+        self.answered_from_snapshot += 1
+        self.reply(subscriber, request, {'jsonrpc': '2.0', 'result': result})
+        return True
+
+    def forward(self, target, request, superseded=()):
+        method = request['method']
+        if not self.is_query(method):
+            # a command may change state before Mopidy sends the matching event
+            self.invalidate_namespace(method)
+        elif method in self.coalesce_methods:
+            # identical getters are coalesced, only one per key is in flight
+            self.fill_generations[self.inflight_key(request)] = self.generation
+        super().forward(target, request, superseded)
+
+    def on_response(self, target, request, response):
+        method = request['method']
+        generation = self.fill_generations.pop(self.inflight_key(request), None) \
+            if method in self.coalesce_methods else None
+        if 'result' not in response:
+            return
+        if generation is not None and generation != self.generation:
+            # the state changed while the getter was in flight, it is answered but not kept
+            self.stale_fills += 1
+            return
+
+        params = request.get('params')
+        result = response['result']
+
+        if method == 'core.playback.get_time_position':
+            self.set_position(result)
+        elif method in self.snapshot_methods and not params:
+            self.snapshot[method] = result
+        elif method in self.lookup_methods:
+            self.lookups[json.dumps(params, sort_keys=True)] = result
+            if len(self.lookups) > self.lookup_cache_size:
+                self.lookups.popitem(last=False)
+        elif not self.is_query(method):
+            self.invalidate_namespace(method)
+
+    def on_notification(self, message):
+        if not isinstance(message, dict) or 'event' not in message:
+            return
+
+        self.generation += 1
+        event = message['event']
+        if event == 'playback_state_changed':
+            # keeps the estimate correct when playback stops or resumes without a position event
+            self.set_position(self.estimate_position(playing=message.get('old_state') == 'playing'))
+            self.snapshot['core.playback.get_state'] = message.get('new_state')
+        elif event == 'track_playback_started':
+            tl_track = message.get('tl_track')
+            self.invalidate(self.current_track_state)
+            if tl_track:
+                self.snapshot['core.playback.get_current_tl_track'] = tl_track
+                self.snapshot['core.playback.get_current_track'] = tl_track.get('track')
+                self.snapshot['core.playback.get_current_tlid'] = tl_track.get('tlid')
+            self.set_position(0)
+        elif event in ('track_playback_paused', 'track_playback_resumed', 'seeked'):
+            self.set_position(message.get('time_position'))
+        elif event == 'track_playback_ended':
+            self.invalidate(self.current_track_state)
+            self.position = None
+        elif event == 'stream_title_changed':
+            self.snapshot['core.playback.get_stream_title'] = message.get('title')
+        elif event == 'tracklist_changed':
+            self.invalidate(self.tracklist_state)
+            # every client refreshes its tracklist on this event, have it ready
+            self.call('core.tracklist.get_tl_tracks')
+        elif event == 'options_changed':
+            self.invalidate(self.options_state)
+        elif event == 'volume_changed':
+            self.snapshot['core.mixer.get_volume'] = message.get('volume')
+        elif event == 'mute_changed':
+            self.snapshot['core.mixer.get_mute'] = message.get('mute')
+        elif event in ('playlists_loaded', 'playlist_changed', 'playlist_deleted'):
+            self.invalidate_namespace('core.playlists.')
+
+    def is_query(self, method):
+        return method.rsplit('.', 1)[-1].startswith(self.query_prefixes)
+
+    def invalidate(self, methods):
+        self.generation += 1
+        for method in methods:
+            self.snapshot.pop(method, None)
+
+    def invalidate_namespace(self, method):
+        self.generation += 1
+        namespace = method.rsplit('.', 1)[0] + '.'
+        for cached in [cached for cached in self.snapshot if cached.startswith(namespace)]:
+            del self.snapshot[cached]
+        if namespace == 'core.playback.':
+            self.position = None
+        if namespace == 'core.library.':
+            self.lookups.clear()
+
+    def set_position(self, position):
+        if position is None:
+            self.position = None
+        else:
+            self.position = (position, time.monotonic())
+
+    def estimate_position(self, playing=None):
+        if self.position is None:
+            return None
+        position, since = self.position
+        elapsed = time.monotonic() - since
+        if elapsed > self.position_ttl:
+            return None
+        if playing is None:
+            state = self.get_playback_state()
+            if state is None:
+                return None
+            playing = state == 'playing'
+        if playing:
+            position += int(elapsed * 1000)
+        return position
@@ -1,68 +1,326 @@
+import asyncio
 import logging
-import threading
+import os
 import time
 from pathlib import Path
-from hydraplay.server.Executor import Executor
+from hydraplay.server.HealthProbe import JsonRpcProbe
+from hydraplay.server.LogParser import MopidyLogParser
+from hydraplay.server.MopidyEventMux import MopidyEventMux
 from jinja2 import Environment, FileSystemLoader
 
-class MopidyPoolService(threading.Thread):
-    def __init__(self, config, state):
-        threading.Thread.__init__(self)
+class MopidyPoolService:
+    """
+    Runs one Mopidy instance per stream.
+
+    In elastic mode (mopidy.elastic in the config) only min_instances are started at
+    boot. The others are started when a client opens their stream or a Snapcast group
+    is switched to it, and stopped again when they were idle for idle_timeout seconds.
+    Configs, ports and fifos of all instances exist from the start, so Snapserver
+    streams work no matter which instances are running.
+    """
+
+    RESTART_TIMEOUT = 60
+    # a hibernated process which ignores SIGTERM is killed after this many seconds when it is woken up
+    STOP_TIMEOUT = 10
+    IDLE_CHECK_INTERVAL = 30
+
+    def __init__(self, config, supervisor, connector):
         self.logger = logging.getLogger(__name__)
         self.config = config
-        self.state = state
-        self.executor_pool = []
-        self.shutdown_flag = threading.Event()
+        self.supervisor = supervisor
+        self.connector = connector
+        self.event_muxes = {}
+        self.rendered = {}
+        self.hibernated = set()
+        self.waking = set()
+        self.idle_since = {}
+        self.idle_task = None
+        # callables telling if an instance is used elsewhere, e.g. by the clients of a worker process
+        self.busy_checks = []
+
+    def get_elastic_settings(self):
+        return self.config.mopidy.elastic
+
+    def get_min_instances(self):
+        elastic = self.get_elastic_settings()
+        if not elastic:
+            return self.config.mopidy.instances
+        return min(elastic.min_instances, self.config.mopidy.instances)
+
+    async def start(self):
+        # all instances are launched at once, clients wait for their own instance only
+        await asyncio.gather(*[self.start_instance(instance)
+                               for instance in range(self.config.mopidy.instances)])
+        self.start_idle_loop()
+
+    def start_idle_loop(self):
+        if self.get_elastic_settings() and self.idle_task is None:
+            self.idle_task = asyncio.ensure_future(self.idle_loop())
+
+    async def start_instance(self, instance):
+        if self.config.hydraplay.source_type == "fifo":
+            # create a fifo for each stream
+            command = ['mkfifo', self.get_fifo(instance)]
+            await self.supervisor.run_once("FIFO Task", command)
+
+        self.generate_mopidy_config(instance)
+        if instance < self.get_min_instances():
+            self.spawn(instance)
+        else:
+            self.hibernated.add(instance)
+
+    def ensure_instance(self, instance):
+        """Wakes up a hibernated instance, called when a client needs it."""
+        self.idle_since.pop(instance, None)
+        if instance in self.hibernated and instance in self.rendered and instance not in self.waking:
+            self.logger.info("Waking up Mopidy instance {0}".format(instance))
+            self.waking.add(instance)
+            asyncio.ensure_future(self.wake(instance))
+
+    async def wake(self, instance):
+        try:
+            executor = self.supervisor.get(self.get_label(instance))
+            if executor is not None and executor.is_running():
+                # still stopping after its hibernation, a spawn now would return the dying process
+                await executor.wait_or_kill(self.STOP_TIMEOUT)
+                await executor.wait()
+            # the instance stays hibernated until the new process exists, unless it was retired meanwhile
+            if instance in self.hibernated:
+                self.spawn(instance)
+                self.hibernated.discard(instance)
+        finally:
+            self.waking.discard(instance)
+
+    def on_stream_assigned(self, stream_id):
+        # streams of the instances are named MOPIDY-<n> in snapserver.conf
+        if stream_id and stream_id.startswith("MOPIDY-"):
+            try:
+                self.ensure_instance(int(stream_id[len("MOPIDY-"):]))
+            except ValueError:
+                pass
+
+    async def idle_loop(self):
+        while True:
+            await asyncio.sleep(self.IDLE_CHECK_INTERVAL)
+            elastic = self.get_elastic_settings()
+            if not elastic:
+                continue
+            try:
+                self.check_idle(elastic.idle_timeout)
+            except Exception:
+                # the next check runs anyway, elastic hibernation must not stop silently
+                self.logger.exception("Checking the Mopidy instances for idleness failed")
+
+    def check_idle(self, idle_timeout):
+        now = time.monotonic()
+        for instance in sorted(self.rendered):
+            if instance < self.get_min_instances() or instance in self.hibernated:
+                continue
+            if not self.is_idle(instance):
+                self.idle_since.pop(instance, None)
+            elif now - self.idle_since.setdefault(instance, now) >= idle_timeout:
+                self.hibernate(instance)
+
+    def is_idle(self, instance):
+        if any(check(instance) for check in self.busy_checks):
+            return False
+        event_mux = self.event_muxes.get(instance)
+        if event_mux is None:
+            return True
+        return not event_mux.subscribers and event_mux.get_playback_state() != 'playing'
+
+    def hibernate(self, instance):
+        self.logger.info("Mopidy instance {0} is idle, stopping it.".format(instance))
+        self.idle_since.pop(instance, None)
+        self.hibernated.add(instance)
+        self.release_event_mux(instance)
+        self.supervisor.stop(self.get_label(instance))
+
+    async def wait_ready(self, instance, timeout):
+        # by label, the executor may not exist yet while the pool boots or be replaced by a restart
+        return await self.supervisor.wait_ready(self.get_label(instance), timeout)
+
+    async def wait_all_ready(self, timeout):
+        results = await asyncio.gather(*[self.wait_ready(instance, timeout)
+                                         for instance in range(self.config.mopidy.instances)
+                                         if instance not in self.hibernated])
+        return all(results)
+
+    def stats(self):
+        return {
+            'instances': self.config.mopidy.instances,
+            'elastic': bool(self.get_elastic_settings()),
+            'running': [instance for instance in sorted(self.rendered) if instance not in self.hibernated],
+            'hibernated': sorted(self.hibernated)
+        }
 
-    def run(self):
-        for instance in range(self.config['mopidy']['instances']):
+    def spawn(self, instance):
+        return self.supervisor.spawn(self.get_label(instance), self.get_command(instance), MopidyLogParser(),
+                                     self.get_probe(instance))
 
-            if self.config['hydraplay']['source_type'] == "fifo":
-                # create a fifo for each stream
-                command = ['mkfifo', '/tmp/stream_{0}.fifo'.format(instance)]
-                Executor("FIFO Task".format(instance), command).start()
+    def get_probe(self, instance):
+        return JsonRpcProbe("http://127.0.0.1:{0}/mopidy/rpc".format(self.get_web_port(instance)), "core.get_version")
 
-            command = ['mopidy', '--config']
-            command.append("/tmp/mopidy_{0}.conf".format(instance))
-            self.executor_pool.append(Executor("Mopidy_{0}".format(instance), command))
-            self.generate_mopidy_config(instance)
-            self.executor_pool[instance].start()
+    def get_label(self, instance):
+        return "Mopidy_{0}".format(instance)
 
-        self.state.set()
+    def get_command(self, instance):
+        command = ['mopidy', '--config']
+        command.append(self.get_config_file(instance))
+        return command
 
-        while not self.shutdown_flag.is_set():
-            time.sleep(0.3)
+    def get_config_file(self, instance):
+        return self.config.mopidy.config_path + "mopidy_{0}.conf".format(instance)
 
-    def reconfigure(self):
-        for instance in range(self.config['mopidy']['instances']):
-            self.executor.kill_process(instance)
-            self.generate_mopidy_config(instance)
-            self.executor.start_process(instance)
+    def get_scan_config_file(self):
+        return self.config.mopidy.config_path + "mopidy_scan.conf"
+
+    def get_fifo(self, instance):
+        return '/tmp/stream_{0}.fifo'.format(instance)
+
+    def write_scan_config(self, data_dir):
+        """Writes the config for a library scan, the same as instance 0 but with its own data_dir."""
+        config_file = self.get_scan_config_file()
+        with open(config_file, "w") as fh:
+            fh.write(self.render_mopidy_config(0, data_dir))
+        return config_file
+
+    def refresh_libraries(self):
+        for event_mux in self.event_muxes.values():
+            if event_mux.connection is not None:
+                event_mux.call('core.library.refresh')
+
+    async def reconfigure(self):
+        """
+        Renders the config of every instance again and compares it with the running one.
+        Only instances whose config changed are restarted, the others keep playing.
+        """
+        changes = {'started': [], 'restarted': [], 'retired': [], 'unchanged': []}
+        instances = self.config.mopidy.instances
+
+        for instance in range(instances):
+            if instance not in self.rendered:
+                await self.start_instance(instance)
+                changes['started'].append(instance)
+                continue
+
+            rendered_config = self.render_mopidy_config(instance)
+            if rendered_config == self.rendered[instance]:
+                changes['unchanged'].append(instance)
+            else:
+                changes['restarted'].append(instance)
+
+        for instance in sorted(self.rendered):
+            if instance >= instances:
+                self.retire_instance(instance)
+                changes['retired'].append(instance)
+
+        # a shared setting changes every instance, restart them one after the other,
+        # idle ones first, so never all rooms are silent at the same time
+        for instance in sorted(changes['restarted'], key=self.is_playing):
+            self.write_mopidy_config(instance, self.render_mopidy_config(instance))
+            if instance in self.hibernated:
+                # picks up the new config when it is woken up
+                continue
+            self.release_event_mux(instance)
+            self.supervisor.restart(self.get_label(instance), self.get_command(instance), self.get_probe(instance))
+            if len(changes['restarted']) > 1 and not await self.wait_ready(instance, self.RESTART_TIMEOUT):
+                self.logger.warning("Mopidy instance {0} was not ready after restart.".format(instance))
+
+        for instance in sorted(self.hibernated):
+            if instance < self.get_min_instances():
+                self.ensure_instance(instance)
+        self.start_idle_loop()
+
+        self.logger.info("Mopidy reconfigured: {0}".format(changes))
+        return changes
+
+    def is_playing(self, instance):
+        event_mux = self.event_muxes.get(instance)
+        return event_mux is not None and event_mux.get_playback_state() == 'playing'
+
+    def retire_instance(self, instance):
+        self.supervisor.remove(self.get_label(instance))
+        self.hibernated.discard(instance)
+        self.idle_since.pop(instance, None)
+        self.release_event_mux(instance)
+        del self.rendered[instance]
+        try:
+            os.remove(self.get_config_file(instance))
+        except OSError:
+            pass
+
+    def release_event_mux(self, instance):
+        # the clients of the instance reconnect to a fresh mux
+        event_mux = self.event_muxes.pop(instance, None)
+        if event_mux is not None:
+            event_mux.close()
+
+    def get_web_port(self, instance):
+        return self.config.mopidy.web_base_port + instance
+
+    def get_event_mux(self, instance):
+        if not 0 <= instance < self.config.mopidy.instances:
+            return None
+        if instance not in self.event_muxes:
+            event_mux = MopidyEventMux(instance, self.get_web_port(instance), self.connector)
+            # no batches, Mopidy.js only parses single messages
+            event_mux.connect_options = self.config.hydraplay.websocket.upstream_connect_options()
+            event_mux.set_command_shaping(self.config.hydraplay.command_shaping)
+            self.event_muxes[instance] = event_mux
+        return self.event_muxes[instance]
 
     def stop(self):
-        for instance in range(self.config['mopidy']['instances']):
-            self.executor_pool[instance].stop()
-        self.shutdown_flag.set()
+        for instance in self.rendered:
+            self.supervisor.stop(self.get_label(instance))
+
+    def close(self):
+        if self.idle_task is not None:
+            self.idle_task.cancel()
+            self.idle_task = None
+        for instance in list(self.event_muxes):
+            self.release_event_mux(instance)
+
+    def delete_files(self):
+        """Removes the generated configs and fifos, they are created again on the next start."""
+        files = [self.get_scan_config_file()]
+        for instance in self.rendered:
+            files.append(self.get_config_file(instance))
+            if self.config.hydraplay.source_type == "fifo":
+                files.append(self.get_fifo(instance))
+        for path in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning("Could not remove {0}: {1}".format(path, e))
 
     def generate_mopidy_config(self, instance):
         self.logger.info("Generating Mopidy config for instance {0}".format(instance))
+        self.write_mopidy_config(instance, self.render_mopidy_config(instance))
+
+    def write_mopidy_config(self, instance, rendered_config):
+        with open(self.get_config_file(instance), "w") as fh:
+            fh.write(rendered_config)
+        self.rendered[instance] = rendered_config
 
+    def render_mopidy_config(self, instance, data_dir=None):
         template_path = str(Path(__file__).resolve().parent.parent) + "/config/templates/"
         templateLoader = FileSystemLoader(searchpath=template_path)
         templateEnvironment = Environment(loader=templateLoader)
         template = templateEnvironment.get_template("mopidy.conf.j2")
-        mpd_port = self.config['mopidy']['mpd_base_port'] + instance
-        web_port = self.config['mopidy']['web_base_port'] + instance
-        tcp_port = self.config['mopidy']['tcp_sink_base_port']
-        source_type = self.config['hydraplay']['source_type']
-        renedered_config = template.render(hydraplay_config=self.config,
-                                           stream_id=instance,
-                                           mpd_port=mpd_port,
-                                           web_port=web_port,
-                                           tcp_port=tcp_port,
-                                           source_type=source_type
-                                           )
-        with open(self.config['mopidy']['config_path'] + "mopidy_{0}.conf".format(instance), "w") as fh:
-            fh.write(renedered_config)
+        mpd_port = self.config.mopidy.mpd_base_port + instance
+        web_port = self.get_web_port(instance)
+        tcp_port = self.config.mopidy.tcp_sink_base_port
+        source_type = self.config.hydraplay.source_type
+        return template.render(hydraplay_config=self.config,
+                               stream_id=instance,
+                               mpd_port=mpd_port,
+                               web_port=web_port,
+                               tcp_port=tcp_port,
+                               source_type=source_type,
+                               data_dir=data_dir or self.config.mopidy.data_dir
+                               )
 
 
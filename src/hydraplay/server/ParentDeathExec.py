@@ -0,0 +1,40 @@
+"""
+Starts a child process of the server which is killed when the server dies.
+
+Run as python -m hydraplay.server.ParentDeathExec <server pid> <command...>, see
+Executor. The kernel sends SIGKILL to the process when its parent exits
+(PR_SET_PDEATHSIG), which survives the exec of the command. Setting it here instead
+of in a preexec_fn keeps code out of the window between fork and exec, which is not
+safe while the server runs threads.
+"""
+import ctypes
+import os
+import signal
+import sys
+
+PR_SET_PDEATHSIG = 1
+
+
+def set_parent_death_signal(parent):
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL) != 0:
+        raise OSError(ctypes.get_errno(), "prctl(PR_SET_PDEATHSIG) failed")
+    # the server may have died before prctl, the signal is not sent then
+    if os.getppid() != parent:
+        sys.exit(1)
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.exit("usage: python -m hydraplay.server.ParentDeathExec <parent pid> <command...>")
+    command = sys.argv[2:]
+    try:
+        set_parent_death_signal(int(sys.argv[1]))
+    except (OSError, AttributeError) as e:
+        # the command runs anyway, the server still kills its process group when it exits
+        sys.stderr.write("Could not set the parent death signal: {0}\n".format(e))
+    os.execvp(command[0], command)
+
+
+if __name__ == "__main__":
+    main()
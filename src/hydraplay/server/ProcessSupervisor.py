@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from tornado import ioloop, locks
+
+from hydraplay.config import ProcessLogSettings, SectionReader, SupervisorSettings
+from hydraplay.server.Executor import Executor
+from hydraplay.server.LogPipeline import LogThrottle
+
+
+class RestartPolicy:
+    """
+    Exponential backoff for restarting crashed processes. A process which crashes
+    more than crash_loop_limit times within crash_loop_window seconds is given up.
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0, crash_loop_limit=5, crash_loop_window=300.0,
+                 stable_after=60.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.crash_loop_limit = crash_loop_limit
+        self.crash_loop_window = crash_loop_window
+        self.stable_after = stable_after
+        self.crashes = deque()
+        self.failures = 0
+
+    def next_delay(self, uptime):
+        """Returns the delay before the next restart, None if the process is crash looping."""
+        now = time.monotonic()
+        if uptime >= self.stable_after:
+            # the process ran fine for a while, start over with a short delay
+            self.failures = 0
+
+        self.crashes.append(now)
+        while self.crashes and now - self.crashes[0] > self.crash_loop_window:
+            self.crashes.popleft()
+        if len(self.crashes) > self.crash_loop_limit:
+            return None
+
+        delay = min(self.max_delay, self.base_delay * (2 ** self.failures))
+        self.failures += 1
+        return delay
+
+
+class ProcessSupervisor:
+    """
+    Keeps track of all child processes (Mopidy instances, snapserver, helpers)
+    running on the server loop.
+
+    Long running processes are restarted with backoff when they exit, and checked
+    with their health probe. A process failing its probe several times in a row
+    is restarted as well. Every process is handled on its own, a crash of one
+    instance never touches the others.
+    """
+
+    READY_INTERVAL = 0.25
+    RESTART_TIMEOUT = 10.0
+
+    def __init__(self, config=None, timeline=None):
+        self.logger = logging.getLogger(__name__)
+        self.timeline = timeline
+        self.processes = {}
+        self.policies = {}
+        # notified when a process is spawned or gets ready, see wait_ready
+        self.ready_changed = locks.Condition()
+        if config is not None:
+            settings = config.hydraplay.supervisor
+            log_settings = config.hydraplay.process_log
+        else:
+            settings = SupervisorSettings.read(SectionReader('hydraplay.supervisor', None))
+            log_settings = ProcessLogSettings.read(SectionReader('hydraplay.process_log', None))
+        self.probe_interval = settings.probe_interval
+        self.probe_grace = settings.probe_grace
+        self.probe_failure_limit = settings.probe_failures
+        self.crash_loop_limit = settings.crash_loop_limit
+        self.crash_loop_window = settings.crash_loop_window
+        self.max_restart_delay = settings.max_restart_delay
+        self.log_rate = log_settings.rate
+        self.log_burst = log_settings.burst
+        self.health_task = None
+
+    def spawn(self, label, command, parser=None, probe=None, policy=None):
+        executor = self.processes.get(label)
+        if executor is not None and executor.is_running():
+            self.logger.warning("Process {0} is already running.".format(label))
+            return executor
+
+        previous = executor
+        # the log throttle and its counters are kept over restarts
+        throttle = previous.throttle if previous is not None else LogThrottle(self.log_rate, self.log_burst)
+        executor = Executor(label, command, parser, probe, throttle)
+        if previous is not None:
+            executor.restarts = previous.restarts
+        self.processes[label] = executor
+        policy = policy or self.policies.get(label) or self.create_policy()
+        self.policies[label] = policy
+        executor.state = Executor.STARTING
+        executor.task = asyncio.ensure_future(self.supervise(executor, policy))
+        self.ready_changed.notify_all()
+
+        if probe is not None and self.health_task is None:
+            self.health_task = asyncio.ensure_future(self.health_loop())
+        return executor
+
+    def create_policy(self):
+        return RestartPolicy(max_delay=self.max_restart_delay,
+                             crash_loop_limit=self.crash_loop_limit,
+                             crash_loop_window=self.crash_loop_window)
+
+    async def supervise(self, executor, policy):
+        while True:
+            readiness = None
+            if executor.probe is not None:
+                readiness = asyncio.ensure_future(self.watch_readiness(executor))
+            await executor.run()
+            if readiness is not None:
+                readiness.cancel()
+
+            if executor.stop_requested:
+                break
+
+            if executor.restart_requested:
+                executor.restart_requested = False
+                executor.restarts += 1
+                self.logger.info("Restarting {0}.".format(executor.label))
+                continue
+
+            delay = policy.next_delay(executor.uptime())
+            if delay is None:
+                executor.state = Executor.FAILED
+                self.ready_changed.notify_all()
+                self.logger.error("{0} keeps crashing, giving up after {1} restarts.".format(
+                    executor.label, executor.restarts))
+                break
+
+            executor.state = Executor.BACKOFF
+            self.logger.warning("{0} exited unexpectedly (code {1}), restarting in {2:.1f} seconds.".format(
+                executor.label, executor.returncode, delay))
+            await asyncio.sleep(delay)
+            if executor.stop_requested:
+                break
+            executor.restarts += 1
+        return executor.returncode
+
+    async def watch_readiness(self, executor):
+        """Probes a freshly started process in short intervals until it answers."""
+        while not executor.ready.is_set():
+            await asyncio.sleep(self.READY_INTERVAL)
+            if executor.is_alive() and await executor.probe.check():
+                self.set_ready(executor)
+                if self.timeline is not None and executor.restarts == 0:
+                    self.timeline.mark("{0} ready".format(executor.label))
+
+    async def health_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            executors = [executor for executor in self.processes.values()
+                         if executor.probe is not None and executor.is_alive() and not executor.stop_requested
+                         and (executor.ready.is_set() or executor.uptime() >= self.probe_grace)]
+            results = await asyncio.gather(*[executor.probe.check() for executor in executors])
+            for executor, healthy in zip(executors, results):
+                self.record_probe(executor, healthy)
+
+    def set_ready(self, executor):
+        executor.set_ready()
+        self.ready_changed.notify_all()
+
+    async def wait_ready(self, label, timeout):
+        """
+        Waits until the process with the label answers its probe, returns False on timeout
+        or when it failed for good. The process may not be spawned yet or be replaced by a
+        new Executor on the way, the waiter follows the label.
+        """
+        deadline = ioloop.IOLoop.current().time() + timeout
+        while True:
+            executor = self.processes.get(label)
+            if executor is not None:
+                if executor.ready.is_set():
+                    return True
+                if executor.state == Executor.FAILED:
+                    return False
+            if not await self.ready_changed.wait(timeout=deadline):
+                return False
+
+    def record_probe(self, executor, healthy):
+        executor.healthy = healthy
+        if healthy:
+            executor.probe_failures = 0
+            return
+
+        executor.probe_failures += 1
+        self.logger.warning("{0} failed its health probe {1} ({2}/{3}).".format(
+            executor.label, executor.probe, executor.probe_failures, self.probe_failure_limit))
+        if executor.probe_failures >= self.probe_failure_limit:
+            # hanging, kill it and let the restart policy bring it back
+            executor.probe_failures = 0
+            asyncio.ensure_future(executor.terminate_and_wait())
+
+    async def run_once(self, label, command, parser=None):
+        """Runs a short lived helper command and waits for its exit code."""
+        executor = Executor(label, command, parser, throttle=LogThrottle(self.log_rate, self.log_burst))
+        executor.start()
+        return await executor.wait()
+
+    def get(self, label):
+        return self.processes.get(label)
+
+    def restart(self, label, command=None, probe=None):
+        executor = self.processes.get(label)
+        if executor is None:
+            return
+        if command is not None:
+            executor.command = command
+        if probe is not None:
+            executor.probe = probe
+        if executor.is_alive():
+            executor.restart()
+            # a process which hangs on shutdown would never come back with SIGTERM alone
+            asyncio.ensure_future(executor.wait_or_kill(self.RESTART_TIMEOUT))
+        elif not executor.is_running():
+            # crashed for good or stopped, start over with a fresh policy
+            self.policies.pop(label, None)
+            self.spawn(label, executor.command, executor.parser, executor.probe)
+
+    def stop(self, label):
+        executor = self.processes.get(label)
+        if executor is not None:
+            executor.stop()
+
+    def remove(self, label):
+        """Stops a process which is not needed anymore and forgets about it."""
+        self.stop(label)
+        self.processes.pop(label, None)
+        self.policies.pop(label, None)
+
+    def stop_all(self):
+        for executor in self.processes.values():
+            executor.stop()
+
+    async def close(self, timeout=10.0):
+        """Stops all processes, kills those which do not exit in time and ends the supervision."""
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+        executors = list(self.processes.values())
+        for executor in executors:
+            executor.stop()
+        await asyncio.gather(*[executor.wait_or_kill(timeout) for executor in executors])
+
+        # the output of the exited processes is read to the end, a backoff sleep is cancelled
+        tasks = [executor.task for executor in executors if executor.task is not None and not executor.task.done()]
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=1.0)
+            for task in pending:
+                task.cancel()
+
+    def status(self):
+        return [executor.to_dict() for executor in self.processes.values()]
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the IOLoop thread from a background thread.
+
+    The result is written in the collapsed stack format ("frame;frame;frame count"),
+    which flamegraph.pl and speedscope read directly. Sampling costs nothing while the
+    profiler is stopped and only little while it runs, so it can be used in production.
+    """
+
+    def __init__(self, interval=0.005):
+        self.logger = logging.getLogger(__name__)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.thread = None
+        self.running = threading.Event()
+        self.target_thread_id = None
+
+    def is_running(self):
+        return self.running.is_set()
+
+    def start(self, target_thread_id=None):
+        if self.is_running():
+            return
+        self.target_thread_id = target_thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.running.set()
+        self.thread = threading.Thread(target=self.sample_loop, name="hydraplay-profiler", daemon=True)
+        self.thread.start()
+        self.logger.info("Profiler started, sampling every {0} ms".format(self.interval * 1000))
+
+    def stop(self):
+        if not self.is_running():
+            return
+        self.running.clear()
+        self.thread.join()
+        self.thread = None
+        self.stopped_at = time.time()
+        self.logger.info("Profiler stopped after {0} samples".format(self.samples))
+
+    def sample_loop(self):
+        while self.running.is_set():
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is not None:
+                self.stacks[self.collapse(frame)] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def collapse(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("{0} ({1}:{2})".format(code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def dump(self):
+        return "".join("{0} {1}\n".format(stack, count) for stack, count in self.stacks.most_common())
+
+    def to_dict(self):
+        return {
+            'running': self.is_running(),
+            'interval': self.interval,
+            'samples': self.samples,
+            'stacks': len(self.stacks),
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at
+        }
+
+
+class StallWatchdog:
+    """
+    Logs the stack of the IOLoop thread whenever the loop did not run for longer
+    than threshold seconds, e.g. because of a blocking call in a handler.
+
+    The loop updates a heartbeat, a background thread checks it.
+    """
+
+    def __init__(self, threshold=1.0):
+        self.logger = logging.getLogger(__name__)
+        self.threshold = threshold
+        self.check_interval = threshold / 4
+        self.heartbeat = time.monotonic()
+        self.stalls = 0
+        self.longest_stall = 0.0
+        self.task = None
+        self.thread = None
+        self.running = threading.Event()
+        self.target_thread_id = None
+
+    def start(self):
+        if self.task is not None:
+            return
+        self.target_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.ensure_future(self.beat())
+        self.running.set()
+        self.thread = threading.Thread(target=self.watch, name="hydraplay-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        self.task = None
+        self.running.clear()
+
+    async def beat(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.check_interval)
+
+    def watch(self):
+        reported = None
+        while self.running.is_set():
+            time.sleep(self.check_interval)
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat
+            if stalled < self.threshold:
+                continue
+            self.longest_stall = max(self.longest_stall, stalled)
+            if reported == heartbeat:
+                # same stall, already logged
+                continue
+            reported = heartbeat
+            self.stalls += 1
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unknown"
+            self.logger.warning("IOLoop blocked for more than {0:.2f}s in:\n{1}".format(stalled, stack))
+
+    def to_dict(self):
+        return {
+            'threshold': self.threshold,
+            'stalls': self.stalls,
+            'longest_stall': self.longest_stall
+        }
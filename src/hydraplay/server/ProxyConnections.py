@@ -0,0 +1,35 @@
+import asyncio
+import logging
+
+
+class ProxyConnections:
+    """
+    The open websocket proxies of a server process. On shutdown every browser gets a
+    close frame with 1001 (going away), so the clients reconnect to the restarted
+    server instead of waiting for a timeout.
+    """
+
+    GOING_AWAY = 1001
+    DRAIN_INTERVAL = 0.05
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.handlers = set()
+
+    def add(self, handler):
+        self.handlers.add(handler)
+
+    def discard(self, handler):
+        self.handlers.discard(handler)
+
+    async def close_all(self, timeout):
+        """Sends the close frames and waits until the clients answered them, at most timeout seconds."""
+        for handler in list(self.handlers):
+            handler.close(self.GOING_AWAY, "server shutting down")
+
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.handlers and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(self.DRAIN_INTERVAL)
+        if self.handlers:
+            self.logger.info("{0} websockets did not close in time.".format(len(self.handlers)))
+        self.handlers.clear()
@@ -0,0 +1,94 @@
+import logging
+
+from tornado import locks
+
+from hydraplay.config import ConfigError, merge_patch
+
+
+class SettingsConflict(ConfigError):
+    """The settings were changed since the version the client based its changes on."""
+    pass
+
+
+class Reconfigurator:
+    """
+    Applies changed settings to the running server.
+
+    The changes are a JSON merge patch of the settings tree, keys which are not in it
+    keep their value. The merged settings are validated and the Snapserver and Mopidy
+    configs are rendered, only then they are stored with Config.save_json. The rendered
+    configs are compared with the running ones. Only processes whose rendered config
+    changed are touched, so changing the settings of one instance does not interrupt
+    playback in the other rooms.
+    """
+
+    # the settings which can be changed over the API, with everything below them. The
+    # other paths and the stream sources end up in the configs of the child processes,
+    # where they could write files or run commands, they are changed in the config file.
+    # The options of the extensions are checked by MopidySettings.read.
+    writable_settings = ('hydraplay.port', 'mopidy.instances', 'mopidy.elastic', 'mopidy.extensions',
+                         'snapcast_server.codec')
+
+    # settings which are only read when the server starts
+    restart_settings = ('port',)
+
+    def __init__(self, config, mopidy_pool, snapcast_service, settings_document=None):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.settings_document = settings_document
+        self.mopidy_pool = mopidy_pool
+        self.snapcast_service = snapcast_service
+        self.lock = locks.Lock()
+
+    async def apply(self, patch, expected_version=None):
+        async with self.lock:
+            if expected_version is not None and expected_version != self.config.version:
+                raise SettingsConflict("The settings were changed meanwhile")
+            if not isinstance(patch, dict):
+                raise ConfigError("The settings must be a JSON object")
+            content = merge_patch(self.config.content, patch)
+            self.check_writable(self.config.content, content)
+            # update() replaces content and settings, or raises a ConfigError naming the invalid option
+            previous = (self.config.content, self.config.settings, self.config.version)
+            previous_settings = self.config.hydraplay
+            self.config.update(content)
+            try:
+                self.render()
+                self.config.save_json()
+            except (ConfigError, OSError):
+                self.config.restore(*previous)
+                raise
+
+            if self.settings_document is not None:
+                # waiting clients get the new settings right away
+                self.settings_document.notify()
+
+            changes = {}
+            # snapserver first, new Mopidy instances need their stream source
+            changes['snapcast'] = await self.snapcast_service.reconfigure()
+            changes['mopidy'] = await self.mopidy_pool.reconfigure()
+            changes['restart_required'] = [key for key in self.restart_settings
+                                           if getattr(previous_settings, key) != getattr(self.config.hydraplay, key)]
+
+        self.logger.info("Settings applied: {0}".format(changes))
+        return changes
+
+    def check_writable(self, current, content, path=""):
+        """Raises a ConfigError when the new settings change more than the writable settings."""
+        for key in sorted(set(current) | set(content)):
+            name = path + key
+            old, new = current.get(key), content.get(key)
+            if old == new or name in self.writable_settings:
+                continue
+            if not isinstance(old, dict) or not isinstance(new, dict):
+                raise ConfigError("{0} can not be changed over the API".format(name))
+            self.check_writable(old, new, name + ".")
+
+    def render(self):
+        """Renders all configs with the new settings, so a template error leaves the running ones alone."""
+        try:
+            self.snapcast_service.render_config()
+            for instance in range(self.config.mopidy.instances):
+                self.mopidy_pool.render_mopidy_config(instance)
+        except Exception as e:
+            raise ConfigError("The settings can not be rendered: {0}".format(e))
@@ -0,0 +1,40 @@
+from hydraplay.server.MopidyPoolService import MopidyPoolService
+
+
+class RemoteMopidyPool(MopidyPoolService):
+    """
+    Mopidy pool of a worker process. The instances are run by the coordinator, the
+    worker only has its own event muxes and learns about the readiness of the
+    instances over the coordinator link.
+    """
+
+    def __init__(self, config, connector, link):
+        super().__init__(config, None, connector)
+        self.link = link
+        link.config_listeners.append(self.release_stale_muxes)
+        link.state_listeners.append(self.on_state)
+        link.usage = self.usage
+
+    def ensure_instance(self, instance):
+        # the coordinator ignores instances which are running already
+        self.link.send({'type': 'ensure', 'instance': instance})
+
+    async def wait_ready(self, instance, timeout):
+        return await self.link.wait_ready(self.get_label(instance), timeout)
+
+    def on_state(self):
+        self.hibernated = set(self.link.hibernated)
+        for instance in list(self.event_muxes):
+            if instance in self.hibernated:
+                self.release_event_mux(instance)
+
+    def release_stale_muxes(self):
+        # instances were removed or moved to other ports by a settings change
+        for instance, event_mux in list(self.event_muxes.items()):
+            if instance >= self.config.mopidy.instances or event_mux.port != self.get_web_port(instance):
+                self.release_event_mux(instance)
+
+    def usage(self):
+        return {str(instance): {'subscribers': len(event_mux.subscribers),
+                                'playing': event_mux.get_playback_state() == 'playing'}
+                for instance, event_mux in self.event_muxes.items()}
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import re
+
+from tornado import ioloop, locks
+
+
+class SettingsDocument:
+    """
+    The settings as served at /api/settings, serialized once per config version.
+
+    The document is the settings tree as POST /api/settings takes it, without the
+    secrets, plus the derived mopidy_instances. A client can change it and post it
+    back: derived keys are ignored, secrets which are not posted keep their value.
+    Clients revalidate with the ETag, or wait for a change with a long-poll instead
+    of polling the document.
+    """
+
+    # options whose values are not served, e.g. cookie_secret or spotify.client_secret
+    hidden_pattern = re.compile(r'(password|secret|token|api_key|identity)$')
+
+    # computed from the settings, not part of them
+    derived_settings = ('mopidy_instances',)
+
+    def __init__(self, config):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.version = None
+        self.body = None
+        self.etag = None
+        self.changed = locks.Condition()
+
+    def get(self):
+        if self.version != self.config.version:
+            self.build()
+        return self.body, self.etag
+
+    def build(self):
+        mopidy = self.config.mopidy
+        extensions = [key for key, value in mopidy.extensions.items() if value.get('enabled')]
+
+        mopidy_instances = []
+        for instance in range(mopidy.instances):
+            mopidy_instances.append({
+                'stream_id': 'MOPIDY-{0}'.format(instance),
+                'id': instance,
+                'port': mopidy.web_base_port + instance,
+                'extensions': extensions
+            })
+
+        settings = self.hide_secrets(self.config.content)
+        settings['mopidy_instances'] = mopidy_instances
+
+        self.body = json.dumps(settings).encode("utf-8")
+        self.etag = '"{0}"'.format(hashlib.sha1(self.body).hexdigest()[:20])
+        self.version = self.config.version
+        self.logger.debug("Settings document rebuilt for config version {0}".format(self.version))
+
+    def hide_secrets(self, content):
+        if not isinstance(content, dict):
+            return content
+        return {key: self.hide_secrets(value) for key, value in content.items()
+                if not self.hidden_pattern.search(key)}
+
+    def read_patch(self, patch):
+        """Removes the derived keys from a posted document, the rest is a patch of the settings."""
+        if not isinstance(patch, dict):
+            return patch
+        return {key: value for key, value in patch.items() if key not in self.derived_settings}
+
+    def notify(self):
+        self.changed.notify_all()
+
+    async def wait_for_change(self, etag, timeout):
+        """Waits until the document differs from the given ETag, returns False on timeout."""
+        deadline = ioloop.IOLoop.current().time() + timeout
+        while self.get()[1] == etag:
+            if not await self.changed.wait(timeout=deadline):
+                return False
+        return True
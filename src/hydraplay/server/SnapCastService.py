@@ -1,69 +1,142 @@
+import datetime
 import logging
-import threading
-import time
+import os
+import re
 from pathlib import Path
-from hydraplay.server.Executor import Executor
+from urllib.parse import parse_qs, urlparse
+from tornado import gen
+from hydraplay.server.HealthProbe import JsonRpcProbe
+from hydraplay.server.LogParser import SnapcastLogParser
 from jinja2 import Environment, FileSystemLoader
 
 
-class SnapCastService(threading.Thread):
-    def __init__(self, config):
-        threading.Thread.__init__(self)
-        self.daemon = True
+class SnapCastService:
+    LABEL = "Snapcast Server"
+    STREAM_UPDATE_TIMEOUT = 5
+
+    source_pattern = re.compile(r'^source\s*=\s*(.+?)\s*$', re.MULTILINE)
+
+    def __init__(self, config, supervisor, hub=None):
         self.config = config
+        self.supervisor = supervisor
+        self.hub = hub
         self.logger = logging.getLogger(__name__)
-        self.command = ['snapserver', '-c', '/tmp/snapserver.conf']
-        self.shutodown_flag = threading.Event()
+        self.command = ['snapserver', '-c', self.get_config_file()]
         self.executor = None
+        self.rendered = None
 
-    def run(self):
+    async def start(self):
+        await self.create_fifos()
+        self.generate_config()
+        probe = JsonRpcProbe("http://127.0.0.1:1780/jsonrpc", "Server.GetRPCVersion")
+        self.executor = self.supervisor.spawn(self.LABEL, self.command, SnapcastLogParser(), probe)
 
-        for idx, additional_stream in enumerate(self.config['snapcast_server']['additional_streams']):
-           if self.config['snapcast_server']['additional_streams'][idx]['source_type'] == "fifo":
-               # create a fifo for each stream
-               command = ['mkfifo', '/tmp/additional_streams/stream_{0}.fifo'.format(self.config['mopidy']['instances']+idx)]
-               Executor("FIFO Task".format(self.config['mopidy']['instances']+idx), command).start()
+    async def create_fifos(self):
+        for fifo in self.get_fifos():
+            # create a fifo for each stream
+            command = ['mkfifo', fifo]
+            await self.supervisor.run_once("FIFO Task", command)
 
-        self.executor = Executor("Snapcast Server", self.command)
-        self.generate_config()
-        self.executor.run()
-        while not self.shutodown_flag.is_set():
-            time.sleep(0.3)
+    def get_fifos(self):
+        return ['/tmp/additional_streams/stream_{0}.fifo'.format(self.config.mopidy.instances + idx)
+                for idx, additional_stream in enumerate(self.config.snapcast_server.additional_streams)
+                if additional_stream['source_type'] == "fifo"]
 
-    def reconfigure(self):
-        self.executor.kill_process()
-        self.generate_config()
-        self.executor.start_process()
+    def get_config_file(self):
+        return self.config.snapcast_server.config_path + "snapserver.conf"
+
+    async def reconfigure(self):
+        """
+        Renders snapserver.conf again. When only stream sources were added or removed they
+        are changed over JSON-RPC and the server keeps running, otherwise it is restarted.
+        Returns "unchanged", "updated" or "restarted".
+        """
+        rendered_config = self.render_config()
+        if rendered_config == self.rendered:
+            return "unchanged"
+
+        await self.create_fifos()
+        previous_config = self.rendered
+        self.write_config(rendered_config)
+
+        if self.only_sources_changed(previous_config, rendered_config):
+            try:
+                await self.update_streams(self.get_sources(previous_config), self.get_sources(rendered_config))
+                return "updated"
+            except Exception as e:
+                self.logger.warning("Could not update Snapcast streams at runtime: {0}".format(e))
+
+        self.supervisor.restart(self.LABEL)
+        return "restarted"
+
+    def get_sources(self, rendered_config):
+        return self.source_pattern.findall(rendered_config)
+
+    def only_sources_changed(self, previous_config, rendered_config):
+        if previous_config is None or self.hub is None:
+            return False
+        return self.strip_sources(previous_config) == self.strip_sources(rendered_config)
+
+    def strip_sources(self, rendered_config):
+        return [line for line in self.source_pattern.sub("", rendered_config).splitlines() if line.strip()]
+
+    async def update_streams(self, previous_sources, sources):
+        await self.hub.ensure_connected()
+        for source in previous_sources:
+            if source not in sources:
+                name = parse_qs(urlparse(source).query).get('name', [source])[0]
+                await self.call_hub("Stream.RemoveStream", {'id': name})
+        for source in sources:
+            if source not in previous_sources:
+                await self.call_hub("Stream.AddStream", {'streamUri': source})
+
+    async def call_hub(self, method, params):
+        response = await gen.with_timeout(datetime.timedelta(seconds=self.STREAM_UPDATE_TIMEOUT),
+                                          self.hub.call(method, params))
+        if 'error' in response:
+            raise RuntimeError("{0} failed: {1}".format(method, response['error']))
+        return response
 
     def stop(self):
-        self.executor.stop()
-        self.shutodown_flag.set()
+        self.supervisor.stop(self.LABEL)
         self.delete_config()
 
     def delete_config(self):
-        pass
+        """Removes snapserver.conf and the fifos of the additional streams."""
+        for path in [self.get_config_file()] + self.get_fifos():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning("Could not remove {0}: {1}".format(path, e))
 
     def render_template(self, template_filename, context):
         return self.template_environment.get_template(template_filename).render(context)
 
     def generate_config(self):
         self.logger.info("Generating Snapcast config")
+        self.write_config(self.render_config())
 
+    def write_config(self, rendered_config):
+        with open(self.get_config_file(), "w") as fh:
+            fh.write(rendered_config)
+        self.rendered = rendered_config
+
+    def render_config(self):
         template_path = str(Path(__file__).resolve().parent.parent) + "/config/templates/"
         templateLoader = FileSystemLoader(searchpath=template_path)
         templateEnvironment = Environment(loader=templateLoader)
         template = templateEnvironment.get_template("snapserver.conf.j2")
-        tcp_port = self.config['mopidy']['tcp_sink_base_port']
-        codec = self.config['snapcast_server']['codec']
-        source_type = self.config['hydraplay']['source_type']
-        additional_streams = self.config['snapcast_server']['additional_streams']
-
-        renedered_config = template.render(hydraplay_config=self.config,
-                                           tcp_port=tcp_port,
-                                           source_type=source_type,
-                                           codec=codec,
-                                           additional_streams=additional_streams
-                                          )
-        with open(self.config['snapcast_server']['config_path'] + "snapserver.conf", "w") as fh:
-            fh.write(renedered_config)
+        tcp_port = self.config.mopidy.tcp_sink_base_port
+        codec = self.config.snapcast_server.codec
+        source_type = self.config.hydraplay.source_type
+        additional_streams = self.config.snapcast_server.additional_streams
+
+        return template.render(hydraplay_config=self.config,
+                               tcp_port=tcp_port,
+                               source_type=source_type,
+                               codec=codec,
+                               additional_streams=additional_streams
+                               )
 
@@ -0,0 +1,203 @@
+import json
+import logging
+
+from hydraplay.server.JsonRpcHub import JsonRpcHub
+
+
+class SnapcastControlHub(JsonRpcHub):
+    """
+    Single JSON-RPC control connection to snapserver for all clients of /socket/control/jsonrpc.
+
+    The result of Server.GetStatus is kept in memory and patched with every
+    notification, so status requests of new clients are answered without
+    asking snapserver. Snapserver does not notify the session which made a
+    change, so the hub synthesizes those notifications for the other clients.
+    """
+
+    coalesce_methods = frozenset(['Server.GetStatus', 'Server.GetRPCVersion'])
+
+    # sent many times per second while a slider is dragged, shaped per client
+    shaped_methods = frozenset(['Client.SetVolume', 'Client.SetLatency'])
+
+    # requests whose response carries the data of the notification the other clients expect
+    change_notifications = {
+        'Client.SetVolume': 'Client.OnVolumeChanged',
+        'Client.SetLatency': 'Client.OnLatencyChanged',
+        'Client.SetName': 'Client.OnNameChanged',
+        'Group.SetMute': 'Group.OnMute',
+        'Group.SetStream': 'Group.OnStreamChanged',
+        'Group.SetName': 'Group.OnNameChanged',
+        'Group.SetClients': 'Server.OnUpdate',
+        'Server.DeleteClient': 'Server.OnUpdate',
+    }
+
+    def __init__(self, connector, uri="ws://127.0.0.1:1780/jsonrpc"):
+        super().__init__(uri, connector)
+        self.logger = logging.getLogger(__name__)
+        self.server = None
+        self.status_cache = None
+        self.answered_from_cache = 0
+        # called with the stream id whenever a group is switched to another stream
+        self.stream_listeners = []
+
+    def on_connect(self):
+        # warm up the model, so the first client is already answered from memory
+        self.call('Server.GetStatus')
+
+    def on_disconnect(self):
+        self.invalidate()
+
+    def stats(self):
+        stats = super().stats()
+        stats['answered_from_cache'] = self.answered_from_cache
+        return stats
+
+    def command_key(self, request):
+        params = request.get('params')
+        return request['method'], params.get('id') if isinstance(params, dict) else None
+
+    def invalidate(self):
+        self.server = None
+        self.status_cache = None
+
+    def handle_request(self, subscriber, request):
+        if self.server is None:
+            return False
+
+        method = request['method']
+        params = request.get('params') or {}
+
+        if method == 'Server.GetStatus':
+            if self.status_cache is None:
+                self.status_cache = json.dumps(self.server)
+            # the model is serialized only once per change, only the id differs per client
+            response = '{{"id": {0}, "jsonrpc": "2.0", "result": {{"server": {1}}}}}'.format(
+                json.dumps(request['id']), self.status_cache)
+            self.send_reply(subscriber, response)
+        elif method == 'Client.GetStatus':
+            client = self.find_client(params.get('id'))
+            if client is None:
+                return False
+            self.reply(subscriber, request, {'jsonrpc': '2.0', 'result': {'client': client}})
+        elif method == 'Group.GetStatus':
+            group = self.find_group(params.get('id'))
+            if group is None:
+                return False
+            self.reply(subscriber, request, {'jsonrpc': '2.0', 'result': {'group': group}})
+        else:
+            return False
+
+        self.answered_from_cache += 1
+        return True
+
+    def on_response(self, target, request, response):
+        result = response.get('result')
+        if not isinstance(result, dict):
+            return
+
+        method = request['method']
+        if method == 'Server.GetStatus':
+            self.server = result.get('server')
+            self.status_cache = None
+            return
+
+        notification_method = self.change_notifications.get(method)
+        if notification_method is None:
+            if not method.endswith('GetStatus') and not method.endswith('GetRPCVersion'):
+                # unknown change (e.g. Stream.*), fetch a fresh model on the next status request
+                self.invalidate()
+            return
+
+        params = dict(result)
+        if 'server' not in params:
+            params['id'] = (request.get('params') or {}).get('id')
+        notification = {'jsonrpc': '2.0', 'method': notification_method, 'params': params}
+        self.on_notification(notification)
+        self.broadcast(json.dumps(notification), exclude=target)
+
+    def on_notification(self, message):
+        if not isinstance(message, dict):
+            return
+
+        self.status_cache = None
+        method = message.get('method')
+        params = message.get('params') or {}
+
+        if method == 'Server.OnUpdate':
+            self.server = params.get('server')
+            return
+        if self.server is None:
+            return
+
+        stream_id = None
+        try:
+            if method == 'Client.OnVolumeChanged':
+                self.find_client(params['id'])['config']['volume'] = params['volume']
+            elif method == 'Client.OnLatencyChanged':
+                self.find_client(params['id'])['config']['latency'] = params['latency']
+            elif method == 'Client.OnNameChanged':
+                self.find_client(params['id'])['config']['name'] = params['name']
+            elif method in ('Client.OnConnect', 'Client.OnDisconnect'):
+                self.replace_client(params['client'])
+            elif method == 'Group.OnMute':
+                self.find_group(params['id'])['muted'] = params['mute']
+            elif method == 'Group.OnStreamChanged':
+                self.find_group(params['id'])['stream_id'] = params['stream_id']
+                stream_id = params['stream_id']
+            elif method == 'Group.OnNameChanged':
+                self.find_group(params['id'])['name'] = params['name']
+            elif method == 'Stream.OnUpdate':
+                self.replace_stream(params['stream'])
+            elif method == 'Stream.OnProperties':
+                self.find_stream(params['id'])['properties'] = params['properties']
+            else:
+                self.invalidate()
+        except (KeyError, TypeError):
+            # the model does not know the referenced object, rebuild it from snapserver
+            self.logger.debug("Could not apply {0}, invalidating server status.".format(method))
+            self.invalidate()
+
+        if stream_id is not None:
+            self.notify_stream_listeners(stream_id)
+
+    def notify_stream_listeners(self, stream_id):
+        # a failing listener must not keep the notification from the clients
+        for listener in self.stream_listeners:
+            try:
+                listener(stream_id)
+            except Exception:
+                self.logger.exception("Stream listener failed for stream {0}".format(stream_id))
+
+    def find_group(self, group_id):
+        for group in self.server['groups']:
+            if group['id'] == group_id:
+                return group
+        return None
+
+    def find_client(self, client_id):
+        for group in self.server['groups']:
+            for client in group['clients']:
+                if client['id'] == client_id:
+                    return client
+        return None
+
+    def find_stream(self, stream_id):
+        for stream in self.server['streams']:
+            if stream['id'] == stream_id:
+                return stream
+        return None
+
+    def replace_client(self, new_client):
+        for group in self.server['groups']:
+            for idx, client in enumerate(group['clients']):
+                if client['id'] == new_client['id']:
+                    group['clients'][idx] = new_client
+                    return
+        raise KeyError(new_client['id'])
+
+    def replace_stream(self, new_stream):
+        for idx, stream in enumerate(self.server['streams']):
+            if stream['id'] == new_stream['id']:
+                self.server['streams'][idx] = new_stream
+                return
+        self.server['streams'].append(new_stream)
@@ -0,0 +1,22 @@
+import logging
+import time
+
+
+class StartupTimeline:
+    """
+    Records when the parts of the server came up, relative to the start of the
+    process. Shown at /api/status to see which Mopidy instance slows down a boot.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.started = time.monotonic()
+        self.events = []
+
+    def mark(self, event):
+        elapsed = time.monotonic() - self.started
+        self.events.append((event, elapsed))
+        self.logger.info("{0} after {1:.2f}s".format(event, elapsed))
+
+    def to_list(self):
+        return [{'event': event, 'elapsed': round(elapsed, 3)} for event, elapsed in self.events]
@@ -0,0 +1,192 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import time
+from collections import OrderedDict
+
+from tornado import ioloop
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'application/manifest+json', 'image/svg+xml')
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(abspath):
+    """SHA-1 hex digest of a file, read in chunks, so big files are not loaded at once."""
+    digest = hashlib.sha1()
+    with open(abspath, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CachedAsset:
+
+    def __init__(self, abspath, stat_result, body, digest=None):
+        self.abspath = abspath
+        self.mtime = stat_result.st_mtime
+        self.size = stat_result.st_size
+        self.modified = datetime.datetime.utcfromtimestamp(int(stat_result.st_mtime))
+        self.checked_at = time.monotonic()
+        self.mime_type, encoding = mimetypes.guess_type(abspath)
+        self.body = body
+        self.variants = {}
+        if digest is None:
+            digest = hashlib.sha1(body).hexdigest()
+        self.digest = digest[:20]
+
+    @property
+    def compressible(self):
+        return self.body is not None and self.mime_type is not None and self.mime_type.startswith(COMPRESSIBLE_TYPES)
+
+    @property
+    def memory_size(self):
+        return (len(self.body) if self.body is not None else 0) + sum(len(v) for v in self.variants.values() if v is not None)
+
+    def etag(self, encoding=None):
+        if encoding:
+            return '"{0}-{1}"'.format(self.digest, encoding)
+        return '"{0}"'.format(self.digest)
+
+
+class StaticAssetCache:
+    """
+    Bounded LRU of static files for the player and snapweb.
+
+    File content, metadata and compressed variants are kept in memory. Entries are
+    checked against the file mtime and size at most once per revalidate interval.
+    Files bigger than max_file_size are streamed from disk, only their metadata and
+    content hash are kept, so they are hashed once per change like the others.
+    Concurrent misses of the same file share one read.
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024, max_file_size=4 * 1024 * 1024, revalidate_interval=2.0,
+                 compression_level=6):
+        self.logger = logging.getLogger(__name__)
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+        self.compression_level = compression_level
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # abspath -> task reading the file, for concurrent misses
+        self.loading = {}
+
+    def encodings(self):
+        if brotli is not None:
+            return ['br', 'gzip']
+        return ['gzip']
+
+    async def get(self, abspath):
+        asset = self.entries.get(abspath)
+        if asset is not None:
+            now = time.monotonic()
+            if now - asset.checked_at < self.revalidate_interval:
+                self.entries.move_to_end(abspath)
+                self.hits += 1
+                return asset
+
+            stat_result = os.stat(abspath)
+            if stat_result.st_mtime == asset.mtime and stat_result.st_size == asset.size:
+                asset.checked_at = now
+                self.entries.move_to_end(abspath)
+                self.hits += 1
+                return asset
+
+            self.logger.debug("{0} changed on disk, reloading.".format(abspath))
+            self.remove(abspath)
+
+        self.misses += 1
+        loading = self.loading.get(abspath)
+        if loading is None:
+            loading = asyncio.ensure_future(self.load(abspath))
+            self.loading[abspath] = loading
+        # a cancelled request must not cancel the read the others wait for
+        return await asyncio.shield(loading)
+
+    async def load(self, abspath):
+        try:
+            return await self.read_asset(abspath)
+        finally:
+            del self.loading[abspath]
+
+    async def read_asset(self, abspath):
+        stat_result = os.stat(abspath)
+        body = None
+        digest = None
+        if stat_result.st_size <= self.max_file_size:
+            body = await ioloop.IOLoop.current().run_in_executor(None, self.read_file, abspath)
+        else:
+            # the digest is compared with the fingerprint of hashed asset names
+            digest = await ioloop.IOLoop.current().run_in_executor(None, hash_file, abspath)
+        asset = CachedAsset(abspath, stat_result, body, digest)
+        self.add(asset)
+        return asset
+
+    async def get_variant(self, asset, encoding):
+        if encoding not in asset.variants:
+            variant = await ioloop.IOLoop.current().run_in_executor(None, self.compress, asset, encoding)
+            if encoding in asset.variants:
+                # compressed by a concurrent request meanwhile, it is counted already
+                return asset.variants[encoding]
+            if len(variant) >= len(asset.body):
+                # not worth it, the identity body is sent instead
+                variant = None
+            asset.variants[encoding] = variant
+            if variant is not None and self.entries.get(asset.abspath) is asset:
+                self.size += len(variant)
+                self.evict()
+        return asset.variants[encoding]
+
+    def compress(self, asset, encoding):
+        # a precompressed file next to the original wins, if it is not outdated
+        suffix = '.br' if encoding == 'br' else '.gz'
+        precompressed = asset.abspath + suffix
+        if os.path.isfile(precompressed) and os.stat(precompressed).st_mtime >= asset.mtime:
+            return self.read_file(precompressed)
+
+        if encoding == 'br':
+            return brotli.compress(asset.body)
+        return gzip.compress(asset.body, compresslevel=self.compression_level)
+
+    def read_file(self, abspath):
+        with open(abspath, "rb") as file:
+            return file.read()
+
+    def add(self, asset):
+        # a replaced entry, with its variants, is not counted anymore
+        self.remove(asset.abspath)
+        self.entries[asset.abspath] = asset
+        self.size += asset.memory_size
+        self.evict()
+
+    def remove(self, abspath):
+        asset = self.entries.pop(abspath, None)
+        if asset is not None:
+            self.size -= asset.memory_size
+
+    def evict(self):
+        while self.size > self.max_size and len(self.entries) > 1:
+            abspath, asset = self.entries.popitem(last=False)
+            self.size -= asset.memory_size
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
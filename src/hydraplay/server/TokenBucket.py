@@ -0,0 +1,28 @@
+import time
+
+
+class TokenBucket:
+    """
+    Allows rate actions per second on average, after a burst of up to burst actions.
+    A rate of 0 allows everything.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def take(self, now=None):
+        """Returns True and uses up a token when one is left."""
+        if not self.rate:
+            return True
+        if now is None:
+            now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
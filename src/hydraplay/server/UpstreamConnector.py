@@ -0,0 +1,171 @@
+import datetime
+import logging
+import random
+import time
+from urllib.parse import urlparse
+
+from tornado import gen
+from tornado.tcpclient import TCPClient
+from tornado.websocket import websocket_connect
+
+
+class UpstreamUnavailableError(Exception):
+    """
+    Raised when no connection to an upstream could be established.
+    """
+    pass
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """
+    Raised when a connection is refused because the upstream is known to be down.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive connection failures of one upstream. After too many failures
+    the circuit opens and connection attempts fail fast. Once the reset timeout has
+    passed a single health probe is allowed, a successful probe closes the circuit again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+
+    def probe_due(self):
+        return self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class UpstreamState:
+
+    def __init__(self, uri, breaker):
+        self.uri = uri
+        self.breaker = breaker
+        self.connects = 0
+        self.failures = 0
+        self.rejected = 0
+        self.last_latency = None
+        self.total_latency = 0.0
+
+    def to_dict(self):
+        return {
+            'uri': self.uri,
+            'state': self.breaker.state,
+            'connects': self.connects,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'last_connect_latency': self.last_latency,
+            'avg_connect_latency': self.total_latency / self.connects if self.connects else None
+        }
+
+
+class UpstreamConnector:
+    """
+    Opens websocket connections to Mopidy and Snapcast without blocking the IOLoop.
+    Failed attempts are retried with jittered exponential backoff, every upstream
+    gets its own circuit breaker and connect statistics.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=5.0, connect_timeout=5.0,
+                 failure_threshold=3, reset_timeout=10.0):
+        self.logger = logging.getLogger(__name__)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.connect_timeout = connect_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.upstreams = {}
+
+    def get_upstream(self, uri):
+        upstream = self.upstreams.get(uri)
+        if upstream is None:
+            upstream = UpstreamState(uri, CircuitBreaker(self.failure_threshold, self.reset_timeout))
+            self.upstreams[uri] = upstream
+        return upstream
+
+    def stats(self):
+        return [upstream.to_dict() for upstream in self.upstreams.values()]
+
+    def backoff(self, attempt):
+        # "full jitter", spreads reconnecting clients after an upstream restart
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def probe(self, uri):
+        location = urlparse(uri)
+        try:
+            stream = await gen.with_timeout(datetime.timedelta(seconds=self.connect_timeout),
+                                            TCPClient().connect(location.hostname, location.port))
+            stream.close()
+            return True
+        except Exception:
+            return False
+
+    async def connect(self, uri, **kwargs):
+        upstream = self.get_upstream(uri)
+        breaker = upstream.breaker
+
+        for attempt in range(self.max_attempts):
+            if breaker.state == CircuitBreaker.HALF_OPEN:
+                # another client is already probing this upstream
+                upstream.rejected += 1
+                raise CircuitOpenError(uri)
+
+            if breaker.state == CircuitBreaker.OPEN:
+                if not breaker.probe_due():
+                    upstream.rejected += 1
+                    raise CircuitOpenError(uri)
+
+                breaker.state = CircuitBreaker.HALF_OPEN
+                self.logger.info("Probing upstream {0}".format(uri))
+                if not await self.probe(uri):
+                    upstream.failures += 1
+                    breaker.record_failure()
+                    self.logger.info("Upstream {0} is still down.".format(uri))
+                    raise CircuitOpenError(uri)
+
+            started = time.monotonic()
+            try:
+                connection = await gen.with_timeout(datetime.timedelta(seconds=self.connect_timeout),
+                                                    websocket_connect(url=uri, **kwargs))
+            except Exception as e:
+                upstream.failures += 1
+                breaker.record_failure()
+                delay = self.backoff(attempt)
+                self.logger.info("{0} not ready ({1}), trying again in {2:.2f} seconds ...".format(uri, e, delay))
+                if breaker.state == CircuitBreaker.OPEN:
+                    self.logger.warning("Circuit for {0} opened after {1} failures.".format(
+                        uri, breaker.consecutive_failures))
+                    raise CircuitOpenError(uri)
+                await gen.sleep(delay)
+                continue
+
+            latency = time.monotonic() - started
+            upstream.connects += 1
+            upstream.last_latency = latency
+            upstream.total_latency += latency
+            breaker.record_success()
+            self.logger.info("{0} connected in {1:.3f} seconds.".format(uri, latency))
+            return connection
+
+        self.logger.info("max number of connection attempts reached for {0}".format(uri))
+        raise UpstreamUnavailableError(uri)
@@ -1,4 +1,5 @@
 import tornado.web
+from urllib.parse import urlparse
 
 class BaseHandler(tornado.web.RequestHandler):
 
@@ -16,4 +17,23 @@ class BaseHandler(tornado.web.RequestHandler):
     def options(self, *args, **kwargs):
         # no body
         self.set_status(204)
-        self.finish()
\ No newline at end of file
+        self.finish()
+
+    def is_same_origin(self):
+        """False for requests a browser sends on behalf of a page from another origin."""
+        origin = self.request.headers.get("Origin")
+        if origin is None:
+            # not sent by browsers for same origin GETs, nor by other clients
+            return True
+        return urlparse(origin).netloc.lower() == self.request.host.lower()
+
+    def check_json_request(self):
+        """
+        Only lets same origin JSON requests change the server. Other content types are
+        sent by any web page without a CORS preflight.
+        """
+        if not self.is_same_origin():
+            raise tornado.web.HTTPError(403, "cross origin requests are not allowed")
+        content_type = self.request.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            raise tornado.web.HTTPError(415, "Content-Type must be application/json")
@@ -0,0 +1,105 @@
+import logging
+from tornado import httputil
+from tornado.httpclient import HTTPRequest
+from hydraplay.server.handler.BaseHandler import BaseHandler
+
+
+class ClientGone(Exception):
+    pass
+
+
+class CoordinatorProxyHandler(BaseHandler):
+    """
+    Forwards the API requests a worker process receives to the coordinator, which owns
+    the config, the child processes and the media scanner. The response is streamed
+    back as it arrives, so long polls and server sent events work through the worker.
+    """
+
+    # server sent events of a scan job stay open until the job is finished
+    REQUEST_TIMEOUT = 3600
+    BODY_METHODS = ("POST", "PUT", "PATCH")
+    # Host is passed on, the coordinator compares it with the Origin of the client
+    HOP_HEADERS = ("Connection", "Keep-Alive", "Transfer-Encoding", "Content-Length", "Upgrade",
+                   "Proxy-Connection", "Te", "Trailer")
+
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.coordinator_url = kwargs.get('coordinator_url')
+        self.client = kwargs.get('client')
+        self.response_start = None
+        self.response_headers = None
+        self.headers_copied = False
+        self.client_gone = False
+
+    async def get(self, *args):
+        await self.forward()
+
+    async def post(self, *args):
+        await self.forward()
+
+    async def put(self, *args):
+        await self.forward()
+
+    async def delete(self, *args):
+        await self.forward()
+
+    async def forward(self):
+        headers = httputil.HTTPHeaders()
+        for name, value in self.request.headers.get_all():
+            if name not in self.HOP_HEADERS:
+                headers.add(name, value)
+
+        body = self.request.body if self.request.method in self.BODY_METHODS else None
+        request = HTTPRequest(self.coordinator_url + self.request.uri, method=self.request.method, headers=headers,
+                              body=body, follow_redirects=False, decompress_response=False,
+                              request_timeout=self.REQUEST_TIMEOUT, header_callback=self.on_header_line,
+                              streaming_callback=self.on_chunk)
+        try:
+            response = await self.client.fetch(request, raise_error=False)
+        except ClientGone:
+            self.logger.debug("Client of {0} went away".format(self.request.uri))
+            return
+        except Exception as e:
+            response = None
+            self.logger.warning("Forwarding {0} to the coordinator failed: {1}".format(self.request.uri, e))
+
+        if self.headers_copied:
+            self.finish()
+        elif response is None or response.code == 599:
+            self.set_status(502)
+            self.finish("coordinator unavailable")
+        else:
+            self.copy_headers()
+            self.finish()
+
+    def on_header_line(self, line):
+        if line.startswith("HTTP/"):
+            # a new response starts, e.g. after 100-continue
+            self.response_start = httputil.parse_response_start_line(line.strip())
+            self.response_headers = httputil.HTTPHeaders()
+        elif line.strip():
+            self.response_headers.parse_line(line)
+
+    def copy_headers(self):
+        self.headers_copied = True
+        self.set_status(self.response_start.code, self.response_start.reason)
+        replaced = set()
+        for name, value in self.response_headers.get_all():
+            if name in self.HOP_HEADERS:
+                continue
+            if name not in replaced:
+                self.clear_header(name)
+                replaced.add(name)
+            self.add_header(name, value)
+
+    def on_chunk(self, chunk):
+        if self.client_gone:
+            # aborts the request to the coordinator
+            raise ClientGone()
+        if not self.headers_copied:
+            self.copy_headers()
+        self.write(chunk)
+        self.flush()
+
+    def on_connection_close(self):
+        self.client_gone = True
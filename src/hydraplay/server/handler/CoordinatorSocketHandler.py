@@ -0,0 +1,49 @@
+import logging
+
+from tornado import websocket
+
+
+class CoordinatorSocketHandler(websocket.WebSocketHandler):
+    """
+    Relays a websocket of the API, like /api/logs/tail, from a worker process to the
+    coordinator. The HTTP requests of the API go through CoordinatorProxyHandler.
+    """
+
+    INTERNAL_ERROR = 1011
+
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.coordinator_url = kwargs.get('coordinator_url')
+        self.connections = kwargs.get('connections')
+        self.upstream = None
+
+    async def open(self, *args):
+        try:
+            self.upstream = await websocket.websocket_connect(self.coordinator_url + self.request.uri,
+                                                              on_message_callback=self.on_upstream_message)
+        except Exception as e:
+            self.logger.warning("Connecting {0} to the coordinator failed: {1}".format(self.request.uri, e))
+            self.close(self.INTERNAL_ERROR, "coordinator unavailable")
+            return
+        if self.connections is not None:
+            self.connections.add(self)
+
+    def on_upstream_message(self, message):
+        if message is None:
+            # the coordinator closed the websocket
+            self.close(self.upstream.close_code, self.upstream.close_reason)
+            return
+        try:
+            self.write_message(message, binary=isinstance(message, bytes))
+        except websocket.WebSocketClosedError:
+            self.upstream.close()
+
+    def on_message(self, message):
+        if self.upstream is not None:
+            self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+        if self.connections is not None:
+            self.connections.discard(self)
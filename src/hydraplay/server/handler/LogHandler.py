@@ -0,0 +1,39 @@
+import tornado.web
+import logging
+import json
+from hydraplay.server.handler.BaseHandler import BaseHandler
+from hydraplay.server.LogBuffer import LogFilter
+
+class LogHandler(BaseHandler):
+    """
+    Recent log lines from the in-memory LogBuffer, filtered with the query arguments
+    sources, level and pattern (see LogFilter). after returns only lines numbered
+    above it, limit the newest lines (default 200).
+    """
+
+    DEFAULT_LIMIT = 200
+    MAX_LIMIT = 5000
+
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.log_buffer = kwargs.get('log_buffer')
+
+    def get(self):
+        # the logs show paths, hosts and stream URLs, other web pages must not read them
+        if not self.is_same_origin():
+            raise tornado.web.HTTPError(403, "cross origin requests are not allowed")
+        try:
+            log_filter = LogFilter.from_request(self)
+            after = int(self.get_query_argument("after", 0))
+            limit = min(int(self.get_query_argument("limit", self.DEFAULT_LIMIT)), self.MAX_LIMIT)
+            if limit < 0:
+                raise ValueError("limit must not be negative")
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+
+        entries, last = self.log_buffer.read(log_filter, after, limit)
+        self.write(json.dumps({
+            'lines': [self.log_buffer.to_dict(entry) for entry in entries],
+            'last': last,
+            'sources': self.log_buffer.stats()
+        }))
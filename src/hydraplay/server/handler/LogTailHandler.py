@@ -0,0 +1,59 @@
+import asyncio
+import json
+import logging
+
+from tornado import websocket
+
+from hydraplay.server.LogBuffer import LogFilter
+
+
+class LogTailHandler(websocket.WebSocketHandler):
+    """
+    Tails the LogBuffer over a websocket. The filter is given with the query arguments
+    like at /api/logs, only matching lines are sent. After the newest backlog lines
+    (default 100) new lines are sent every TAIL_INTERVAL as {"lines": [...]}.
+    """
+
+    TAIL_INTERVAL = 0.25
+    DEFAULT_BACKLOG = 100
+    POLICY_VIOLATION = 1008
+
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.log_buffer = kwargs.get('log_buffer')
+        self.connections = kwargs.get('connections')
+        self.task = None
+
+    def open(self):
+        try:
+            log_filter = LogFilter.from_request(self)
+            backlog = int(self.get_query_argument("backlog", self.DEFAULT_BACKLOG))
+            if backlog < 0:
+                raise ValueError("backlog must not be negative")
+        except ValueError as e:
+            self.close(self.POLICY_VIOLATION, str(e))
+            return
+        if self.connections is not None:
+            self.connections.add(self)
+        self.task = asyncio.ensure_future(self.tail(log_filter, backlog))
+
+    async def tail(self, log_filter, backlog):
+        entries, last = self.log_buffer.read(log_filter, limit=backlog)
+        while True:
+            if entries:
+                try:
+                    await self.write_message(json.dumps({'lines': [self.log_buffer.to_dict(entry)
+                                                                   for entry in entries]}))
+                except websocket.WebSocketClosedError:
+                    return
+            await asyncio.sleep(self.TAIL_INTERVAL)
+            entries, last = self.log_buffer.read(log_filter, last)
+
+    def on_message(self, message):
+        pass
+
+    def on_close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.connections is not None:
+            self.connections.discard(self)
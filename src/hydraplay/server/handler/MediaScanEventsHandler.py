@@ -0,0 +1,39 @@
+import tornado.web
+import logging
+import json
+from tornado.iostream import StreamClosedError
+from hydraplay.server.handler.BaseHandler import BaseHandler
+
+class MediaScanEventsHandler(BaseHandler):
+    """
+    Streams the progress of a scan job as server sent events until the job is finished.
+    """
+
+    KEEPALIVE_INTERVAL = 15
+
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.scanner = kwargs.get('scanner')
+
+    async def get(self, job_id):
+        job = self.scanner.get(job_id)
+        if job is None:
+            raise tornado.web.HTTPError(404, "unknown scan job")
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        try:
+            version = None
+            while True:
+                if version != job.version:
+                    version = job.version
+                    self.write("event: {0}\ndata: {1}\n\n".format(job.state, json.dumps(job.to_dict())))
+                    await self.flush()
+                    if job.is_finished():
+                        break
+                elif not await job.wait_for_update(version, self.KEEPALIVE_INTERVAL):
+                    self.write(": keepalive\n\n")
+                    await self.flush()
+        except StreamClosedError:
+            self.logger.debug("Client of scan job {0} went away".format(job_id))
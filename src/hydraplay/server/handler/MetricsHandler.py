@@ -0,0 +1,154 @@
+import logging
+from hydraplay.server.handler.BaseHandler import BaseHandler
+from hydraplay.server.Metrics import ProxyMetrics
+
+class MetricsHandler(BaseHandler):
+    """
+    Exposes counters of the proxy, the upstreams, the static cache, the child processes,
+    the IOLoop and the log pipeline in the Prometheus text format. The counters are kept
+    up to date where they change, a scrape only reads them.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.metrics = kwargs.get('metrics')
+        self.connector = kwargs.get('connector')
+        self.static_cache = kwargs.get('static_cache')
+        self.supervisor = kwargs.get('supervisor')
+        self.loop_monitor = kwargs.get('loop_monitor')
+        self.watchdog = kwargs.get('watchdog')
+        self.log_pipeline = kwargs.get('log_pipeline')
+        self.coordinator_channel = kwargs.get('coordinator_channel')
+        self.lines = []
+
+    def add(self, name, metric_type, help_text, samples):
+        self.lines.append("# HELP {0} {1}".format(name, help_text))
+        self.lines.append("# TYPE {0} {1}".format(name, metric_type))
+        for labels, value in samples:
+            self.add_sample(name, labels, value)
+
+    def add_summary(self, name, help_text, samples):
+        self.lines.append("# HELP {0} {1}".format(name, help_text))
+        self.lines.append("# TYPE {0} summary".format(name))
+        for labels, total, count in samples:
+            self.add_sample(name + "_sum", labels, total)
+            self.add_sample(name + "_count", labels, count)
+
+    @staticmethod
+    def escape_label(value):
+        # the escapes of the text format, a backslash first so the others are not doubled
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def add_sample(self, name, labels, value):
+        if labels:
+            label_text = ",".join('{0}="{1}"'.format(key, self.escape_label(label)) for key, label in labels)
+            self.lines.append("{0}{{{1}}} {2}".format(name, label_text, value))
+        else:
+            self.lines.append("{0} {1}".format(name, value))
+
+    def get(self):
+        self.add_proxy_metrics()
+        self.add_upstream_metrics()
+        self.add_static_cache_metrics()
+        self.add_process_metrics()
+        self.add_loop_metrics()
+        self.add_log_metrics()
+
+        self.set_header("Content-Type", self.CONTENT_TYPE)
+        self.set_header("Cache-Control", "no-cache")
+        self.write("\n".join(self.lines) + "\n")
+
+    def add_proxy_metrics(self):
+        metrics = self.metrics
+        if self.coordinator_channel is not None:
+            # the clients are connected to the workers, sum up their last reports
+            metrics = ProxyMetrics()
+            metrics.merge(self.metrics.snapshot())
+            for snapshot in self.coordinator_channel.metrics_snapshots():
+                metrics.merge(snapshot)
+        routes = sorted(metrics.routes.items())
+        self.add("hydraplay_websocket_proxies", "gauge", "Open websocket proxies.",
+                 [((('route', route),), metrics.active) for route, metrics in routes])
+        self.add("hydraplay_websocket_proxies_opened_total", "counter", "Websocket proxies opened.",
+                 [((('route', route),), metrics.opened) for route, metrics in routes])
+        self.add("hydraplay_websocket_messages_total", "counter", "Websocket messages by direction.",
+                 [((('route', route), ('direction', 'in')), metrics.messages_in) for route, metrics in routes] +
+                 [((('route', route), ('direction', 'out')), metrics.messages_out) for route, metrics in routes])
+        self.add("hydraplay_websocket_bytes_total", "counter", "Websocket payload bytes by direction.",
+                 [((('route', route), ('direction', 'in')), metrics.bytes_in) for route, metrics in routes] +
+                 [((('route', route), ('direction', 'out')), metrics.bytes_out) for route, metrics in routes])
+
+    def add_upstream_metrics(self):
+        upstreams = sorted(self.connector.upstreams.items())
+        self.add("hydraplay_upstream_connects_total", "counter", "Successful upstream connects.",
+                 [((('upstream', uri),), upstream.connects) for uri, upstream in upstreams])
+        self.add("hydraplay_upstream_connect_failures_total", "counter", "Failed upstream connect attempts.",
+                 [((('upstream', uri),), upstream.failures) for uri, upstream in upstreams])
+        self.add("hydraplay_upstream_rejected_total", "counter", "Connects rejected by the open circuit.",
+                 [((('upstream', uri),), upstream.rejected) for uri, upstream in upstreams])
+        self.add_summary("hydraplay_upstream_connect_latency_seconds", "Upstream connect latency.",
+                         [((('upstream', uri),), upstream.total_latency, upstream.connects)
+                          for uri, upstream in upstreams])
+
+    def add_static_cache_metrics(self):
+        stats = self.static_cache.stats()
+        requests = stats['hits'] + stats['misses']
+        self.add("hydraplay_static_cache_hits_total", "counter", "Static files served from memory.",
+                 [((), stats['hits'])])
+        self.add("hydraplay_static_cache_misses_total", "counter", "Static files read from disk.",
+                 [((), stats['misses'])])
+        self.add("hydraplay_static_cache_hit_ratio", "gauge", "Share of static requests served from memory.",
+                 [((), stats['hits'] / requests if requests else 0)])
+        self.add("hydraplay_static_cache_bytes", "gauge", "Memory used by the static cache.",
+                 [((), stats['size'])])
+
+    def add_process_metrics(self):
+        rss = []
+        cpu = []
+        restarts = []
+        up = []
+        suppressed = []
+        for label, executor in sorted(self.supervisor.processes.items()):
+            labels = (('process', label),)
+            restarts.append((labels, executor.restarts))
+            up.append((labels, 1 if executor.is_alive() else 0))
+            if executor.throttle is not None:
+                for reason, count in sorted(executor.throttle.stats().items()):
+                    suppressed.append((labels + (('reason', reason),), count))
+            usage = executor.resource_usage()
+            if usage is not None:
+                rss.append((labels, usage[0]))
+                cpu.append((labels, usage[1]))
+        self.add("hydraplay_process_up", "gauge", "Child process is running.", up)
+        self.add("hydraplay_process_restarts_total", "counter", "Restarts of the child process.", restarts)
+        self.add("hydraplay_process_resident_memory_bytes", "gauge", "Resident memory of the child process.", rss)
+        self.add("hydraplay_process_cpu_seconds_total", "counter", "CPU time of the child process.", cpu)
+        self.add("hydraplay_process_log_lines_suppressed_total", "counter",
+                 "Output lines of the child process which were not logged.", suppressed)
+
+    def add_loop_metrics(self):
+        monitor = self.loop_monitor
+        self.add("hydraplay_ioloop_lag_last_seconds", "gauge", "Last measured IOLoop lag.", [((), monitor.last_lag)])
+        self.add("hydraplay_ioloop_lag_max_seconds", "gauge", "Highest IOLoop lag.", [((), monitor.max_lag)])
+        self.add("hydraplay_ioloop_lag_seconds_total", "counter", "Sum of all measured IOLoop lags.",
+                 [((), monitor.total_lag)])
+        self.add("hydraplay_ioloop_lag_samples_total", "counter", "IOLoop lag measurements.",
+                 [((), monitor.samples)])
+        if self.watchdog is not None:
+            self.add("hydraplay_ioloop_stalls_total", "counter", "Times the IOLoop was blocked.",
+                     [((), self.watchdog.stalls)])
+
+    def add_log_metrics(self):
+        if self.log_pipeline is None:
+            return
+        stats = self.log_pipeline.stats()
+        self.add("hydraplay_log_records_queued", "gauge", "Log records waiting for the writer thread.",
+                 [((), stats['queued'])])
+        self.add("hydraplay_log_records_written_total", "counter", "Log records written by the writer thread.",
+                 [((), stats['written'])])
+        self.add("hydraplay_log_batches_total", "counter", "Batches written by the writer thread.",
+                 [((), stats['batches'])])
+        self.add("hydraplay_log_records_dropped_total", "counter", "Log records dropped on a full queue.",
+                 [((), stats['dropped'])])
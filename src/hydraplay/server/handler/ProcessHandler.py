@@ -0,0 +1,11 @@
+import logging
+import json
+from hydraplay.server.handler.BaseHandler import BaseHandler
+
+class ProcessHandler(BaseHandler):
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.supervisor = kwargs.get('supervisor')
+
+    def get(self):
+        self.write(json.dumps({'processes': self.supervisor.status()}))
@@ -0,0 +1,38 @@
+import tornado.web
+import logging
+import json
+from hydraplay.server.handler.BaseHandler import BaseHandler
+
+class ProfilerHandler(BaseHandler):
+    """
+    GET returns the state of profiler and stall watchdog, with ?format=collapsed the
+    sampled stacks for a flamegraph. POST .../start and .../stop control the profiler.
+    """
+
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.profiler = kwargs.get('profiler')
+        self.watchdog = kwargs.get('watchdog')
+
+    def get(self, action=None):
+        if action is not None:
+            raise tornado.web.HTTPError(405)
+
+        if self.get_query_argument("format", None) == "collapsed":
+            self.set_header("Content-Type", "text/plain; charset=utf-8")
+            self.write(self.profiler.dump())
+            return
+
+        status = {'profiler': self.profiler.to_dict()}
+        status['watchdog'] = self.watchdog.to_dict() if self.watchdog is not None else None
+        self.write(json.dumps(status))
+
+    def post(self, action=None):
+        self.check_json_request()
+        if action == "start":
+            self.profiler.start()
+        elif action == "stop":
+            self.profiler.stop()
+        else:
+            raise tornado.web.HTTPError(404)
+        self.write(json.dumps({'profiler': self.profiler.to_dict()}))
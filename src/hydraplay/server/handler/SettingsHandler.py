@@ -1,36 +1,68 @@
 import tornado.web
 import logging
 import json
+from hydraplay.server.Reconfigurator import SettingsConflict
 from hydraplay.server.handler.BaseHandler import BaseHandler
 
 class SettingsHandler(BaseHandler):
+
+    # longest time a client may wait for a settings change
+    MAX_WAIT = 60
+
     def initialize(self, *args, **kwargs):
         self.logger = logging.getLogger(__name__)
         self.config = kwargs.get('config')
+        self.reconfigurator = kwargs.get('reconfigurator')
+        self.settings_document = kwargs.get('settings_document')
 
-    def get_list_of_extensions(self):
-        extensions = []
-        for key, value in self.config.content['mopidy']['extensions'].items():
-            if self.config.content['mopidy']['extensions'][key]['enabled']:
-                extensions.append(key)
-        return extensions
-
-    def get(self):
+    async def get(self):
+        """
+        Returns the settings. With If-None-Match and ?wait=<seconds> the request is held
+        until the settings change, which replaces polling by the clients.
+        """
+        body, etag = self.settings_document.get()
+        client_etag = self.request.headers.get("If-None-Match")
+        try:
+            wait = min(float(self.get_query_argument("wait", 0)), self.MAX_WAIT)
+        except ValueError:
+            raise tornado.web.HTTPError(400, "wait must be a number of seconds")
 
-        settings = {}
+        if client_etag == etag and wait > 0:
+            if await self.settings_document.wait_for_change(etag, wait):
+                body, etag = self.settings_document.get()
 
-        mopidy_instances = []
-        for instance in range(self.config.content['mopidy']['instances']):
-            port = int(self.config.content['mopidy']['web_base_port']) + instance
-            mopidy_instance = dict()
-            mopidy_instance['stream_id'] = 'MOPIDY-{0}'.format(instance)
-            mopidy_instance['id'] = instance
-            mopidy_instance['port'] = port
-            mopidy_instance['extensions'] = self.get_list_of_extensions()
-            mopidy_instances.append(mopidy_instance)
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("Etag", etag)
+        if client_etag == etag:
+            self.set_status(304)
+            return
+        self.write(body)
 
-        settings['mopidy_instances'] = mopidy_instances
-        settings['hydraplay'] = self.config.content['hydraplay']
+    def compute_etag(self):
+        # the Etag is set from the settings document
+        return None
 
-        self.write(json.dumps(settings))
+    async def post(self):
+        """
+        Applies a settings patch. With If-Match the patch is only applied when the settings
+        are still the ones of that ETag, otherwise the answer is 412.
+        """
+        self.check_json_request()
+        expected_version = None
+        client_etag = self.request.headers.get("If-Match")
+        if client_etag is not None:
+            if client_etag != self.settings_document.get()[1]:
+                raise tornado.web.HTTPError(412, "the settings were changed meanwhile")
+            expected_version = self.config.version
+        try:
+            patch = self.settings_document.read_patch(json.loads(self.request.body))
+            changes = await self.reconfigurator.apply(patch, expected_version)
+        except SettingsConflict:
+            raise tornado.web.HTTPError(412, "the settings were changed meanwhile")
+        except ValueError as e:
+            self.set_status(400)
+            self.write(json.dumps({'error': str(e)}))
+            return
 
+        self.write(json.dumps(changes))
@@ -5,6 +5,7 @@ import email
 import mimetypes
 import stat
 import logging
+import email.utils
 from tornado.web import HTTPError
 from hydraplay.server.handler.BaseHandler import BaseHandler
 
@@ -26,16 +27,32 @@ class StaticFileHandler(BaseHandler):
     with the path, we set an infinite HTTP expiration header. So, if you
     want browsers to cache a file indefinitely, send them to, e.g.,
     /static/images/myimage.png?v=xxx.
+
+    If a StaticAssetCache is passed as "cache" argument, files are served from
+    memory with compressed variants, strong ETags and byte range support. With
+    an AssetManifest as "manifest" argument, fingerprinted asset names are served
+    as immutable and index.html is served with rewritten references.
     """
-    def initialize(self, path, default_filename=None):
+    CHUNK_SIZE = 64 * 1024
+    IMMUTABLE = "public, max-age=31536000, immutable"
+
+    def initialize(self, path, default_filename=None, cache=None, manifest=None):
         self.root = os.path.abspath(path) + os.path.sep
         self.default_filename = default_filename
+        self.cache = cache
+        self.manifest = manifest
         self._logger = logging.getLogger(__name__)
 
-    def head(self, path):
-        self.get(path, include_body=False)
+    async def head(self, path):
+        await self.get(path, include_body=False)
 
-    def get(self, path, include_body=True):
+    async def get(self, path, include_body=True):
+
+        fingerprint = None
+        if self.manifest is not None and self.cache is not None:
+            fingerprinted = self.manifest.resolve(path)
+            if fingerprinted is not None:
+                path, fingerprint = fingerprinted
 
         if os.path.sep != "/":
             path = path.replace("/", os.path.sep)
@@ -57,6 +74,10 @@ class StaticFileHandler(BaseHandler):
         if not os.path.isfile(abspath):
             raise HTTPError(403, "%s is not a file", path)
 
+        if self.cache is not None:
+            await self.get_cached(abspath, path, include_body, fingerprint)
+            return
+
         stat_result = os.stat(abspath)
         modified = datetime.datetime.fromtimestamp(stat_result[stat.ST_MTIME])
 
@@ -92,6 +113,130 @@ class StaticFileHandler(BaseHandler):
         finally:
             file.close()
 
+    async def get_cached(self, abspath, path, include_body, fingerprint=None):
+        index = await self.manifest.get_index(abspath) if self.manifest is not None else None
+        asset = index or await self.cache.get(abspath)
+
+        self.set_header("Last-Modified", asset.modified)
+        if fingerprint is not None and asset.digest.startswith(fingerprint):
+            self.set_header("Cache-Control", self.IMMUTABLE)
+        elif index is not None or fingerprint is not None:
+            # references the fingerprinted assets of this version, always revalidate
+            self.set_header("Cache-Control", "no-cache")
+        elif "v" in self.request.arguments:
+            self.set_header("Expires", datetime.datetime.utcnow() + \
+                                       datetime.timedelta(days=365*10))
+            self.set_header("Cache-Control", "max-age=" + str(86400*365*10))
+        else:
+            self.set_header("Cache-Control", "public")
+        if asset.mime_type:
+            self.set_header("Content-Type", asset.mime_type)
+        self.set_header("Accept-Ranges", "bytes")
+
+        self.set_extra_headers(path)
+
+        range_header = self.request.headers.get("Range")
+        body = asset.body
+        encoding = None
+        if asset.compressible:
+            self.set_header("Vary", "Accept-Encoding")
+            # byte ranges always refer to the identity representation
+            if range_header is None:
+                encoding = self.select_encoding()
+                if encoding is not None:
+                    variant = await self.cache.get_variant(asset, encoding)
+                    if variant is None:
+                        encoding = None
+                    else:
+                        body = variant
+
+        etag = asset.etag(encoding)
+        self.set_header("Etag", etag)
+        if encoding is not None:
+            self.set_header("Content-Encoding", encoding)
+
+        if self.is_not_modified(etag, asset.modified):
+            self.set_status(304)
+            return
+
+        start, end = 0, asset.size
+        if range_header is not None:
+            request_range = self.parse_range(range_header, asset.size)
+            if request_range is None:
+                self.set_status(416)
+                self.set_header("Content-Range", "bytes */{0}".format(asset.size))
+                return
+            start, end = request_range
+            self.set_status(206)
+            self.set_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end - 1, asset.size))
+
+        if body is not None and encoding is not None:
+            end = len(body)
+        self.set_header("Content-Length", end - start)
+
+        if not include_body:
+            return
+
+        if body is not None:
+            self.write(body[start:end] if (start, end) != (0, len(body)) else body)
+            return
+
+        # too big for the cache, stream it in chunks
+        with open(abspath, "rb") as file:
+            file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = file.read(min(self.CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                self.write(chunk)
+                await self.flush()
+
+    def select_encoding(self):
+        accepted = self.request.headers.get("Accept-Encoding", "")
+        accepted = [value.split(";")[0].strip() for value in accepted.split(",")]
+        for encoding in self.cache.encodings():
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def is_not_modified(self, etag, modified):
+        inm_value = self.request.headers.get("If-None-Match")
+        if inm_value is not None:
+            etags = [value.strip() for value in inm_value.split(",")]
+            return "*" in etags or etag in etags or ("W/" + etag) in etags
+
+        ims_value = self.request.headers.get("If-Modified-Since")
+        if ims_value is not None:
+            date_tuple = email.utils.parsedate(ims_value)
+            if date_tuple is not None:
+                if_since = datetime.datetime(*date_tuple[:6])
+                return if_since >= modified
+        return False
+
+    def parse_range(self, range_header, size):
+        """Parses a single "bytes=" range, returns (start, end) with end exclusive."""
+        unit, _, value = range_header.partition("=")
+        if unit.strip() != "bytes" or "," in value:
+            return None
+        start, _, end = value.strip().partition("-")
+        try:
+            if start == "":
+                # suffix range, the last n bytes
+                length = int(end)
+                if length <= 0:
+                    return None
+                return max(size - length, 0), size
+            start = int(start)
+            end = int(end) + 1 if end else size
+        except ValueError:
+            return None
+        end = min(end, size)
+        if start >= end:
+            return None
+        return start, end
+
     def set_extra_headers(self, path):
         """For subclass to add extra headers to the response"""
         pass
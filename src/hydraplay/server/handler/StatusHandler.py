@@ -0,0 +1,28 @@
+import logging
+import json
+from hydraplay.server.handler.BaseHandler import BaseHandler
+
+class StatusHandler(BaseHandler):
+    def initialize(self, *args, **kwargs):
+        self.logger = logging.getLogger(__name__)
+        self.connector = kwargs.get('connector')
+        self.snapcast_hub = kwargs.get('snapcast_hub')
+        self.mopidy_pool = kwargs.get('mopidy_pool')
+        self.audio_relays = kwargs.get('audio_relays')
+        self.static_cache = kwargs.get('static_cache')
+        self.timeline = kwargs.get('timeline')
+        self.coordinator_channel = kwargs.get('coordinator_channel')
+
+    def get(self):
+        status = {}
+        status['upstreams'] = self.connector.stats()
+        status['snapcast_hub'] = self.snapcast_hub.stats()
+        status['mopidy_pool'] = self.mopidy_pool.stats()
+        status['mopidy_muxes'] = [mux.stats() for mux in self.mopidy_pool.event_muxes.values()]
+        status['audio_relays'] = self.audio_relays.stats()
+        status['static_cache'] = self.static_cache.stats()
+        status['startup'] = self.timeline.to_list()
+        if self.coordinator_channel is not None:
+            status['workers'] = self.coordinator_channel.stats()
+
+        self.write(json.dumps(status))
@@ -1,14 +1,30 @@
 from tornado import websocket, web, ioloop
-from tornado.websocket import websocket_connect
+from hydraplay.server.UpstreamConnector import UpstreamUnavailableError
+from hydraplay.server.Metrics import ProxyMetrics, payload_size
 import json
 import logging
-import time
 
 
 class WebsocketProxyHandler(websocket.WebSocketHandler):
 
-    def initialize(self):
+    # how long a client waits for its Mopidy instance while the pool is booting
+    READY_TIMEOUT = 60
+
+    def initialize(self, connector, snapcast_hub, mopidy_pool, audio_relays, metrics=None, connections=None,
+                   websocket_settings=None):
         self.logger = logging.getLogger(__name__)
+        self.connector = connector
+        self.connections = connections
+        self.websocket_settings = websocket_settings
+        self.metrics = metrics
+        self.route_metrics = None
+        self.snapcast_hub = snapcast_hub
+        self.mopidy_pool = mopidy_pool
+        self.audio_relays = audio_relays
+        self.hub = None
+        self.route = None
+        self.instance = None
+        self.relay = None
         self.destination_connection = None
         self.binary = False
         self.ws_uri = "ws://"
@@ -16,68 +32,134 @@ class WebsocketProxyHandler(websocket.WebSocketHandler):
     def check_origin(self, origin):
         return True
 
-    async def open(self, uri):
-
-        try:
-            self.logger.debug("websocket route {0} requested".format(uri))
-            uri = uri.split('/')
+    @staticmethod
+    def is_audio_route(uri):
+        return 'control' in uri[0] and len(uri) > 1 and 'stream' in uri[1]
 
-            # we have a snapcast connection
-            if 'control' in uri[0]:
+    def get_compression_options(self):
+        # negotiated before open(), the audio is compressed already
+        if self.websocket_settings is None or self.is_audio_route(self.path_args[0].split('/')):
+            return None
+        return self.websocket_settings.compression_options()
 
-                # snapcsat audio stream
-                if 'stream' in uri[1]:
-                    self.binary = True
+    def resolve_upstream(self, uri):
+        uri = uri.split('/')
 
-                self.ws_uri = "ws://127.0.0.1:1780/{0}".format(uri[1])
+        # we have a snapcast connection
+        if 'control' in uri[0]:
 
-            # we have a mopidy connection
-            if 'stream' in uri[0]:
-                port = int(uri[1])+6680
+            self.route = ProxyMetrics.CONTROL
 
-                self.binary = False
-                self.ws_uri = "ws://127.0.0.1:{0}/mopidy/ws".format(port)
+            # snapcsat audio stream
+            if self.is_audio_route(uri):
+                self.binary = True
+                self.route = ProxyMetrics.STREAM
 
-            self.destination_connection = None
+            # control clients share one snapserver connection
+            if 'jsonrpc' in uri[1]:
+                self.hub = self.snapcast_hub
 
-            client_connected = False
-            connection_attempt = 0
-            max_connection_attempt = 5
-            while not client_connected:
-                try:
-                    self.destination_connection = await websocket_connect(url=self.ws_uri)
-                    client_connected = True
-                    self.logger.info("{0} connected.".format(self.ws_uri))
+            self.ws_uri = "ws://127.0.0.1:1780/{0}".format(uri[1])
 
-                except Exception as e:
-                    # FIXME: Please refactor me! This is ugly
+        # we have a mopidy connection, all clients of an instance share its event mux
+        if 'stream' in uri[0]:
+            self.binary = False
+            self.route = ProxyMetrics.MOPIDY
+            self.instance = int(uri[1])
+            self.hub = self.mopidy_pool.get_event_mux(self.instance)
+            if self.hub is None:
+                raise web.HTTPError(404, "unknown Mopidy instance {0}".format(uri[1]))
+            self.ws_uri = self.hub.uri
 
-                    connection_attempt += 1
-                    if (connection_attempt == max_connection_attempt):
-                        self.logger.info("max number of connection attempts reached for {0}".format(self.ws_uri))
-                        self.close()
+    async def open(self, uri):
 
-                    reconnect_interval = 3
-                    self.logger.info("{0} not Ready trying again in {1} seconds ...".format(self.ws_uri, reconnect_interval))
-                    time.sleep(reconnect_interval)
+        if self.connections is not None:
+            self.connections.add(self)
+        try:
+            self.logger.debug("websocket route {0} requested".format(uri))
+            self.resolve_upstream(uri)
+            if self.metrics is not None and self.route is not None:
+                self.route_metrics = self.metrics.get(self.route)
+                self.route_metrics.active += 1
+                self.route_metrics.opened += 1
+
+            try:
+                if self.instance is not None:
+                    self.mopidy_pool.ensure_instance(self.instance)
+                if self.instance is not None and not await self.mopidy_pool.wait_ready(self.instance,
+                                                                                        self.READY_TIMEOUT):
+                    raise UpstreamUnavailableError("Mopidy instance {0} is not ready".format(self.instance))
+
+                if self.hub:
+                    # only clients which read JSON-RPC batches ask for them, e.g. the HydraPlay player
+                    await self.hub.subscribe(self, self.get_query_argument("batch", "false") == "true")
+                    if self.ws_connection is None:
+                        self.hub.unsubscribe(self)
+                    return
+
+                connect_options = {}
+                if not self.binary and self.websocket_settings is not None:
+                    connect_options = self.websocket_settings.upstream_connect_options()
+                self.destination_connection = await self.connector.connect(self.ws_uri, **connect_options)
+            except UpstreamUnavailableError:
+                self.logger.info("{0} is not available, closing client connection.".format(self.ws_uri))
+                # 1013: try again later
+                self.close(1013, "upstream unavailable")
+                return
+
+            if self.ws_connection is None:
+                # client went away while we were connecting
+                self.destination_connection.close()
+                return
 
             async def proxy_loop():
                 while True:
                     msg = await self.destination_connection.read_message()
                     if msg is None:
                         break
-                    await self.write_message(msg, self.binary)
+                    try:
+                        await self.write_message(msg, self.binary)
+                    except websocket.WebSocketClosedError:
+                        break
+                # upstream went away, let the client reconnect
+                self.close_all()
+
+            async def relay_loop():
+                # audio is queued for the client, a slow client never stalls the upstream read
+                while not self.relay.closed:
+                    msg = await self.destination_connection.read_message()
+                    if msg is None:
+                        break
+                    self.relay.feed(msg)
+                self.close_all()
 
-            ioloop.IOLoop.current().spawn_callback(proxy_loop)
+            if self.binary:
+                self.relay = self.audio_relays.create(self)
+                ioloop.IOLoop.current().spawn_callback(relay_loop)
+            else:
+                ioloop.IOLoop.current().spawn_callback(proxy_loop)
 
         except Exception as e:
             self.logger.error("Other Exception while handling {0}".format(self.ws_uri))
             self.logger.error(e)
             self.close_all()
 
+    def write_message(self, message, binary=False):
+        route_metrics = self.route_metrics
+        if route_metrics is not None:
+            route_metrics.messages_out += 1
+            route_metrics.bytes_out += payload_size(message)
+        return super().write_message(message, binary)
+
     def on_message(self, message):
+        route_metrics = self.route_metrics
+        if route_metrics is not None:
+            route_metrics.messages_in += 1
+            route_metrics.bytes_in += payload_size(message)
         try:
-            if self.destination_connection:
+            if self.hub:
+                self.hub.send(self, message)
+            elif self.destination_connection:
                 self.destination_connection.write_message(message, self.binary)
         except Exception as e:
             self.logger.error(e)
@@ -85,7 +167,17 @@ class WebsocketProxyHandler(websocket.WebSocketHandler):
 
     def on_close(self):
         self.logger.debug("Closing connection {0}".format(self.ws_uri))
-        self.destination_connection.close()
+        if self.connections is not None:
+            self.connections.discard(self)
+        if self.route_metrics is not None:
+            self.route_metrics.active -= 1
+            self.route_metrics = None
+        if self.hub:
+            self.hub.unsubscribe(self)
+        if self.relay:
+            self.audio_relays.release(self.relay)
+        if self.destination_connection:
+            self.destination_connection.close()
 
     def close_all(self):
         if self.destination_connection:
@@ -0,0 +1,28 @@
+import json
+import logging
+
+from tornado import websocket
+
+
+class WorkerChannelHandler(websocket.WebSocketHandler):
+    """
+    Websocket of one worker process to the coordinator, only bound on the local coordinator port.
+    """
+
+    def initialize(self, channel):
+        self.logger = logging.getLogger(__name__)
+        self.channel = channel
+        self.worker = None
+
+    def open(self):
+        self.worker = self.get_argument("worker")
+        self.channel.add(self.worker, self)
+
+    def on_message(self, message):
+        try:
+            self.channel.on_message(self.worker, json.loads(message))
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.error("Invalid message from worker {0}: {1}".format(self.worker, e))
+
+    def on_close(self):
+        self.channel.remove(self.worker, self)
@@ -0,0 +1,107 @@
+import struct
+
+from tornado import gen, locks
+from tornado.testing import AsyncTestCase, gen_test
+
+from hydraplay.server.AudioRelay import AudioRelay, SNAPCAST_WIRE_CHUNK
+
+
+def message(kind, payload=b""):
+    return struct.pack("<H", kind) + payload
+
+
+class SlowClient:
+    """Browser websocket which only takes a message when released."""
+
+    def __init__(self):
+        self.messages = []
+        self.released = locks.Event()
+        self.close_code = None
+
+    async def write_message(self, chunk, binary=False):
+        await self.released.wait()
+        self.messages.append(chunk)
+
+    def close(self, code=None, reason=None):
+        self.close_code = code
+
+
+class AudioRelayTest(AsyncTestCase):
+
+    def create(self, policy, max_queue=3):
+        self.client = SlowClient()
+        relay = AudioRelay(self.client, max_queue, policy)
+        relay.start()
+        return relay
+
+    @gen_test
+    async def test_messages_are_sent_in_order(self):
+        relay = self.create(AudioRelay.DROP_OLDEST)
+        chunks = [message(SNAPCAST_WIRE_CHUNK, bytes([idx])) for idx in range(3)]
+        for chunk in chunks:
+            relay.feed(chunk)
+
+        self.client.released.set()
+        await gen.sleep(0.01)
+
+        self.assertEqual(self.client.messages, chunks)
+        self.assertEqual(relay.sent, 3)
+        self.assertEqual(relay.queued_bytes, 0)
+
+    @gen_test
+    async def test_drop_oldest_drops_audio_only(self):
+        relay = self.create(AudioRelay.DROP_OLDEST)
+        await gen.sleep(0)
+        control = message(1, b"codec")
+        audio = [message(SNAPCAST_WIRE_CHUNK, bytes([idx])) for idx in range(4)]
+        # the first one is taken by the writer right away and waits for the client
+        relay.feed(audio[0])
+        await gen.sleep(0)
+        for chunk in [control] + audio[1:]:
+            relay.feed(chunk)
+
+        self.assertEqual([chunk for received, chunk in relay.queue], [control, audio[2], audio[3]])
+        self.assertEqual(relay.dropped, 1)
+        self.assertIsNone(self.client.close_code)
+
+    @gen_test
+    async def test_control_message_without_room_disconnects(self):
+        relay = self.create(AudioRelay.DROP_OLDEST, max_queue=2)
+        await gen.sleep(0)
+        relay.feed(message(1))
+        await gen.sleep(0)
+        relay.feed(message(1))
+        relay.feed(message(1))
+
+        relay.feed(message(1))
+
+        self.assertTrue(relay.closed)
+        self.assertEqual(self.client.close_code, 1008)
+
+    @gen_test
+    async def test_audio_without_room_is_dropped(self):
+        relay = self.create(AudioRelay.DROP_OLDEST, max_queue=2)
+        await gen.sleep(0)
+        relay.feed(message(1))
+        await gen.sleep(0)
+        relay.feed(message(1))
+        relay.feed(message(1))
+
+        relay.feed(message(SNAPCAST_WIRE_CHUNK))
+
+        self.assertFalse(relay.closed)
+        self.assertEqual(relay.dropped, 1)
+        self.assertEqual(len(relay.queue), 2)
+
+    @gen_test
+    async def test_disconnect_policy(self):
+        relay = self.create(AudioRelay.DISCONNECT)
+        await gen.sleep(0)
+        for idx in range(5):
+            relay.feed(message(SNAPCAST_WIRE_CHUNK))
+            await gen.sleep(0)
+
+        self.assertTrue(relay.closed)
+        self.assertEqual(self.client.close_code, 1008)
+        self.assertEqual(relay.queued_bytes, 0)
+        self.assertEqual(relay.dropped, 0)
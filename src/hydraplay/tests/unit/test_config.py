@@ -0,0 +1,176 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from hydraplay.config import Config, ConfigError, SectionReader, Settings, merge_patch
+
+
+def settings_content():
+    return {
+        'hydraplay': {'port': 8080, 'cookie_secret': "secret"},
+        'mopidy': {'instances': 2, 'extensions': {'tunein': {'enabled': True, 'timeout': 5000}}},
+        'snapcast_server': {'additional_streams': []}
+    }
+
+
+class SectionReaderTest(unittest.TestCase):
+
+    def test_defaults_and_values(self):
+        reader = SectionReader('hydraplay', {'port': 9000})
+
+        self.assertEqual(reader.port('port', 8080), 9000)
+        self.assertEqual(reader.integer('workers', 1, minimum=1), 1)
+
+    def test_errors_name_the_option(self):
+        reader = SectionReader('mopidy', {'instances': 0, 'data_dir': "", 'enabled': "yes"})
+
+        with self.assertRaisesRegex(ConfigError, r"^mopidy\.instances must be an integer >= 1, got 0$"):
+            reader.integer('instances', minimum=1)
+        with self.assertRaisesRegex(ConfigError, r"^mopidy\.data_dir must be a non-empty string"):
+            reader.string('data_dir')
+        with self.assertRaisesRegex(ConfigError, r"^mopidy\.enabled must be true or false"):
+            reader.flag('enabled')
+        with self.assertRaisesRegex(ConfigError, r"^mopidy\.config_path is missing$"):
+            reader.string('config_path')
+
+    def test_booleans_are_not_integers(self):
+        with self.assertRaises(ConfigError):
+            SectionReader('hydraplay', {'port': True}).port('port')
+
+    def test_flags_of_older_configs(self):
+        reader = SectionReader('hydraplay', {'use_ws_proxy': "true", 'uvloop': "false"})
+
+        self.assertIs(reader.flag('use_ws_proxy'), True)
+        self.assertIs(reader.flag('uvloop'), False)
+
+    def test_choices(self):
+        reader = SectionReader('snapcast_server', {'codec': "opus:48000", 'other': "mp3"})
+
+        self.assertEqual(reader.string('codec', choices=("flac", "opus")), "opus:48000")
+        with self.assertRaisesRegex(ConfigError, "one of flac, opus"):
+            reader.string('other', choices=("flac", "opus"))
+
+    def test_options_must_not_break_lines(self):
+        reader = SectionReader('mopidy.extensions.tunein', {'timeout': 5000, 'name': "a b", 'evil': "1\n[core]"})
+
+        self.assertEqual(reader.option('timeout'), 5000)
+        self.assertEqual(reader.option('name'), "a b")
+        with self.assertRaises(ConfigError):
+            reader.option('evil')
+
+    def test_names(self):
+        SectionReader('mopidy.extensions', {'local-images': {}, 'tune_in2': {}}).check_names()
+        with self.assertRaisesRegex(ConfigError, r"mopidy\.extensions\.tune\]in is not a valid name"):
+            SectionReader('mopidy.extensions', {'tune]in': {}}).check_names()
+
+    def test_section_must_be_an_object(self):
+        with self.assertRaisesRegex(ConfigError, r"^hydraplay\.websocket must be an object"):
+            SectionReader('hydraplay', {'websocket': [1]}).section('websocket')
+
+
+class SettingsTest(unittest.TestCase):
+
+    def test_read(self):
+        settings = Settings.read(settings_content())
+
+        self.assertEqual(settings.hydraplay.coordinator_port, 8081)
+        self.assertEqual(settings.mopidy.instances, 2)
+        self.assertEqual(settings.mopidy.extensions['tunein']['timeout'], 5000)
+        self.assertIsNone(settings.mopidy.elastic)
+        self.assertEqual(settings.snapcast_server.codec, "flac")
+
+    def test_settings_are_frozen(self):
+        settings = Settings.read(settings_content())
+
+        with self.assertRaises(AttributeError):
+            settings.mopidy.instances = 3
+        with self.assertRaises(TypeError):
+            settings.mopidy.extensions['tunein']['timeout'] = 1
+
+    def test_invalid_extension_option(self):
+        content = settings_content()
+        content['mopidy']['extensions']['tunein']['timeout'] = {'nested': 1}
+
+        with self.assertRaisesRegex(ConfigError, r"mopidy\.extensions\.tunein\.timeout"):
+            Settings.read(content)
+
+    def test_invalid_stream(self):
+        content = settings_content()
+        content['snapcast_server']['additional_streams'] = [{'label': "Radio", 'source_type': "pipe"}]
+
+        with self.assertRaisesRegex(ConfigError, r"snapcast_server\.additional_streams\[0\]\.source_type"):
+            Settings.read(content)
+
+    def test_coordinator_port_must_differ(self):
+        content = settings_content()
+        content['hydraplay'].update(workers=2, coordinator_port=8080)
+
+        with self.assertRaises(ConfigError):
+            Settings.read(content)
+
+
+class MergePatchTest(unittest.TestCase):
+
+    def test_merge(self):
+        content = {'a': {'b': 1, 'c': 2}, 'd': [1, 2]}
+
+        merged = merge_patch(content, {'a': {'b': 3, 'c': None}, 'd': [3], 'e': {'f': None}})
+
+        self.assertEqual(merged, {'a': {'b': 3}, 'd': [3], 'e': {}})
+        self.assertEqual(content, {'a': {'b': 1, 'c': 2}, 'd': [1, 2]})
+
+    def test_patch_which_is_not_an_object_replaces(self):
+        self.assertEqual(merge_patch({'a': 1}, [1]), [1])
+
+
+class ConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, "hydra.config.json")
+        with open(self.file_name, "w") as file:
+            json.dump(settings_content(), file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_update_keeps_the_old_settings_when_invalid(self):
+        config = Config(self.file_name)
+        content = settings_content()
+        content['mopidy']['instances'] = "3"
+
+        with self.assertRaises(ConfigError):
+            config.update(content)
+
+        self.assertEqual(config.mopidy.instances, 2)
+        self.assertEqual(config.version, 0)
+
+    def test_update_and_save(self):
+        config = Config(self.file_name)
+        content = merge_patch(config.content, {'mopidy': {'instances': 3}})
+
+        config.update(content)
+        config.save_json()
+
+        self.assertEqual(config.version, 1)
+        self.assertEqual(Config(self.file_name).mopidy.instances, 3)
+
+    def test_restore(self):
+        config = Config(self.file_name)
+        previous = (config.content, config.settings, config.version)
+        config.update(merge_patch(config.content, {'mopidy': {'instances': 3}}))
+
+        config.restore(*previous)
+
+        self.assertEqual(config.mopidy.instances, 2)
+        self.assertEqual(config.content['mopidy']['instances'], 2)
+        self.assertEqual(config.version, 0)
+
+    def test_invalid_json_names_the_line(self):
+        with open(self.file_name, "w") as file:
+            file.write('{\n"hydraplay": }')
+
+        with self.assertRaisesRegex(ConfigError, "line 2"):
+            Config(self.file_name)
@@ -0,0 +1,261 @@
+import json
+
+from tornado import gen, queues
+from tornado.testing import AsyncTestCase, gen_test
+
+from hydraplay.config import CommandShapingSettings
+from hydraplay.server.JsonRpcHub import JsonRpcHub
+
+
+class FakeUpstream:
+    """Upstream websocket, the test reads what the hub sent and answers with receive()."""
+
+    def __init__(self):
+        self.sent = []
+        self.incoming = queues.Queue()
+
+    def write_message(self, message):
+        self.sent.append(json.loads(message))
+
+    async def read_message(self):
+        return await self.incoming.get()
+
+    def receive(self, message):
+        self.incoming.put_nowait(json.dumps(message))
+
+    def close(self):
+        self.incoming.put_nowait(None)
+
+
+class FakeConnector:
+
+    def __init__(self):
+        self.upstream = FakeUpstream()
+        self.options = None
+
+    async def connect(self, uri, **options):
+        self.options = options
+        return self.upstream
+
+
+class FakeSubscriber:
+
+    def __init__(self):
+        self.messages = []
+        self.close_code = None
+
+    def write_message(self, message):
+        self.messages.append(json.loads(message))
+
+    def close(self, code=None, reason=None):
+        self.close_code = code
+
+
+class HubTestCase(AsyncTestCase):
+
+    hub_class = JsonRpcHub
+
+    def setUp(self):
+        super().setUp()
+        self.connector = FakeConnector()
+        self.upstream = self.connector.upstream
+        self.hub = self.create_hub()
+
+    def create_hub(self):
+        return self.hub_class("ws://upstream", self.connector)
+
+    async def subscribe(self, batches=False):
+        subscriber = FakeSubscriber()
+        await self.hub.subscribe(subscriber, batches)
+        return subscriber
+
+    def request(self, subscriber, method, request_id, params=None):
+        request = {'jsonrpc': '2.0', 'id': request_id, 'method': method}
+        if params is not None:
+            request['params'] = params
+        self.hub.send(subscriber, json.dumps(request))
+
+    async def respond(self, request, result):
+        self.upstream.receive({'jsonrpc': '2.0', 'id': request['id'], 'result': result})
+        await gen.sleep(0)
+
+
+class CoalescingHub(JsonRpcHub):
+    coalesce_methods = frozenset(['get_status'])
+    shaped_methods = frozenset(['set_volume'])
+
+
+class JsonRpcHubTest(HubTestCase):
+
+    hub_class = CoalescingHub
+
+    @gen_test
+    async def test_ids_are_rewritten_and_routed_back(self):
+        first = await self.subscribe()
+        second = await self.subscribe()
+        self.request(first, 'play', 1)
+        self.request(second, 'play', 1)
+
+        self.assertEqual([request['id'] for request in self.upstream.sent], [1, 2])
+        await self.respond(self.upstream.sent[1], "second")
+        await self.respond(self.upstream.sent[0], "first")
+
+        self.assertEqual(first.messages, [{'jsonrpc': '2.0', 'id': 1, 'result': "first"}])
+        self.assertEqual(second.messages, [{'jsonrpc': '2.0', 'id': 1, 'result': "second"}])
+        self.assertEqual(self.hub.pending, {})
+
+    @gen_test
+    async def test_notifications_go_to_every_subscriber(self):
+        first = await self.subscribe()
+        second = await self.subscribe()
+
+        self.upstream.receive({'jsonrpc': '2.0', 'method': 'on_update', 'params': {}})
+        await gen.sleep(0)
+
+        self.assertEqual(first.messages, second.messages)
+        self.assertEqual(first.messages[0]['method'], 'on_update')
+
+    @gen_test
+    async def test_batch_requests_are_split(self):
+        subscriber = await self.subscribe()
+
+        self.hub.send(subscriber, json.dumps([{'jsonrpc': '2.0', 'id': 7, 'method': 'play'},
+                                              {'jsonrpc': '2.0', 'method': 'ping'}, "junk"]))
+
+        self.assertEqual(self.upstream.sent, [{'jsonrpc': '2.0', 'id': 1, 'method': 'play'},
+                                              {'jsonrpc': '2.0', 'method': 'ping'}])
+
+    @gen_test
+    async def test_upstream_batch_responses_are_routed(self):
+        subscriber = await self.subscribe()
+        self.request(subscriber, 'play', 'a')
+        self.request(subscriber, 'pause', 'b')
+
+        self.upstream.receive([{'jsonrpc': '2.0', 'id': 2, 'result': "paused"},
+                               {'jsonrpc': '2.0', 'id': 1, 'result': "playing"}])
+        await gen.sleep(0)
+
+        self.assertEqual([(message['id'], message['result']) for message in subscriber.messages],
+                         [('b', "paused"), ('a', "playing")])
+
+    @gen_test
+    async def test_identical_requests_are_coalesced(self):
+        first = await self.subscribe()
+        second = await self.subscribe()
+        self.request(first, 'get_status', 1)
+        self.request(second, 'get_status', 5)
+        self.request(second, 'get_status', 6, params={'id': "other"})
+
+        self.assertEqual(len(self.upstream.sent), 2)
+        await self.respond(self.upstream.sent[0], "status")
+
+        self.assertEqual(first.messages, [{'jsonrpc': '2.0', 'id': 1, 'result': "status"}])
+        self.assertEqual(second.messages, [{'jsonrpc': '2.0', 'id': 5, 'result': "status"}])
+        self.assertEqual(list(self.hub.inflight), [('get_status', '{"id": "other"}')])
+
+    @gen_test
+    async def test_call_joins_a_request_in_flight(self):
+        subscriber = await self.subscribe()
+        self.request(subscriber, 'get_status', 1)
+
+        future = self.hub.call('get_status')
+        await self.respond(self.upstream.sent[0], "status")
+
+        self.assertEqual(len(self.upstream.sent), 1)
+        self.assertEqual((await future)['result'], "status")
+
+    @gen_test
+    async def test_commands_are_shaped(self):
+        self.hub.set_command_shaping(CommandShapingSettings(coalesce_window=0.05, rate=0, burst=1))
+        first = await self.subscribe()
+        second = await self.subscribe()
+        self.request(first, 'set_volume', 1, {'volume': 10})
+        self.request(first, 'set_volume', 2, {'volume': 20})
+        self.request(second, 'set_volume', 3, {'volume': 30})
+
+        self.assertEqual([request['params'] for request in self.upstream.sent], [{'volume': 10}])
+        await gen.sleep(0.1)
+        self.assertEqual([request['params'] for request in self.upstream.sent], [{'volume': 10}, {'volume': 30}])
+        self.assertEqual(self.hub.coalesced, 1)
+
+        await self.respond(self.upstream.sent[0], 10)
+        await self.respond(self.upstream.sent[1], 30)
+
+        # the superseded command is answered with the response of the one sent in its place
+        self.assertEqual(first.messages, [{'jsonrpc': '2.0', 'id': 1, 'result': 10},
+                                          {'jsonrpc': '2.0', 'id': 2, 'result': 30}])
+        self.assertEqual(second.messages, [{'jsonrpc': '2.0', 'id': 3, 'result': 30}])
+
+    @gen_test
+    async def test_requests_above_the_rate_get_an_error(self):
+        self.hub.set_command_shaping(CommandShapingSettings(coalesce_window=0, rate=1, burst=2))
+        subscriber = await self.subscribe()
+        other = await self.subscribe()
+        for request_id in range(3):
+            self.request(subscriber, 'play', request_id)
+        self.request(other, 'play', 9)
+
+        self.assertEqual(len(self.upstream.sent), 3)
+        self.assertEqual(subscriber.messages, [{'jsonrpc': '2.0', 'id': 2, 'error': JsonRpcHub.RATE_LIMIT_ERROR}])
+        self.assertEqual(self.hub.rate_limited, 1)
+
+    @gen_test
+    async def test_request_without_upstream_gets_an_error(self):
+        subscriber = await self.subscribe()
+        self.hub.connection = None
+
+        self.request(subscriber, 'play', 1)
+
+        self.assertEqual(subscriber.messages, [{'jsonrpc': '2.0', 'id': 1, 'error': JsonRpcHub.UNAVAILABLE_ERROR}])
+        self.assertEqual(self.hub.pending, {})
+
+    @gen_test
+    async def test_disconnect_closes_the_subscribers(self):
+        subscriber = await self.subscribe()
+        self.request(subscriber, 'get_status', 1)
+        future = self.hub.call('get_status')
+
+        self.upstream.close()
+        await gen.sleep(0)
+
+        self.assertEqual(subscriber.close_code, 1012)
+        self.assertTrue(future.cancelled())
+        self.assertIsNone(self.hub.connection)
+        self.assertEqual((self.hub.pending, self.hub.inflight, self.hub.subscribers), ({}, {}, set()))
+
+
+class BatchingHubTest(HubTestCase):
+
+    def create_hub(self):
+        hub = JsonRpcHub("ws://upstream", self.connector)
+        hub.batch_window = 0.05
+        return hub
+
+    def notify(self, idx):
+        self.upstream.receive({'jsonrpc': '2.0', 'method': 'on_update', 'params': {'idx': idx}})
+
+    @gen_test
+    async def test_notifications_are_batched_for_subscribers_which_ask(self):
+        batched = await self.subscribe(batches=True)
+        single = await self.subscribe()
+        for idx in range(3):
+            self.notify(idx)
+        await gen.sleep(0)
+
+        self.assertEqual(batched.messages, [])
+        self.assertEqual(len(single.messages), 3)
+        await gen.sleep(0.1)
+
+        self.assertEqual(len(batched.messages), 1)
+        self.assertEqual([entry['params']['idx'] for entry in batched.messages[0]], [0, 1, 2])
+        self.assertEqual(self.hub.batches, 1)
+
+    @gen_test
+    async def test_a_reply_flushes_the_batch_first(self):
+        subscriber = await self.subscribe(batches=True)
+        self.request(subscriber, 'play', 1)
+        self.notify(0)
+        await self.respond(self.upstream.sent[0], "ok")
+
+        self.assertEqual(subscriber.messages[0]['method'], 'on_update')
+        self.assertEqual(subscriber.messages[1], {'jsonrpc': '2.0', 'id': 1, 'result': "ok"})
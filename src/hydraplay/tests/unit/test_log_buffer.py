@@ -0,0 +1,69 @@
+import logging
+import unittest
+
+from hydraplay.server.LogBuffer import LogBuffer, LogFilter
+
+
+class LogBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = LogBuffer(max_bytes=3 * (LogBuffer.ENTRY_OVERHEAD + 1))
+
+    def messages(self, entries):
+        return [entry[4] for entry in entries]
+
+    def test_sources_are_bounded_separately(self):
+        for idx in range(5):
+            self.buffer.append("Mopidy_0", 0.0, logging.INFO, str(idx))
+        self.buffer.append("HydraPlay", 0.0, logging.INFO, "x")
+
+        entries, last = self.buffer.read(LogFilter())
+
+        self.assertEqual(self.messages(entries), ["2", "3", "4", "x"])
+        self.assertEqual(last, 6)
+        self.assertEqual(self.buffer.stats()['Mopidy_0'], {'lines': 3, 'bytes': 3 * (LogBuffer.ENTRY_OVERHEAD + 1),
+                                                           'dropped': 2})
+
+    def test_a_long_line_is_kept(self):
+        self.buffer.append("Mopidy_0", 0.0, logging.INFO, "x" * 1000)
+
+        entries, last = self.buffer.read(LogFilter())
+
+        self.assertEqual(len(entries), 1)
+
+    def test_read_after_and_limit(self):
+        for idx in range(3):
+            self.buffer.append("Mopidy_0", 0.0, logging.INFO, str(idx))
+            self.buffer.append("Mopidy_1", 0.0, logging.INFO, str(idx))
+
+        entries, last = self.buffer.read(LogFilter(), after=2, limit=3)
+
+        self.assertEqual([entry[0] for entry in entries], [4, 5, 6])
+        self.assertEqual(self.buffer.read(LogFilter(), after=2, limit=0)[0], [])
+
+    def test_filter(self):
+        self.buffer.append("Mopidy_0", 0.0, logging.INFO, "Playing Radio")
+        self.buffer.append("Mopidy_0", 0.0, logging.ERROR, "radio failed")
+        self.buffer.append("Mopidy_1", 0.0, logging.ERROR, "Radio failed")
+
+        entries, last = self.buffer.read(LogFilter(["Mopidy_0"], logging.WARNING, "RADIO"))
+
+        self.assertEqual(self.messages(entries), ["radio failed"])
+
+    def test_source_of_a_record(self):
+        self.assertEqual(self.buffer.get_source("hydraplay.server.Executor.Mopidy_0"), "Mopidy_0")
+        self.assertEqual(self.buffer.get_source("hydraplay.server.HydraServer"), LogBuffer.OWN_SOURCE)
+
+    def test_collects_log_records(self):
+        logger = logging.getLogger("hydraplay.server.Executor.Snapcast Server")
+        logger.setLevel(logging.INFO)
+        self.buffer.start()
+        try:
+            logger.info("started")
+        finally:
+            self.buffer.stop()
+            logger.setLevel(logging.NOTSET)
+
+        entries, last = self.buffer.read(LogFilter())
+
+        self.assertEqual(entries[0][2:], ("Snapcast Server", logging.INFO, "started"))
@@ -0,0 +1,48 @@
+import logging
+import unittest
+
+from hydraplay.server.LogPipeline import LogThrottle
+
+
+class LogThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.throttle = LogThrottle(1, 2, clock=lambda: self.now)
+
+    def test_repeated_lines_are_summarized(self):
+        self.assertEqual(self.throttle.filter(logging.INFO, "a"), [(logging.INFO, "a")])
+        self.assertEqual(self.throttle.filter(logging.INFO, "a"), [])
+        self.assertEqual(self.throttle.filter(logging.INFO, "a"), [])
+
+        self.assertEqual(self.throttle.filter(logging.INFO, "b"),
+                         [(logging.WARNING, "2 repeated lines suppressed"), (logging.INFO, "b")])
+        self.assertEqual(self.throttle.stats(), {'repeated': 2, 'rate_limited': 0})
+
+    def test_lines_above_the_rate_are_dropped(self):
+        entries = [self.throttle.filter(logging.INFO, str(idx)) for idx in range(4)]
+
+        self.assertEqual(entries, [[(logging.INFO, "0")], [(logging.INFO, "1")], [], []])
+        self.now = 1.0
+        self.assertEqual(self.throttle.filter(logging.INFO, "4"),
+                         [(logging.WARNING, "2 lines suppressed by the rate limit"), (logging.INFO, "4")])
+
+    def test_errors_always_pass(self):
+        for idx in range(2):
+            self.throttle.filter(logging.INFO, str(idx))
+
+        self.assertEqual(self.throttle.filter(logging.ERROR, "failed"), [(logging.ERROR, "failed")])
+
+    def test_summary_while_suppressing(self):
+        self.throttle.filter(logging.INFO, "a")
+        self.throttle.filter(logging.INFO, "a")
+        self.now = LogThrottle.SUMMARY_INTERVAL
+
+        self.assertEqual(self.throttle.filter(logging.INFO, "a"), [(logging.WARNING, "2 repeated lines suppressed")])
+        self.assertEqual(self.throttle.flush(), [])
+
+    def test_flush_logs_the_rest(self):
+        self.throttle.filter(logging.INFO, "a")
+        self.throttle.filter(logging.INFO, "a")
+
+        self.assertEqual(self.throttle.flush(), [(logging.WARNING, "1 repeated lines suppressed")])
@@ -0,0 +1,142 @@
+from tornado import gen
+from tornado.testing import gen_test
+
+from hydraplay.server.MopidyEventMux import MopidyEventMux
+from hydraplay.tests.unit.test_json_rpc_hub import HubTestCase
+
+
+class MopidyEventMuxTest(HubTestCase):
+
+    def create_hub(self):
+        return MopidyEventMux(0, 6680, self.connector)
+
+    def sent(self, method):
+        return [request for request in self.upstream.sent if request['method'] == method]
+
+    async def prefetch(self):
+        """Answers the getters sent when the mux connected."""
+        subscriber = await self.subscribe()
+        results = {'core.playback.get_state': 'playing', 'core.playback.get_time_position': 1000}
+        for request in list(self.upstream.sent):
+            result = results.get(request['method'], request['method'])
+            self.upstream.receive({'jsonrpc': '2.0', 'id': request['id'], 'result': result})
+        await gen.sleep(0)
+        self.upstream.sent.clear()
+        return subscriber
+
+    def event(self, event, **params):
+        self.upstream.receive(dict(params, event=event))
+
+    @gen_test
+    async def test_getters_are_answered_from_the_snapshot(self):
+        subscriber = await self.prefetch()
+
+        self.request(subscriber, 'core.playback.get_state', 1)
+        self.request(subscriber, 'core.mixer.get_volume', 2)
+
+        self.assertEqual(self.upstream.sent, [])
+        self.assertEqual([message['result'] for message in subscriber.messages],
+                         ['playing', 'core.mixer.get_volume'])
+        self.assertEqual(self.hub.answered_from_snapshot, 2)
+
+    @gen_test
+    async def test_events_update_the_snapshot(self):
+        subscriber = await self.prefetch()
+        self.event('volume_changed', volume=40)
+        self.event('playback_state_changed', old_state='playing', new_state='paused')
+        await gen.sleep(0)
+
+        self.request(subscriber, 'core.mixer.get_volume', 1)
+        self.request(subscriber, 'core.playback.get_state', 2)
+
+        self.assertEqual([message['result'] for message in subscriber.messages[-2:]], [40, 'paused'])
+
+    @gen_test
+    async def test_time_position_is_estimated(self):
+        subscriber = await self.prefetch()
+
+        self.request(subscriber, 'core.playback.get_time_position', 1)
+        self.event('seeked', time_position=5000)
+        self.event('playback_state_changed', old_state='playing', new_state='paused')
+        await gen.sleep(0)
+        self.request(subscriber, 'core.playback.get_time_position', 2)
+
+        self.assertEqual(self.upstream.sent, [])
+        self.assertGreaterEqual(subscriber.messages[0]['result'], 1000)
+        self.assertGreaterEqual(subscriber.messages[-1]['result'], 5000)
+        self.assertLess(subscriber.messages[-1]['result'], 6000)
+
+    @gen_test
+    async def test_tracklist_is_fetched_again_after_a_change(self):
+        subscriber = await self.prefetch()
+
+        self.event('tracklist_changed')
+        await gen.sleep(0)
+
+        self.assertNotIn('core.tracklist.get_tl_tracks', self.hub.snapshot)
+        self.assertEqual(len(self.sent('core.tracklist.get_tl_tracks')), 1)
+        self.request(subscriber, 'core.tracklist.get_tl_tracks', 1)
+        # joins the call in flight instead of sending another one
+        self.assertEqual(len(self.sent('core.tracklist.get_tl_tracks')), 1)
+
+    @gen_test
+    async def test_command_invalidates_its_namespace(self):
+        subscriber = await self.prefetch()
+
+        self.request(subscriber, 'core.mixer.set_mute', 1, {'mute': True})
+
+        self.assertNotIn('core.mixer.get_mute', self.hub.snapshot)
+        self.assertNotIn('core.mixer.get_volume', self.hub.snapshot)
+        self.assertIn('core.playback.get_state', self.hub.snapshot)
+
+    @gen_test
+    async def test_response_from_an_older_generation_is_not_kept(self):
+        subscriber = await self.prefetch()
+        self.event('options_changed')
+        await gen.sleep(0)
+        self.request(subscriber, 'core.tracklist.get_repeat', 1)
+        request = self.sent('core.tracklist.get_repeat')[0]
+
+        # the options change again while the getter is in flight
+        self.event('options_changed')
+        await gen.sleep(0)
+        await self.respond(request, False)
+
+        self.assertEqual(subscriber.messages[-1], {'jsonrpc': '2.0', 'id': 1, 'result': False})
+        self.assertNotIn('core.tracklist.get_repeat', self.hub.snapshot)
+        self.assertEqual(self.hub.stale_fills, 1)
+        self.assertEqual(self.hub.fill_generations, {})
+
+    @gen_test
+    async def test_response_of_the_current_generation_is_kept(self):
+        subscriber = await self.prefetch()
+        self.event('options_changed')
+        await gen.sleep(0)
+        self.request(subscriber, 'core.tracklist.get_repeat', 1)
+
+        await self.respond(self.sent('core.tracklist.get_repeat')[0], True)
+
+        self.assertIs(self.hub.snapshot['core.tracklist.get_repeat'], True)
+        self.assertEqual(self.hub.stale_fills, 0)
+
+    @gen_test
+    async def test_lookups_are_cached_by_parameters(self):
+        subscriber = await self.prefetch()
+        params = {'uris': ["local:track:a.mp3"]}
+        self.request(subscriber, 'core.library.get_images', 1, params)
+        await self.respond(self.upstream.sent[0], {'local:track:a.mp3': []})
+
+        self.request(subscriber, 'core.library.get_images', 2, params)
+
+        self.assertEqual(len(self.upstream.sent), 1)
+        self.assertEqual(subscriber.messages[-1], {'jsonrpc': '2.0', 'id': 2, 'result': {'local:track:a.mp3': []}})
+
+    @gen_test
+    async def test_disconnect_clears_the_snapshot(self):
+        await self.prefetch()
+
+        self.upstream.close()
+        await gen.sleep(0)
+
+        self.assertEqual(self.hub.snapshot, {})
+        self.assertIsNone(self.hub.position)
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from hydraplay.config import Config, ConfigError
+from hydraplay.server.Reconfigurator import Reconfigurator, SettingsConflict
+from hydraplay.tests.unit.test_config import settings_content
+
+
+class FakeSnapcastService:
+
+    def __init__(self):
+        self.reconfigured = 0
+
+    def render_config(self):
+        pass
+
+    async def reconfigure(self):
+        self.reconfigured += 1
+        return {'restarted': False}
+
+
+class FakeMopidyPool:
+
+    def __init__(self):
+        self.broken = False
+        self.reconfigured = 0
+
+    def render_mopidy_config(self, instance):
+        if self.broken:
+            raise RuntimeError("undefined variable")
+
+    async def reconfigure(self):
+        self.reconfigured += 1
+        return {'restarted': [0]}
+
+
+class ReconfiguratorTest(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, "hydra.config.json")
+        with open(self.file_name, "w") as file:
+            json.dump(settings_content(), file)
+        self.config = Config(self.file_name)
+        self.pool = FakeMopidyPool()
+        self.snapcast = FakeSnapcastService()
+        self.reconfigurator = Reconfigurator(self.config, self.pool, self.snapcast)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def saved(self):
+        with open(self.file_name) as file:
+            return json.load(file)
+
+    @gen_test
+    async def test_patch_is_merged_and_applied(self):
+        changes = await self.reconfigurator.apply({'mopidy': {'extensions': {'tunein': {'timeout': 3000}}}})
+
+        self.assertEqual(changes, {'snapcast': {'restarted': False}, 'mopidy': {'restarted': [0]},
+                                   'restart_required': []})
+        self.assertEqual(self.config.mopidy.extensions['tunein'], {'enabled': True, 'timeout': 3000})
+        self.assertEqual(self.config.version, 1)
+        self.assertEqual(self.saved()['mopidy']['extensions']['tunein']['timeout'], 3000)
+        self.assertEqual(self.saved()['hydraplay']['cookie_secret'], "secret")
+
+    @gen_test
+    async def test_port_change_needs_a_restart(self):
+        changes = await self.reconfigurator.apply({'hydraplay': {'port': 8090}})
+
+        self.assertEqual(changes['restart_required'], ['port'])
+
+    @gen_test
+    async def test_unchanged_settings_may_be_sent(self):
+        await self.reconfigurator.apply(settings_content())
+
+        self.assertEqual(self.config.version, 1)
+
+    @gen_test
+    async def test_only_writable_settings_can_be_changed(self):
+        for patch in ({'hydraplay': {'cookie_secret': "guessed"}}, {'mopidy': {'data_dir': "/etc"}},
+                      {'snapcast_server': {'additional_streams': [{'label': "x", 'source_type': "fifo"}]}},
+                      {'hydraplay': None}):
+            with self.assertRaisesRegex(ConfigError, "can not be changed over the API"):
+                await self.reconfigurator.apply(patch)
+
+        self.assertEqual(self.config.version, 0)
+        self.assertEqual(self.pool.reconfigured, 0)
+
+    @gen_test
+    async def test_invalid_settings_are_rejected(self):
+        with self.assertRaisesRegex(ConfigError, r"mopidy\.extensions\.tunein\.timeout"):
+            await self.reconfigurator.apply({'mopidy': {'extensions': {'tunein': {'timeout': "1\n[core]"}}}})
+        with self.assertRaises(ConfigError):
+            await self.reconfigurator.apply([1])
+
+        self.assertEqual(self.config.version, 0)
+
+    @gen_test
+    async def test_render_error_rolls_back(self):
+        self.pool.broken = True
+
+        with self.assertRaisesRegex(ConfigError, "can not be rendered"):
+            await self.reconfigurator.apply({'mopidy': {'instances': 3}})
+
+        self.assertEqual(self.config.mopidy.instances, 2)
+        self.assertEqual(self.config.content['mopidy']['instances'], 2)
+        self.assertEqual(self.config.version, 0)
+        self.assertEqual(self.saved()['mopidy']['instances'], 2)
+        self.assertEqual(self.snapcast.reconfigured, 0)
+
+    @gen_test
+    async def test_outdated_version_is_a_conflict(self):
+        await self.reconfigurator.apply({'mopidy': {'instances': 3}}, expected_version=0)
+
+        with self.assertRaises(SettingsConflict):
+            await self.reconfigurator.apply({'mopidy': {'instances': 4}}, expected_version=0)
+
+        self.assertEqual(self.config.mopidy.instances, 3)
@@ -0,0 +1,164 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application
+
+from hydraplay.server.StaticAssetCache import StaticAssetCache
+from hydraplay.server.handler.StaticFileHandler import StaticFileHandler
+
+
+class StaticAssetCacheTest(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super().tearDown()
+
+    def write(self, name, body):
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as file:
+            file.write(body)
+        return path
+
+    @gen_test
+    async def test_concurrent_misses_share_one_read(self):
+        cache = StaticAssetCache()
+        path = self.write("app.js", b"x" * 100000)
+
+        assets = await gen.multi([cache.get(path) for _ in range(5)])
+
+        self.assertTrue(all(asset is assets[0] for asset in assets))
+        self.assertEqual(len(cache.entries), 1)
+        self.assertEqual(cache.size, 100000)
+        self.assertEqual(cache.loading, {})
+        cache.remove(path)
+        self.assertEqual(cache.size, 0)
+
+    @gen_test
+    async def test_concurrent_variants_are_counted_once(self):
+        cache = StaticAssetCache()
+        path = self.write("app.js", b"var a = 1;\n" * 1000)
+        asset = await cache.get(path)
+
+        variants = await gen.multi([cache.get_variant(asset, 'gzip') for _ in range(3)])
+
+        self.assertTrue(all(variant is variants[0] for variant in variants))
+        self.assertEqual(cache.size, len(asset.body) + len(variants[0]))
+
+    @gen_test
+    async def test_replaced_entry_is_not_counted(self):
+        cache = StaticAssetCache()
+        path = self.write("app.js", b"var a = 1;\n" * 1000)
+        asset = await cache.get(path)
+        await cache.get_variant(asset, 'gzip')
+
+        cache.add(await cache.read_asset(path))
+
+        self.assertEqual(len(cache.entries), 1)
+        self.assertEqual(cache.size, len(asset.body))
+
+    @gen_test
+    async def test_least_recently_used_entry_is_evicted(self):
+        cache = StaticAssetCache(max_size=250)
+        first = self.write("first.bin", b"1" * 100)
+        second = self.write("second.bin", b"2" * 100)
+        third = self.write("third.bin", b"3" * 100)
+
+        await cache.get(first)
+        await cache.get(second)
+        await cache.get(first)
+        await cache.get(third)
+
+        self.assertEqual(list(cache.entries), [first, third])
+        self.assertEqual(cache.size, 200)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    @gen_test
+    async def test_big_files_are_not_kept_in_memory(self):
+        cache = StaticAssetCache(max_file_size=10)
+        path = self.write("big.bin", b"x" * 100)
+
+        asset = await cache.get(path)
+
+        self.assertIsNone(asset.body)
+        self.assertEqual(asset.size, 100)
+        self.assertEqual(cache.size, 0)
+
+    @gen_test
+    async def test_changed_file_is_reloaded(self):
+        cache = StaticAssetCache(revalidate_interval=0)
+        path = self.write("app.js", b"var a = 1;")
+        asset = await cache.get(path)
+        self.write("app.js", b"var a = 22;")
+
+        changed = await cache.get(path)
+
+        self.assertIsNot(changed, asset)
+        self.assertEqual(changed.body, b"var a = 22;")
+        self.assertNotEqual(changed.etag(), asset.etag())
+        self.assertEqual(cache.size, len(changed.body))
+
+
+class StaticFileHandlerTest(AsyncHTTPTestCase):
+
+    BODY = b"var answer = 42;\n" * 200
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, "app.js"), "wb") as file:
+            file.write(self.BODY)
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.root)
+
+    def get_app(self):
+        return Application([(r"/(.*)", StaticFileHandler, {"path": self.root, "cache": StaticAssetCache()})])
+
+    def test_range_is_served_from_the_identity_body(self):
+        response = self.fetch("/app.js", headers={"Range": "bytes=4-9", "Accept-Encoding": "gzip"},
+                              decompress_response=False)
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, self.BODY[4:10])
+        self.assertEqual(response.headers["Content-Range"], "bytes 4-9/{0}".format(len(self.BODY)))
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_suffix_range(self):
+        response = self.fetch("/app.js", headers={"Range": "bytes=-5"})
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, self.BODY[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.fetch("/app.js", headers={"Range": "bytes={0}-".format(len(self.BODY))})
+
+        self.assertEqual(response.code, 416)
+        self.assertEqual(response.headers["Content-Range"], "bytes */{0}".format(len(self.BODY)))
+
+    def test_etag_revalidation(self):
+        response = self.fetch("/app.js")
+        etag = response.headers["Etag"]
+
+        revalidated = self.fetch("/app.js", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, self.BODY)
+        self.assertEqual(revalidated.code, 304)
+
+    def test_compressed_variant_has_its_own_etag(self):
+        identity = self.fetch("/app.js", decompress_response=False)
+        response = self.fetch("/app.js", headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertNotEqual(response.headers["Etag"], identity.headers["Etag"])
+        self.assertEqual(gzip.decompress(response.body), self.BODY)
@@ -0,0 +1,33 @@
+import unittest
+
+from hydraplay.server.TokenBucket import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(2, 3, clock=lambda: 0.0)
+
+        self.assertEqual([bucket.take(0.0) for _ in range(4)], [True, True, True, False])
+        self.assertFalse(bucket.take(0.25))
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+
+    def test_tokens_do_not_grow_beyond_burst(self):
+        bucket = TokenBucket(10, 2, clock=lambda: 0.0)
+
+        self.assertEqual([bucket.take(100.0) for _ in range(3)], [True, True, False])
+
+    def test_rate_zero_allows_everything(self):
+        bucket = TokenBucket(0, 1, clock=lambda: 0.0)
+
+        self.assertTrue(all(bucket.take(0.0) for _ in range(100)))
+
+    def test_uses_the_clock(self):
+        now = [0.0]
+        bucket = TokenBucket(1, 1, clock=lambda: now[0])
+
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        now[0] = 1.0
+        self.assertTrue(bucket.take())
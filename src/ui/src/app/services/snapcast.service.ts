@@ -96,7 +96,8 @@ export class SnapcastService {
     let wsUrl = `${this.wsProtocol}${this.snapcastHost}:${this.snapcastPort}/jsonrpc`;
 
     if (hydra_settings['hydraplay']['use_ws_proxy']) {
-       wsUrl = `${this.wsProtocol}${this.snapcastHost}/socket/control/jsonrpc`;
+       // the proxy may send bursts of notifications as one JSON-RPC batch
+       wsUrl = `${this.wsProtocol}${this.snapcastHost}/socket/control/jsonrpc?batch=true`;
     }
 
     return webSocket({
@@ -122,6 +123,11 @@ export class SnapcastService {
 
   private handleIncomingSnapcastEvent(message){
 
+     if (Array.isArray(message)){
+        message.forEach(entry => this.handleIncomingSnapcastEvent(entry));
+        return;
+     }
+
      if (message.hasOwnProperty('method')){
         console.log(message);
 